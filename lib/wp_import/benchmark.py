@@ -0,0 +1,323 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.benchmark
+
+This module measures the throughput of the import pipeline. It generates
+synthetic dump files and times every stage of the pipeline on synthetic or
+real dump files without touching the configured databases.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import gzip
+import logging
+import os
+import random
+import timeit
+
+import wp_import.mysql as wpi_mysql
+import wp_import.postgresql as wpi_psql
+import wp_import.utils as wpi_utils
+
+_log = logging.getLogger(__name__)
+
+DUMP_FILE_REGEX = \
+        r'(?P<language>[\w_]+)wiki-(?P<date>\d{8})-(?P<table>[\w_-]+).*'
+
+# column definitions as written by mysqldump
+SCHEMAS = {
+    'pagelinks': [
+        "`pl_from` int(8) unsigned NOT NULL default '0'",
+        "`pl_namespace` int(11) NOT NULL default '0'",
+        "`pl_title` varbinary(255) NOT NULL default ''",
+    ],
+    'categorylinks': [
+        "`cl_from` int(8) unsigned NOT NULL default '0'",
+        "`cl_to` varbinary(255) NOT NULL default ''",
+        "`cl_sortkey` varbinary(70) NOT NULL default ''",
+        "`cl_timestamp` timestamp NOT NULL",
+    ],
+    'langlinks': [
+        "`ll_from` int(8) unsigned NOT NULL default '0'",
+        "`ll_lang` varbinary(20) NOT NULL default ''",
+        "`ll_title` varbinary(255) NOT NULL default ''",
+    ],
+    'redirect': [
+        "`rd_from` int(8) unsigned NOT NULL default '0'",
+        "`rd_namespace` int(11) NOT NULL default '0'",
+        "`rd_title` varbinary(255) NOT NULL default ''",
+    ],
+}
+
+# column types of the temporary tables the postgresql sink loads into
+_PG_SCHEMAS = {
+    'pagelinks': 'pl_from integer, pl_namespace integer, pl_title text',
+    'categorylinks': 'cl_from integer, cl_to text, cl_sortkey text, '
+                     'cl_timestamp timestamp with time zone',
+    'langlinks': 'll_from integer, ll_lang text, ll_title text',
+    'redirect': 'rd_from integer, rd_namespace integer, rd_title text',
+}
+
+_WORDS = ['Holy', 'Grail', 'Camelot', "Knights_who_say_'Ni'", 'Shrubbery',
+          'P/NP問題', 'Linux内核', 'ASCII艺术', 'Back\\slash', 'Ελληνικά']
+
+_LANGUAGES = ['af', 'de', 'en', 'fr', 'ja', 'zh', 'zh-classical']
+
+
+def _title(rand):
+    return '_'.join(rand.choice(_WORDS)
+                    for i in range(rand.randint(1, 4))).encode('utf8')
+
+
+def _timestamp(rand):
+    return '{0:04d}{1:02d}{2:02d}{3:02d}{4:02d}{5:02d}'.format(
+        rand.randint(2001, 2009), rand.randint(1, 12), rand.randint(1, 28),
+        rand.randint(0, 23), rand.randint(0, 59), rand.randint(0, 59))
+
+
+def _quote(value):
+    """Quote a UTF-8 encoded string like mysqldump.
+    """
+    return b"'" + value.replace(b'\\', b'\\\\').replace(b"'", b"\\'") + b"'"
+
+
+def _row(table, rand, page_id, bad_utf8=False):
+    title = _title(rand)
+    if bad_utf8:
+        title += 'å'.encode('latin-1')
+
+    if table == 'categorylinks':
+        return b','.join([str(page_id).encode('ascii'), _quote(title),
+                          _quote(_title(rand)[:70]),
+                          _timestamp(rand).encode('ascii')])
+    if table == 'langlinks':
+        return b','.join([str(page_id).encode('ascii'),
+                          _quote(rand.choice(_LANGUAGES).encode('ascii')),
+                          _quote(title)])
+    return b','.join([str(page_id).encode('ascii'),
+                      str(rand.choice([0, 0, 0, 1, 4, 14])).encode('ascii'),
+                      _quote(title)])
+
+
+def synthetic_dump(path, table, rows, bad_utf8_every=1000,
+                   statement_size=1 << 20, seed=42):
+    """Write a gzip compressed synthetic dump file of given table.
+
+    The file looks like a MySQL dump published by the Wikimedia foundation:
+    A table definition followed by multirow INSERT statements of about
+    statement_size bytes.
+
+    :param table:           Table (pagelinks, categorylinks, langlinks,
+                            redirect)
+    :type table:            unicode
+
+    :param rows:            Number of rows
+    :type rows:             int
+
+    :param bad_utf8_every:  Every bad_utf8_every-th row contains a latin-1
+                            encoded string (0: never)
+    :type bad_utf8_every:   int
+    """
+    rand = random.Random(seed)
+    columns = ',\n  '.join(SCHEMAS[table])
+
+    with gzip.open(path, 'wb', 6) as dump_f:
+        dump_f.write('-- MySQL dump 10.11\n--\n'
+                     '-- Table structure for table `{0}`\n--\n\n'
+                     'DROP TABLE IF EXISTS `{0}`;\n'
+                     'CREATE TABLE `{0}` (\n  {1}\n) '
+                     'ENGINE=InnoDB DEFAULT CHARSET=binary;\n\n'
+                     'LOCK TABLES `{0}` WRITE;\n'
+                     '/*!40000 ALTER TABLE `{0}` DISABLE KEYS */;\n'.format(
+                         table, columns).encode('utf8'))
+
+        stmt = []
+        size = 0
+        for row_number in range(1, rows + 1):
+            row = _row(table, rand, row_number,
+                       bad_utf8_every and row_number % bad_utf8_every == 0)
+            stmt.append(row)
+            size += len(row) + 3
+            if size >= statement_size or row_number == rows:
+                dump_f.write('INSERT INTO `{0}` VALUES ('.format(
+                    table).encode('utf8'))
+                dump_f.write(b'),('.join(stmt))
+                dump_f.write(b');\n')
+                stmt = []
+                size = 0
+
+        dump_f.write('/*!40000 ALTER TABLE `{0}` ENABLE KEYS */;\n'
+                     'UNLOCK TABLES;\n\n'
+                     '-- Dump completed on 2009-09-03 13:13:58\n'.format(
+                         table).encode('utf8'))
+
+
+def synthetic_dumps(directory, rows, bad_utf8_every=1000):
+    """Write synthetic dumps of all tables in SCHEMAS into directory.
+
+    :returns:   Paths of the dump files
+    :rtype:     list
+    """
+    paths = []
+    for table in sorted(SCHEMAS):
+        path = os.path.join(directory,
+                            'benchwiki-20090101-{0}.sql.gz'.format(table))
+        _log.info('Generating {0} with {1:d} rows'.format(
+            os.path.basename(path), rows))
+        synthetic_dump(path, table, rows, bad_utf8_every)
+        paths.append(path)
+    return paths
+
+
+def _result(table, stage, seconds, size, rows):
+    seconds = max(seconds, 1e-9)
+    return {
+        'table': table,
+        'stage': stage,
+        'seconds': round(seconds, 6),
+        'bytes': size,
+        'rows': rows,
+        'mb_per_s': round(size / seconds / (1 << 20), 3),
+        'rows_per_s': round(rows / seconds, 1),
+    }
+
+
+def _timed(func, *args):
+    """Call func and materialise its result.
+
+    :returns:   The time func took and its result as a list
+    :rtype:     tuple
+    """
+    start = timeit.default_timer()
+    result = list(func(*args))
+    return (timeit.default_timer() - start, result)
+
+
+def _null_sink(statements):
+    for stmt in statements:
+        if isinstance(stmt, unicode):
+            stmt = stmt.encode('utf8')
+        yield len(stmt)
+
+
+def _postgresql_sink(pool, db_name, table):
+    """Get a sink that executes statements on a temporary table.
+
+    All changes are rolled back.
+    """
+
+    def sink(statements):
+        with pool.connection(db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('CREATE TEMPORARY TABLE "{0}" ({1})'.format(
+                table, _PG_SCHEMAS[table]))
+            for stmt in statements:
+                cursor.execute(stmt)
+                yield cursor.rowcount
+            cursor.close()
+
+    return sink
+
+
+def benchmark_dump(path, table, decompressor='auto', sink=None):
+    """Time every stage of the import pipeline on given dump file.
+
+    Every stage processes the materialised output of the previous stage, so
+    the times don't include the work of other stages. Complete pipelines
+    are timed as well.
+
+    :param table:           Table of the dump
+    :type table:            unicode
+
+    :param sink:            Callable that loads a sequence of statements
+                            (default: encode the statements and discard
+                            them)
+    :type sink:             callable
+
+    :returns:   Results with the keys table, stage, seconds, bytes, rows,
+                mb_per_s and rows_per_s
+    :rtype:     list
+    """
+    if sink is None:
+        sink = _null_sink
+
+    def read_lines(path):
+        with wpi_utils.open_compressed(path, decompressor) as dump_f:
+            for line in dump_f:
+                yield line
+
+    (seconds, lines) = _timed(read_lines, path)
+    size = sum(len(line) for line in lines)
+    rows = sum(sum(1 for row in wpi_mysql.values_rows(
+        stmt.decode('utf8', 'replace')))
+        for stmt in lines if stmt.startswith(b'INSERT'))
+
+    results = [_result(table, 'decompression', seconds, size, rows)]
+    timestamp_columns = wpi_mysql.timestamp_columns(
+        wpi_mysql.split_header(lines)[0])
+    stages = [
+        ('filter_strings',
+         lambda seq: wpi_utils.filter_strings(r'^INSERT', seq)),
+        ('convert_multirow_to_unicode',
+         wpi_utils.convert_multirow_to_unicode),
+        ('transform_insert',
+         lambda seq: (wpi_psql.transform_insert(el.strip(), timestamp_columns)
+                      for el in seq)),
+        ('load', sink),
+    ]
+
+    data = lines
+    for (stage, func) in stages:
+        (seconds, output) = _timed(func, data)
+        results.append(_result(table, stage, seconds, size, rows))
+        data = output
+    del lines, data
+
+    for (stage, func, args) in [
+        ('insert_statements', wpi_psql.insert_statements,
+         (path, decompressor)),
+        ('raw_insert_statements', wpi_psql.raw_insert_statements,
+         (path, decompressor)),
+        ('copy_rows', wpi_psql.copy_rows, (path, 'text', decompressor))]:
+        (seconds, output) = _timed(func, *args)
+        results.append(_result(table, stage, seconds, size, rows))
+
+    return results
+
+
+def run(paths, decompressor='auto', pool=None, db_name=None):
+    """Benchmark given dump files.
+
+    :param pool:    Connection pool of the database statements are loaded
+                    into (default: statements are discarded)
+    :type pool:     wp_import.loader.ConnectionPool
+
+    :returns:   Results of all dump files (see benchmark_dump)
+    :rtype:     list
+    """
+    results = []
+    for path in paths:
+        table = wpi_utils.DumpInfo(path, DUMP_FILE_REGEX).table
+        sink = None
+        if pool is not None:
+            sink = _postgresql_sink(pool, db_name, table)
+        _log.info('Benchmarking {0}'.format(os.path.basename(path)))
+        results.extend(benchmark_dump(path, table, decompressor, sink))
+    return results
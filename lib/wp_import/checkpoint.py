@@ -0,0 +1,139 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.checkpoint
+
+This module keeps track of the import progress of every table. Checkpoints
+are stored in a table within the target database and are written in the
+same transaction as the data they describe.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import collections
+import logging
+
+_log = logging.getLogger(__name__)
+
+CHECKPOINT_TABLE = 'wp_import_checkpoint'
+
+Checkpoint = collections.namedtuple(
+    'Checkpoint', 'table dump_date load_mode position completed')
+
+
+def create_table(cursor):
+    """Create the checkpoint table if it does not exist yet.
+
+    :param cursor:  psycopg2 cursor
+    :type cursor:   psycopg2.extensions.cursor
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS "{0}" (
+        table_name text NOT NULL,
+        dump_date text NOT NULL,
+        load_mode text NOT NULL,
+        position bigint NOT NULL DEFAULT 0,
+        completed boolean NOT NULL DEFAULT false,
+        PRIMARY KEY (table_name, dump_date))'''.format(CHECKPOINT_TABLE))
+
+
+def table_exists(cursor):
+    """Check whether the checkpoint table exists without creating it.
+
+    :param cursor:  psycopg2 cursor
+    :type cursor:   psycopg2.extensions.cursor
+
+    :rtype:     bool
+    """
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL',
+                   ('"{0}"'.format(CHECKPOINT_TABLE), ))
+    return cursor.fetchone()[0]
+
+
+def load(cursor, table, dump_date):
+    """Get the checkpoint of given table.
+
+    Nothing is written, so that imports can be planned without changing
+    the database.
+
+    :returns:   The checkpoint or None if there is none
+    :rtype:     Checkpoint
+    """
+    if not table_exists(cursor):
+        return None
+    cursor.execute(
+        'SELECT table_name, dump_date, load_mode, position, completed '
+        'FROM "{0}" WHERE table_name = %s AND dump_date = %s'.format(
+            CHECKPOINT_TABLE), (table, dump_date))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return Checkpoint(*row)
+
+
+def latest(cursor, table):
+    """Get the checkpoint of the newest complete import of given table.
+
+    :returns:   The checkpoint or None if the table was never imported
+                completely.
+    :rtype:     Checkpoint
+    """
+    if not table_exists(cursor):
+        return None
+    cursor.execute(
+        'SELECT table_name, dump_date, load_mode, position, completed '
+        'FROM "{0}" WHERE table_name = %s AND completed '
+        'ORDER BY dump_date DESC LIMIT 1'.format(CHECKPOINT_TABLE), (table, ))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return Checkpoint(*row)
+
+
+def save(cursor, table, dump_date, load_mode, position, completed=False):
+    """Record the import progress of given table.
+
+    :param load_mode:   Load mode (insert, copy) the position refers to
+    :type load_mode:    unicode
+
+    :param position:    Number of INSERT statements (load mode insert) or
+                        rows (load mode copy) of the dump that are committed.
+    :type position:     int
+
+    :param completed:   Whether the import of the table is complete
+    :type completed:    bool
+    """
+    create_table(cursor)
+    cursor.execute(
+        'UPDATE "{0}" SET load_mode = %s, position = %s, completed = %s '
+        'WHERE table_name = %s AND dump_date = %s'.format(CHECKPOINT_TABLE),
+        (load_mode, position, completed, table, dump_date))
+    if cursor.rowcount == 0:
+        cursor.execute(
+            'INSERT INTO "{0}" (table_name, dump_date, load_mode, position, '
+            'completed) VALUES (%s, %s, %s, %s, %s)'.format(CHECKPOINT_TABLE),
+            (table, dump_date, load_mode, position, completed))
+
+
+def delete(cursor, table, dump_date):
+    """Remove the checkpoint of given table.
+    """
+    create_table(cursor)
+    cursor.execute(
+        'DELETE FROM "{0}" WHERE table_name = %s AND dump_date = %s'.format(
+            CHECKPOINT_TABLE), (table, dump_date))
@@ -33,3 +33,94 @@ ENOENT = 3
 
 # wrong password
 EPASS = 4
+
+# import of at least one dump failed
+EIMPORT = 5
+
+
+class WPError(Exception):
+    """Base class for all errors raised within wp_import"""
+    pass
+
+
+class LoadError(WPError):
+    """Loading data into a database table failed.
+
+    :param db_name:     Name of the database
+    :type db_name:      str
+
+    :param table:       Name of the table
+    :type table:        str
+
+    :param ordinal:     Ordinal (starting at 1) of the statement or row
+                        that could not be loaded.
+    :type ordinal:      int
+
+    :param statement:   The failing statement or None if not known
+    :type statement:    str
+
+    :param cause:       Error reported by the database adapter
+    :type cause:        Exception
+    """
+
+    def __init__(self, db_name, table, ordinal, statement, cause):
+        super(LoadError, self).__init__(db_name, table, ordinal, statement,
+                                        cause)
+        self.db_name = db_name
+        self.table = table
+        self.ordinal = ordinal
+        self.statement = statement
+        self.cause = cause
+
+    def __str__(self):
+        msg = '{0.db_name}.{0.table}: Load failed at #{0.ordinal:d}: ' \
+                '{1}'.format(self, str(self.cause).strip())
+        if self.statement is not None:
+            stmt = self.statement[:80]
+            if isinstance(stmt, unicode):
+                stmt = stmt.encode('utf8')
+            msg += ' [{0}...]'.format(stmt)
+        return msg
+
+
+class SchemaError(WPError):
+    """The columns of a dump don't match the table it is imported into.
+
+    :param db_name:     Name of the database
+    :type db_name:      str
+
+    :param table:       Name of the table
+    :type table:        str
+
+    :param problems:    Descriptions of the differences
+    :type problems:     list
+    """
+
+    def __init__(self, db_name, table, problems):
+        super(SchemaError, self).__init__(db_name, table, problems)
+        self.db_name = db_name
+        self.table = table
+        self.problems = problems
+
+    def __str__(self):
+        return '{0.db_name}.{0.table}: Dump does not match table: ' \
+                '{1}'.format(self, '; '.join(self.problems))
+
+
+class FilterError(WPError):
+    """A row filter of the configuration can't be applied to a dump.
+
+    :param table:       Name of the table
+    :type table:        str
+
+    :param problems:    Descriptions of the problems
+    :type problems:     list
+    """
+
+    def __init__(self, table, problems):
+        super(FilterError, self).__init__(table, problems)
+        self.table = table
+        self.problems = problems
+
+    def __str__(self):
+        return '[Filter:{0.table}]: {1}'.format(self, '; '.join(self.problems))
@@ -23,22 +23,80 @@ various database backends.
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import contextlib
 import itertools
 import fnmatch
 import logging
+import multiprocessing
+import multiprocessing.pool
 import os
 import re
 import string
 import subprocess
+import threading
 
 import mwdb
+import sqlalchemy.event
 import sqlalchemy.exc
-
+import sqlalchemy.pool
+
+from . import checkpoint
+from . import exceptions as wpi_exc
+from . import loader
+from . import manifest
+from . import metrics
+from . import mysql
+from . import plan
+from . import rowfilter
 from . import utils
 from . import postgresql
+from . import xmldump
 
 _log = logging.getLogger(__name__)
 
+# PostgreSQL settings applied to the mwdb sessions of the current thread
+# (see _session_settings)
+_thread_settings = threading.local()
+
+_SETTING_NAME_PAT = re.compile(r'^[A-Za-z_][\w.]*$')
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.pool.Pool, 'checkout')
+def _apply_session_settings(dbapi_conn, conn_record, conn_proxy):
+    """Bring the settings of a connection of mwdb in line with the settings
+    of the current thread whenever it is checked out of its pool.
+    """
+    settings = getattr(_thread_settings, 'settings', ())
+    applied = conn_record.info.get('wp_import_settings', ())
+    if settings == applied:
+        return
+
+    cursor = dbapi_conn.cursor()
+    for (name, value) in applied:
+        cursor.execute('RESET {0}'.format(name))
+    for (name, value) in settings:
+        cursor.execute('SELECT set_config(%s, %s, false)', (name, value))
+    cursor.close()
+    # settings changed within a transaction are rolled back with it
+    dbapi_conn.commit()
+    conn_record.info['wp_import_settings'] = settings
+
+
+@contextlib.contextmanager
+def _session_settings(settings):
+    """Apply given PostgreSQL settings to the mwdb sessions of the current
+    thread until the context is left.
+
+    :param settings:    Tuple of (name, value) tuples
+    :type settings:     tuple
+    """
+    previous = getattr(_thread_settings, 'settings', ())
+    _thread_settings.settings = settings
+    try:
+        yield
+    finally:
+        _thread_settings.settings = previous
+
 
 class Importer(object):
     """Base class for vender specific MW dump importer"""
@@ -107,8 +165,12 @@ class Importer(object):
 
     def _database_name(self, dump_info):
         """Get database name for given dump_info dictionary.
+
+        ${date} is the date as in the filename (DumpInfo.dump_date).
         """
-        return self.db_name_template.substitute(dump_info)
+        return self.db_name_template.substitute(
+            language=dump_info.language, table=dump_info.table,
+            date=dump_info.dump_date)
 
 
 class PostgreSQLImporter(Importer):
@@ -122,13 +184,96 @@ class PostgreSQLImporter(Importer):
         """Constructor.
         """
         super(PostgreSQLImporter, self).__init__(config, options)
+        self._loader = None
+        self._index_pool = None
+        self._index_results = []
+        self._deferred_indexes = []
+        # rows loaded by the current import of every thread
+        self._loaded_rows = {}
+        self._lock = threading.Lock()
+        # names of the databases on the server (None: not read yet), the
+        # tables of every database and the connection of every database
+        # and thread
+        self._databases = None
+        self._tables = {}
+        self._dump_dbs = {}
+        self._catalog_lock = threading.RLock()
+        self._manifest = None
+        if self.options.manifest:
+            self._manifest = manifest.Manifest(self.options.manifest)
+        self._row_filters = rowfilter.from_config(self.config)
+
+        self._maintenance_settings = self._read_maintenance_settings()
+
+    def _read_maintenance_settings(self):
+        """Read the PostgreSQL settings of the [Maintenance] section.
+
+        They are applied to the sessions that create primary keys and
+        indexes (see _create_indexes). Settings with invalid names are
+        ignored.
+
+        :returns:   Tuple of (name, value) tuples
+        :rtype:     tuple
+        """
+        if not self.config.has_section('Maintenance'):
+            return ()
+
+        settings = []
+        # options of the DEFAULT section are not settings
+        for name in self.config.options('Maintenance'):
+            if self.config.has_option('DEFAULT', name):
+                continue
+            if not _SETTING_NAME_PAT.match(name):
+                _log.error('[Maintenance]: Invalid setting {0}. '
+                           'Ignored'.format(name))
+                continue
+            settings.append((name, self.config.get('Maintenance', name)))
+        return tuple(settings)
+
+    @property
+    def loader(self):
+        """Loader used by the psycopg2 loader backend.
+
+        The loader and its connection pool are created on first use.
+        """
+        with self._lock:
+            if self._loader is None:
+                self._loader = loader.Psycopg2Loader(
+                    loader.ConnectionPool(self.options,
+                                          self.options.pg_pool_size),
+                    commit_every=self.options.pg_commit_every)
+        return self._loader
 
     def _connect_to_db(self, dump_info):
         """Connect to the suitable database for given dump.
 
-        The database will be created if it does not exist yet.
+        The database will be created if it does not exist yet. Connections
+        are kept per database and thread, so that the dumps of a language
+        share one connection (see _release_db). The databases on the server
+        are read once.
+        """
+        db_name = self._database_name(dump_info)
+        key = (db_name, threading.current_thread().ident)
+        dump_db = self._dump_dbs.get(key)
+        if dump_db is not None:
+            return dump_db
+
+        dump_db = self._mwdb(dump_info)
+        with self._catalog_lock:
+            if not self._database_exists(dump_info):
+                _log.info('{0}: Create database'.format(db_name))
+                dump_db.create()
+                self._databases.add(db_name)
+                self._tables[db_name] = set()
+
+        dump_db.connect()
+        self._dump_dbs[key] = dump_db
+        return dump_db
+
+    def _mwdb(self, dump_info):
+        """Get the (unconnected) mwdb database of given dump.
         """
-        dump_db = mwdb.orm.database.PostgreSQLDatabase(
+        return mwdb.orm.database.PostgreSQLDatabase(
             self.options.pg_driver,
             self.options.pg_user,
             self.options.pg_password,
@@ -136,68 +281,353 @@ class PostgreSQLImporter(Importer):
             self._database_name(dump_info),
             dump_info.language)
 
-        if self._database_name(dump_info) not in dump_db.all_databases():
-            _log.info('{0}: Create database'.format(
-                self._database_name(dump_info)))
-            dump_db.create()
+    def _database_exists(self, dump_info):
+        """Check whether the database of given dump exists.
 
-        dump_db.connect()
-        return dump_db
+        The databases on the server are read on the first call.
+        """
+        with self._catalog_lock:
+            if self._databases is None:
+                self._databases = set(self._mwdb(dump_info).all_databases())
+            return self._database_name(dump_info) in self._databases
+
+    def _release_db(self, db_name):
+        """Drop the cached connection of the current thread to given
+        database and close it.
+
+        Connections of other threads (e.g. running index builds) are left
+        alone, they are released by their threads.
+        """
+        dump_db = self._dump_dbs.pop(
+            (db_name, threading.current_thread().ident), None)
+        if dump_db is not None:
+            # mwdb keeps its connections in the pool of its engine
+            dump_db.engine.dispose()
 
-    def _create_table(self, dump_db, table_name):
+    def _table_names(self, dump_db):
+        """Get the names of the tables of given database.
+
+        The tables are read once per database and updated by _create_table
+        and _drop_table.
+
+        :rtype:     set
+        """
+        with self._catalog_lock:
+            if dump_db.name not in self._tables:
+                self._tables[dump_db.name] = set(dump_db.table_names)
+            return self._tables[dump_db.name]
+
+    def _drop_table(self, dump_db, table_name):
+        dump_db.drop_table(table_name)
+        with self._catalog_lock:
+            self._tables.get(dump_db.name, set()).discard(table_name)
+
+    def _create_table(self, dump_db, table_name, truncate=None):
         """Create table for dump within given database.
+
+        An existing table is emptied if truncate is True (default: reimport
+        option). New and emptied tables are unlogged with --pg-unlogged.
+
+        :returns:   False if the table could not be made unlogged
+        :rtype:     bool
         """
-        if table_name not in dump_db.table_names:
+        if table_name not in self._table_names(dump_db):
             dump_db.create_table(table_name=table_name, pkey=False,
                                  index=False)
-            return
+            with self._catalog_lock:
+                self._tables[dump_db.name].add(table_name)
+            return self._set_logged(dump_db.name, table_name, False)
+
+        if truncate is None:
+            truncate = self.options.reimport
 
-        if self.options.reimport:
+        if truncate:
             dump_db.drop_pkey_constraint(table_name)
             dump_db.drop_indexes(table_name)
             dump_db.truncate_table(table_name)
+            return self._set_logged(dump_db.name, table_name, False)
+
+        return True
+
+    def _execute(self, db_name, table, statements):
+        """Execute given statements with the configured loader.
+
+        :returns:   False if a statement failed
+        :rtype:     bool
+        """
+        if self.options.pg_loader == 'psycopg2':
+            try:
+                self.loader.execute(db_name, table, statements)
+            except wpi_exc.LoadError as load_err:
+                _log.error(load_err)
+                return False
+            return True
+
+        return self._psql_pipe(db_name, table,
+                               ('{0};'.format(stmt)
+                                for stmt in statements)) == 0
+
+    def _set_logged(self, db_name, table, logged=True):
+        """Switch given table to a (un)logged table if --pg-unlogged is given.
+
+        :returns:   False if the table could not be switched
+        :rtype:     bool
+        """
+        if not self.options.pg_unlogged:
+            return True
+
+        _log.info('{0}.{1}: Set {2}'.format(
+            db_name, table, 'logged' if logged else 'unlogged'))
+        return self._execute(
+            db_name, table,
+            [postgresql.persistence_statement(table, logged)])
+
+    def _checkpoint(self, dump_info, latest=False):
+        """Get the checkpoint of the table given dump is imported into.
+
+        Checkpoints are only written by the psycopg2 loader.
+
+        :param latest:  Get the checkpoint of the newest complete import of
+                        the table instead of the one of given dump.
+        :type latest:   bool
+
+        :returns:   The checkpoint or None
+        :rtype:     checkpoint.Checkpoint
+        """
+        if self.options.pg_loader != 'psycopg2':
+            return None
+
+        with self.loader.pool.connection(
+            self._database_name(dump_info)) as conn:
+            cursor = conn.cursor()
+            if latest:
+                cp = checkpoint.latest(cursor, dump_info.table)
+            else:
+                cp = checkpoint.load(cursor, dump_info.table,
+                                     dump_info.dump_date)
+            conn.commit()
+        return cp
+
+    def _save_checkpoint(self, dump_info, position, completed=False):
+        """Record the import progress of the table of given dump.
+        """
+        if self.options.pg_loader != 'psycopg2':
+            return
 
-    def _get_insert_statements(self, dump_info):
+        with self.loader.pool.connection(
+            self._database_name(dump_info)) as conn:
+            checkpoint.save(conn.cursor(), dump_info.table,
+                            dump_info.dump_date, self.options.pg_load_mode,
+                            position, completed)
+            conn.commit()
+
+    def _parse_workers(self):
+        """Number of worker processes used to parse a single dump file.
+
+        Daemonic pool workers of --jobs can't start processes of their own,
+        so dumps are parsed serially within them.
+        """
+        if multiprocessing.current_process().daemon:
+            return 1
+        return self.options.parse_workers
+
+    def _ordered(self):
+        """Whether parsed batches are loaded in dump order.
+
+        Checkpoints count the statements (or rows) loaded in dump order and
+        --resume skips as many, so --unordered is ignored when the psycopg2
+        loader writes checkpoints.
+        """
+        return (not self.options.unordered
+                or self.options.pg_loader == 'psycopg2')
+
+    def _metrics(self, dump_info, table=None):
+        """Create the metrics of the import of given dump.
+        """
+        return metrics.Metrics(
+            '{0}.{1}'.format(self._database_name(dump_info),
+                             table or dump_info.table),
+            self.options.progress_interval)
+
+    def _report_metrics(self, table_metrics):
+        """Log the metrics of an import and write them to --metrics-file.
+        """
+        _log.info(table_metrics.summary())
+        if 'rows' in table_metrics.counters:
+            thread = threading.current_thread().ident
+            self._loaded_rows[thread] = (self._loaded_rows.get(thread, 0)
+                                         + table_metrics.counters['rows'])
+        if self.options.metrics_file:
+            metrics.MetricsWriter(self.options.metrics_file,
+                                  self.options.metrics_format).write(
+                                      table_metrics.report())
+
+    def _get_insert_statements(self, dump_info, skip=0, table_metrics=None):
         """Get insert statement iterator.
+
+        The first skip statements are dropped. % is not escaped, as neither
+        psql nor the psycopg2 loader interpolate the statements.
         """
-        insert_statements = postgresql.insert_statements(dump_info.path)
-        if self.options.pg_driver == 'psycopg2':
-            insert_statements = (el.replace('%', '%%') for el in
-                                 insert_statements)
-        return insert_statements
+        row_filter = self._row_filters.get(dump_info.table)
+        if self._parse_workers() > 1:
+            return self._buffered(postgresql.parallel_pipeline(
+                dump_info.path, self._parse_workers(),
+                batch_size=self.options.parse_batch_size,
+                ordered=self._ordered(),
+                decompressor=self.options.decompressor,
+                skip=skip, metrics=table_metrics, row_filter=row_filter))
+        return self._buffered(postgresql.raw_insert_statements(
+            dump_info.path, self.options.decompressor, skip, table_metrics,
+            buffering=self._buffering(), row_filter=row_filter))
+
+    def _get_copy_rows(self, dump_info, skip=0, table_metrics=None):
+        """Get COPY row iterator.
+
+        The first skip rows are dropped.
+        """
+        row_filter = self._row_filters.get(dump_info.table)
+        if self._parse_workers() > 1:
+            return self._buffered(postgresql.parallel_pipeline(
+                dump_info.path, self._parse_workers(),
+                copy_format=self.options.pg_copy_format,
+                batch_size=self.options.parse_batch_size,
+                ordered=self._ordered(),
+                decompressor=self.options.decompressor,
+                skip=skip, metrics=table_metrics, row_filter=row_filter))
+        return self._buffered(postgresql.copy_rows(
+            dump_info.path, self.options.pg_copy_format,
+            self.options.decompressor, skip, table_metrics,
+            self._buffering(), row_filter))
+
+    def _copy_columns(self, dump_info):
+        """Names of the columns of the COPY rows of given dump or None if
+        they contain all columns of the table.
+        """
+        row_filter = self._row_filters.get(dump_info.table)
+        return row_filter.columns if row_filter is not None else None
 
-    def _psql_pipe(self, db_name, table, statements):
-        """Pipe given statements into psql.
+    def _buffering(self):
+        """Limits (max_entries, max_bytes) of the queues between the threads
+        of the pipeline or None if it runs in a single thread.
+        """
+        if self.options.queue_size <= 0:
+            return None
+        return (self.options.queue_size, self.options.queue_memory << 20)
 
-        :param db_name:     Name of the database psql should connect to.
-        :type db_name:      str
+    def _buffered(self, seq):
+        """Transform given sequence in a thread of its own, so that the
+        transformation overlaps with the loading (see utils.buffered).
+        """
+        if self._buffering() is None:
+            return seq
+        return utils.buffered(seq, *self._buffering())
 
-        :param table:       Name of the table the statements insert into.
-        :type table:        str
+    def _psql_args(self, db_name):
+        """Command line of psql connecting to given database.
 
-        :param statements:  Sequence of SQL statements.
-        :type statements:   iterable
+        psql stops at the first error and exits with a non-zero status, so
+        that a failed statement or COPY fails the import.
         """
-        psql_process = subprocess.Popen([
+        return [
             'psql',
             '--quiet',
+            '--set=ON_ERROR_STOP=1',
             '--host={0}'.format(self.options.pg_host),
             '--username={0}'.format(self.options.pg_user),
             '--no-password',
             '--dbname={0}'.format(db_name),
-        ],
-            stdin=subprocess.PIPE,
-        )
+        ]
 
-        _log.info('{0}.{1}: Importing data'.format(db_name, table))
+    def _psql_process(self, db_name):
+        """Start a psql process that reads commands from its stdin.
 
-        for stmt in statements:
-            if isinstance(stmt, unicode):
-                stmt = stmt.encode('utf8')
+        :param db_name:     Name of the database psql should connect to.
+        :type db_name:      str
+        """
+        return subprocess.Popen(self._psql_args(db_name),
+                                stdin=subprocess.PIPE)
 
-            stmt = stmt.strip()
-            psql_process.stdin.write(b'{0}\n'.format(stmt))
+    def _table_columns(self, db_name, table):
+        """Get the columns of given table (see postgresql.table_columns).
+        """
+        if self.options.pg_loader == 'psycopg2':
+            with self.loader.pool.connection(db_name) as conn:
+                columns = postgresql.table_columns(conn.cursor(), table)
+                conn.commit()
+            return columns
+
+        output = subprocess.check_output(
+            self._psql_args(db_name) + [
+                '--no-align', '--tuples-only', '--field-separator=\t',
+                '--command={0}'.format(postgresql.columns_query(table))])
+        return [tuple(line.decode('utf8').split('\t'))
+                for line in output.splitlines() if line]
+
+    def _dump_schema(self, dump_info):
+        """Read the table definition in the header of given dump.
+
+        :rtype:     mysql.Schema
+        """
+        with utils.open_compressed(dump_info.path,
+                                   self.options.decompressor) as dump_file:
+            return mysql.split_header(dump_file)[0]
 
+    def _check_filter(self, dump_info):
+        """Check that the row filter of the table of given dump (if any)
+        can be applied to the dump.
+
+        :returns:   False if the filter names columns the dump lacks
+        :rtype:     bool
+        """
+        row_filter = self._row_filters.get(dump_info.table)
+        if row_filter is None:
+            return True
+
+        try:
+            rowfilter.resolve(row_filter, self._dump_schema(dump_info))
+        except wpi_exc.FilterError as filter_err:
+            _log.error('{0}: {1}'.format(dump_info.filename, filter_err))
+            return False
+        _log.info('{0}.{1}: Rows filtered by [Filter:{1}]'.format(
+            self._database_name(dump_info), dump_info.table))
+        return True
+
+    def _check_schema(self, dump_info):
+        """Check that the table definition in the header of given dump
+        matches the table it is imported into.
+
+        :returns:   False if the dump can't be loaded into the table
+        :rtype:     bool
+        """
+        if not self.options.schema_check:
+            return True
+
+        db_name = self._database_name(dump_info)
+        schema = self._dump_schema(dump_info)
+        if schema is None:
+            _log.warning('{0}.{1.table}: No table definition in ' \
+                         '{1.filename}'.format(db_name, dump_info))
+            return True
+
+        try:
+            postgresql.check_schema(
+                db_name, schema, self._table_columns(db_name,
+                                                     dump_info.table))
+        except wpi_exc.SchemaError as schema_err:
+            _log.error(schema_err)
+            return False
+        except subprocess.CalledProcessError as psql_err:
+            _log.error('{0}.{1}: Could not read the table definition: ' \
+                       '{2}'.format(db_name, dump_info.table, psql_err))
+            return False
+        return True
+
+    def _psql_wait(self, psql_process):
+        """Close stdin of given psql process and wait for it to terminate.
+
+        :returns:   The return code of psql
+        :rtype:     int
+        """
         psql_process.stdin.close()
         psql_process.wait()
 
@@ -206,145 +636,1014 @@ class PostgreSQLImporter(Importer):
 
         return psql_process.returncode
 
-    def _import_sql_dump(self, dump_info):
+    def _psql_write(self, db_name, psql_process, data):
+        """Write given data to the stdin of a psql process and wait for it
+        to terminate.
+
+        psql exits at the first error (see _psql_args), the remaining data
+        is discarded then. psql is terminated if data raises an exception.
+
+        :param data:    Sequence of bytes
+        :type data:     iterable
+
+        :returns:   The return code of psql
+        :rtype:     int
+        """
+        try:
+            for el in data:
+                psql_process.stdin.write(el)
+        except IOError as io_err:
+            # psql died, its exit status is reported below
+            _log.error('{0}: {1}'.format(db_name, io_err))
+        except:
+            psql_process.terminate()
+            self._psql_wait(psql_process)
+            raise
+        return self._psql_wait(psql_process)
+
+    def _psql_pipe(self, db_name, table, statements):
+        """Pipe given statements into psql.
+
+        :param db_name:     Name of the database psql should connect to.
+        :type db_name:      str
+
+        :param table:       Name of the table the statements insert into.
+        :type table:        str
+
+        :param statements:  Sequence of SQL statements.
+        :type statements:   iterable
+        """
+        _log.info('{0}.{1}: Importing data'.format(db_name, table))
+
+        def data():
+            for stmt in statements:
+                if isinstance(stmt, unicode):
+                    stmt = stmt.encode('utf8')
+
+                # avoid copying (possibly huge) statements
+                yield stmt
+                if not stmt.endswith(b'\n'):
+                    yield b'\n'
+
+        return self._psql_write(db_name, self._psql_process(db_name), data())
+
+    def _psql_copy(self, db_name, table, rows, columns=None):
+        """Stream given rows into psql using COPY table FROM STDIN.
+
+        :param db_name:     Name of the database psql should connect to.
+        :type db_name:      str
+
+        :param table:       Name of the table the rows are copied into.
+        :type table:        str
+
+        :param rows:        Sequence of newline terminated rows in the COPY
+                            format given by the pg_copy_format option.
+        :type rows:         iterable
+
+        :param columns:     Names of the columns the rows contain (default:
+                            all columns of the table)
+        :type columns:      list
+        """
+        _log.info('{0}.{1}: Copying data'.format(db_name, table))
+
+        copy_stmt = postgresql.copy_statement(table,
+                                              self.options.pg_copy_format,
+                                              columns)
+        data = itertools.chain(
+            ['{0};\n'.format(copy_stmt).encode('utf8')],
+            (row.encode('utf8') for row in rows), [b'\\.\n'])
+        return self._psql_write(db_name, self._psql_process(db_name), data)
+
+    def _load_sql_dump(self, dump_info, resume_from=0):
+        """Load the data of given dump into its (existing) table.
+
+        The psycopg2 loader records a checkpoint with every commit.
+
+        :param resume_from:     Number of INSERT statements (or COPY rows)
+                                that are already loaded.
+        :type resume_from:      int
+
+        :returns:   True if the data was loaded successfully
+        :rtype:     bool
+        """
+        db_name = self._database_name(dump_info)
+        table_metrics = self._metrics(dump_info)
+
+        try:
+            if self.options.pg_loader == 'psycopg2':
+
+                def on_commit(cursor, position):
+                    checkpoint.save(cursor, dump_info.table,
+                                    dump_info.dump_date,
+                                    self.options.pg_load_mode,
+                                    resume_from + position)
+
+                try:
+                    if self.options.pg_load_mode == 'copy':
+                        _log.info('{0}.{1}: Copying data'.format(
+                            db_name, dump_info.table))
+                        loaded = self.loader.copy(
+                            db_name, dump_info.table,
+                            self._get_copy_rows(dump_info, resume_from,
+                                                table_metrics),
+                            self.options.pg_copy_format, on_commit,
+                            self._copy_columns(dump_info))
+                    else:
+                        _log.info('{0}.{1}: Importing data'.format(
+                            db_name, dump_info.table))
+                        loaded = self.loader.execute(
+                            db_name, dump_info.table,
+                            self._get_insert_statements(dump_info, resume_from,
+                                                        table_metrics),
+                            on_commit)
+                        table_metrics.add('rows', loaded)
+                except wpi_exc.LoadError as load_err:
+                    _log.error(load_err)
+                    return False
+
+                _log.info('{0}.{1}: Loaded {2:d} rows'.format(
+                    db_name, dump_info.table, loaded))
+                return True
+
+            if self.options.pg_load_mode == 'copy':
+                psql_returncode = self._psql_copy(
+                    db_name, dump_info.table,
+                    self._get_copy_rows(dump_info,
+                                        table_metrics=table_metrics),
+                    self._copy_columns(dump_info))
+            else:
+                psql_returncode = self._psql_pipe(
+                    db_name, dump_info.table,
+                    self._get_insert_statements(dump_info,
+                                                table_metrics=table_metrics))
+            return psql_returncode == 0
+        finally:
+            self._report_metrics(table_metrics)
+
+    def _import_delta(self, dump_info, previous):
+        """Apply the changes between a previously imported dump and given
+        dump to its table.
+
+        :param previous:    Checkpoint of the previous import
+        :type previous:     checkpoint.Checkpoint
+
+        :returns:   False if the import failed
+        :rtype:     bool
+        """
+        db_name = self._database_name(dump_info)
+
+        if previous.dump_date >= dump_info.dump_date:
+            _log.info('{0}.{1.table}: Skipped import of {1.filename}. ' \
+                      'Dump of {2} already imported'.format(
+                          db_name, dump_info, previous.dump_date))
+            return True
+
+        _log.info('{0}.{1.table}: Apply changes since {2}'.format(
+            db_name, dump_info, previous.dump_date))
+
+        def on_commit(cursor, position):
+            checkpoint.save(cursor, dump_info.table, dump_info.dump_date,
+                            'copy', position, completed=True)
+
+        table_metrics = self._metrics(dump_info)
+        try:
+            (deleted, inserted) = self.loader.delta(
+                db_name, dump_info.table,
+                self._get_copy_rows(dump_info, table_metrics=table_metrics),
+                self.options.pg_copy_format, on_commit,
+                self._copy_columns(dump_info))
+        except wpi_exc.LoadError as load_err:
+            _log.error(load_err)
+            return False
+        finally:
+            self._report_metrics(table_metrics)
+
+        _log.info('{0}.{1}: Deleted {2:d} and inserted {3:d} rows'.format(
+            db_name, dump_info.table, deleted, inserted))
+        return True
+
+    def _sql_dump_action(self, dump_info, dump_db, reimport=False):
+        """Decide how given dump is imported into its table.
+
+        :param dump_db:     Database of the dump
+        :type dump_db:      mwdb.orm.database.PostgreSQLDatabase
+
+        :param reimport:    Reimport the table even if it exists
+        :type reimport:     bool
+
+        :returns:   The action (see plan) and the checkpoint it is based on,
+                    i.e. the previous import for DELTA and the incomplete
+                    import for RESUME
+        :rtype:     tuple
+        """
+        exists = dump_info.table in self._table_names(dump_db)
+        if self.options.delta and not reimport and exists:
+            previous = self._checkpoint(dump_info, latest=True)
+            if previous is not None:
+                return (plan.DELTA, previous)
+
+        if not exists:
+            return (plan.CREATE, None)
+        if reimport:
+            return (plan.REIMPORT, None)
+
+        cp = self._checkpoint(dump_info)
+        if cp is None or cp.completed:
+            return (plan.SKIP, cp)
+        if (self.options.resume
+            and cp.load_mode == self.options.pg_load_mode):
+            return (plan.RESUME, cp)
+        return (plan.REIMPORT, cp)
+
+    def _import_sql_dump(self, dump_info, reimport=False):
         """Import dump.
 
         :param dump_info:   Dump file information. This information is used to
                             select the appropriate database and table.
         :type dump_info:    DumpInfo
+
+        :param reimport:    Reimport the table even if it exists
+        :type reimport:     bool
+
+        :returns:   False if the import failed
+        :rtype:     bool
         """
         _log.info('Processing: {0.filename}'.format(dump_info))
         dump_db = self._connect_to_db(dump_info)
+        (action, cp) = self._sql_dump_action(dump_info, dump_db, reimport)
 
-        if (dump_info.table in dump_db.table_names
-            and not self.options.reimport):
+        if action == plan.DELTA:
+            if not (self._check_schema(dump_info)
+                    and self._check_filter(dump_info)):
+                return False
+            return self._import_delta(dump_info, cp)
+
+        if action == plan.SKIP:
             _log.info('{0}.{1.table}: Skipped import of {1.filename}'.format(
                 dump_db.name, dump_info))
-            return
-
-        self._create_table(dump_db, dump_info.table)
-        insert_statements = self._get_insert_statements(dump_info)
+            return True
+
+        resume_from = 0
+        if action == plan.RESUME:
+            _log.info('{0}.{1.table}: Resume import after {2:d} ' \
+                      '{3}'.format(dump_db.name, dump_info, cp.position,
+                                   'statements' if cp.load_mode ==
+                                   'insert' else 'rows'))
+            resume_from = cp.position
+            dump_db.drop_pkey_constraint(dump_info.table)
+            dump_db.drop_indexes(dump_info.table)
+        elif action == plan.REIMPORT and not reimport:
+            _log.info('{0}.{1.table}: Previous import incomplete. ' \
+                      'Reimport'.format(dump_db.name, dump_info))
+
+        if not self._check_filter(dump_info):
+            return False
+        # an existing table is checked before it is emptied, a new one is
+        # dropped again, so that the next run doesn't skip it
+        if action != plan.CREATE and not self._check_schema(dump_info):
+            return False
+        if not self._create_table(dump_db, dump_info.table,
+                                  action == plan.REIMPORT):
+            return False
+        if action == plan.CREATE and not self._check_schema(dump_info):
+            _log.info('{0}.{1}: Drop Table'.format(dump_db.name,
+                                                   dump_info.table))
+            self._drop_table(dump_db, dump_info.table)
+            return False
+        self._save_checkpoint(dump_info, resume_from)
+
+        if not self._load_sql_dump(dump_info, resume_from):
+            if self.options.pg_loader == 'psycopg2':
+                # committed data and its checkpoint are kept for --resume
+                _log.info('{0}.{1}: Import failed'.format(
+                    self._database_name(dump_info), dump_info.table))
+                return False
 
-        psql_returncode = self._psql_pipe(self._database_name(dump_info),
-                                          dump_info.table, insert_statements)
-
-        if psql_returncode != 0:
             _log.info('{0}.{1}: Import failed. Drop Table'.format(
                 self._database_name(dump_info), dump_info.table))
-            dump_db.drop_table(table)
-            return
+            self._drop_table(dump_db, dump_info.table)
+            return False
 
-        try:
-            dump_db.create_pkey_constraint(dump_info.table)
-        except sqlalchemy.exc.IntegrityError as integrity_error:
-            _log.error(integrity_error)
-            _log.error(
-                '{0}.{1.table}: Could not create pkey constraint'.format(
-                    dump_db.name, dump_info))
-
-        _log.info('{0}.{1.table}: Create indexes'.format(
-            dump_db.name, dump_info))
-        dump_db.create_indexes(dump_info.table)
-
-    def _convert_pages_articles(self, pa_path):
-        """Convert the pages-articles XML dump to SQL.
-
-        This method calls xml2sql in a subprocess and returns a dictionary
-        with the paths to page.sql, revision.sql and text.sql.
-        """
-        _log.info('Converting: {0}'.format(os.path.basename(pa_path)))
-        converter_process = subprocess.Popen(['xml2sql',
-                                              '--postgresql=8.4',
-                                              '--output-dir={0}'.format(
-                                                  os.path.dirname(pa_path)),
-                                             ],
-                                             stdin=subprocess.PIPE,
-                                            )
-
-        with utils.open_compressed(pa_path) as pa_dump_f:
-            for line in pa_dump_f:
-                converter_process.stdin.write(line)
-        converter_process.stdin.close()
-
-        converter_process.wait()
-
-        _log.info('xml2sql [{0:d}]: Exited with {1:d}'.format(
-            converter_process.pid, converter_process.returncode))
-
-        base_path = os.path.dirname(pa_path)
-        return {
-            'page': os.path.join(base_path, 'page.sql'),
-            'revision': os.path.join(base_path, 'revision.sql'),
-            'text': os.path.join(base_path, 'text.sql'),
-        }
-
-    def _import_pages_articles(self, dump_info):
+        return self._schedule_indexes(dump_info, [dump_info.table])
 
-        _log.info('Processing: {0.filename}'.format(dump_info))
-        dump_db = self._connect_to_db(dump_info)
+    def _create_indexes(self, dump_info, tables):
+        """Create the primary key and indexes of given tables.
 
-        # skip conversion if all {table, revision, text} tables are
-        # present in the database *and* reimport is disabled
-        if (not self.options.reimport
-            and ('revision' in dump_db.table_names)
-            and ('text' in dump_db.table_names)
-            and ('page' in dump_db.table_names)):
+        This runs on a connection of its own, so that it can overlap with
+        the import of the next dump. Afterwards, unlogged tables are switched
+        to logged tables and their checkpoints are marked complete.
 
+        :param tables:  Names of the tables in the database of dump_info
+        :type tables:   list
+
+        :returns:   False if the indexes could not be created
+        :rtype:     bool
+        """
+        try:
+            dump_db = self._connect_to_db(dump_info)
+
+            # e.g. maintenance_work_mem of [Maintenance]
+            with _session_settings(self._maintenance_settings):
+                for table in tables:
+                    try:
+                        dump_db.create_pkey_constraint(table)
+                    except sqlalchemy.exc.IntegrityError as integrity_error:
+                        _log.error(integrity_error)
+                        _log.error(
+                            '{0}.{1}: Could not create pkey constraint'.format(
+                                dump_db.name, table))
+
+                    _log.info('{0}.{1}: Create indexes'.format(dump_db.name,
+                                                               table))
+                    dump_db.create_indexes(table)
+
+                    if not self._set_logged(dump_db.name, table):
+                        return False
+
+                    if table == dump_info.table:
+                        cp = self._checkpoint(dump_info)
+                        if cp is not None:
+                            self._save_checkpoint(dump_info, cp.position,
+                                                  completed=True)
+        except Exception as exc:
+            _log.exception('{0}: Creating indexes failed: {1}'.format(
+                self._database_name(dump_info), exc))
+            return False
+        finally:
+            if self.options.index_workers >= 1:
+                # index workers serve many databases, keep no connections
+                self._release_db(self._database_name(dump_info))
+
+        return True
+
+    def _schedule_indexes(self, dump_info, tables):
+        """Schedule the creation of the indexes of given tables.
+
+        Indexes are created right away, on one of --index-workers threads
+        or, with --defer-indexes, after all dumps of the language are
+        loaded.
+
+        :returns:   False if indexes were created right away and failed
+        :rtype:     bool
+        """
+        if self.options.defer_indexes:
+            with self._lock:
+                self._deferred_indexes.append((dump_info, tables))
+            return True
+        return self._submit_indexes(dump_info, tables)
+
+    def _submit_indexes(self, dump_info, tables):
+        if self.options.index_workers < 1:
+            return self._create_indexes(dump_info, tables)
+
+        with self._lock:
+            if self._index_pool is None:
+                self._index_pool = multiprocessing.pool.ThreadPool(
+                    self.options.index_workers)
+            self._index_results.append(self._index_pool.apply_async(
+                self._create_indexes, (dump_info, tables)))
+        return True
+
+    def _flush_deferred_indexes(self, db_name=None):
+        """Schedule the deferred index builds (of given database).
+
+        :returns:   False if an index build run right away failed
+        :rtype:     bool
+        """
+        with self._lock:
+            flushed = [(dump_info, tables) for (dump_info, tables)
+                       in self._deferred_indexes
+                       if db_name in (None, self._database_name(dump_info))]
+            self._deferred_indexes = [
+                deferred for deferred in self._deferred_indexes
+                if deferred not in flushed]
+
+        success = True
+        for (dump_info, tables) in flushed:
+            success = self._submit_indexes(dump_info, tables) and success
+        return success
+
+    def _wait_for_indexes(self):
+        """Wait until all scheduled index builds are done.
+
+        :returns:   False if any index build failed
+        :rtype:     bool
+        """
+        success = self._flush_deferred_indexes()
+        for result in self._index_results:
+            success = result.get() and success
+        self._index_results = []
+
+        if self._index_pool is not None:
+            self._index_pool.close()
+            self._index_pool.join()
+            self._index_pool = None
+        return success
+
+    def _get_pages_articles_rows(self, dump_info, tables, shard=None,
+                                 namespaces=None, table_metrics=None):
+        """Get the COPY rows of given tables from a pages-articles dump.
+
+        :param tables:      Names of the tables (page, revision, text) whose
+                            rows are needed.
+        :type tables:       list
+
+        :param shard:       (start, end) offsets of the streams of a
+                            multistream dump that should be read instead of
+                            the whole dump.
+        :type shard:        tuple
+
+        :param namespaces:  Namespaces of the dump (needed with shard)
+        :type namespaces:   dict
+
+        :param table_metrics:   Measures the parser
+        :type table_metrics:    metrics.Metrics
+
+        :returns:   Sequence of (table, row) tuples
+        :rtype:     iterable
+        """
+        to_copy_row = postgresql.COPY_FORMATS[self.options.pg_copy_format]
+
+        if shard is not None:
+            table_rows = xmldump.fragment_rows(
+                utils.decompress_range(dump_info.path, *shard), namespaces)
+            for (table, row) in metrics.stage(table_metrics, 'parse',
+                                              table_rows, 'rows'):
+                if table in tables:
+                    yield (table, to_copy_row(row))
             return
 
-        file_path_dict = self._convert_pages_articles(dump_info.path)
+        with utils.open_compressed(dump_info.path,
+                                   self.options.decompressor) as pa_dump_f:
+            if table_metrics is not None:
+                table_metrics.watch(pa_dump_f)
+            table_rows = xmldump.table_rows(pa_dump_f)
+            for (table, row) in metrics.stage(table_metrics, 'parse',
+                                              table_rows, 'rows'):
+                if table in tables:
+                    yield (table, to_copy_row(row))
+
+    def _psql_copy_streams(self, db_name, columns, rows):
+        """Stream rows into several tables using one psql process with COPY
+        ... FROM STDIN for each table.
+
+        :param columns:     Mapping of the names of the tables to the
+                            columns their rows contain.
+        :type columns:      dict
+
+        :param rows:        Sequence of (table, row) tuples
+        :type rows:         iterable
+
+        :returns:   True if all rows were copied successfully
+        :rtype:     bool
+        """
+        processes = {}
+        for (table, table_columns) in columns.iteritems():
+            _log.info('{0}.{1}: Copying data'.format(db_name, table))
+            processes[table] = self._psql_process(db_name)
+            copy_stmt = postgresql.copy_statement(
+                table, self.options.pg_copy_format, table_columns)
+            processes[table].stdin.write('{0};\n'.format(copy_stmt).encode(
+                'utf8'))
 
-        for table, path in file_path_dict.iteritems():
+        try:
+            for (table, row) in rows:
+                processes[table].stdin.write(row.encode('utf8'))
+        except IOError as io_err:
+            # a psql process died, its exit status is reported below
+            _log.error('{0}: {1}'.format(db_name, io_err))
+        except:
+            for psql_process in processes.itervalues():
+                psql_process.terminate()
+                self._psql_wait(psql_process)
+            raise
+
+        success = True
+        for psql_process in processes.itervalues():
+            try:
+                psql_process.stdin.write(b'\\.\n')
+            except IOError:
+                pass
+            success = self._psql_wait(psql_process) == 0 and success
+        return success
 
-            # skip table if present and reimport disabled
-            if (table in dump_db.table_names and not self.options.reimport):
+    def _load_pages_articles(self, dump_info, tables, rows):
+        """Copy rows of a pages-articles dump into their (existing) tables.
 
+        :param rows:    Sequence of (table, row) tuples
+        :type rows:     iterable
+
+        :returns:   True if the rows were loaded successfully
+        :rtype:     bool
+        """
+        db_name = self._database_name(dump_info)
+        columns = dict((table, xmldump.COLUMNS[table]) for table in tables)
+
+        try:
+            if self.options.pg_loader == 'psycopg2':
+                loaded = self.loader.copy_streams(
+                    db_name, columns, rows, self.options.pg_copy_format)
+                for (table, count) in sorted(loaded.iteritems()):
+                    _log.info('{0}.{1}: Loaded {2:d} rows'.format(
+                        db_name, table, count))
+                return True
+            return self._psql_copy_streams(db_name, columns, rows)
+        except wpi_exc.LoadError as load_err:
+            _log.error(load_err)
+        except SyntaxError as parse_err:
+            # cElementTree.ParseError
+            _log.error('{0}: Could not parse {1.filename}: {2}'.format(
+                db_name, dump_info, parse_err))
+        return False
+
+    def _load_multistream(self, dump_info, tables, index_path, workers):
+        """Load a multistream pages-articles dump with several processes.
+
+        The bzip2 streams of the dump are split into shards, which are
+        decompressed, parsed and loaded independently.
+
+        :param index_path:  Path of the index of the dump
+        :type index_path:   str
+
+        :param workers:     Number of worker processes
+        :type workers:      int
+
+        :returns:   True if all shards were loaded successfully
+        :rtype:     bool
+        """
+        offsets = utils.multistream_offsets(index_path)
+        if not offsets:
+            return self._load_pages_articles(
+                dump_info, tables,
+                self._get_pages_articles_rows(dump_info, tables))
+
+        # the first stream holds the siteinfo
+        namespaces = xmldump.site_namespaces(utils.IterFile(
+            utils.decompress_range(dump_info.path, 0, offsets[0])))
+        # several shards per worker even out differences in their content
+        shards = utils.multistream_shards(
+            offsets, os.path.getsize(dump_info.path), workers * 4)
+
+        _log.info('{0}: Loading {1:d} shards of {2.filename} with {3:d} '
+                  'workers'.format(self._database_name(dump_info),
+                                   len(shards), dump_info, workers))
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.imap_unordered(
+                _load_shard, ((self, dump_info, tables, shard, namespaces)
+                              for shard in shards))
+            success = all(list(results))
+        finally:
+            pool.close()
+            pool.join()
+        return success
+
+    def _import_pages_articles(self, dump_info, reimport=False):
+        """Import pages-articles dump into the page, revision and text
+        tables.
+
+        The dump is parsed once and its rows are copied into all three
+        tables concurrently. Multistream dumps with an index are split into
+        shards that are loaded by --parse-workers processes.
+
+        :param reimport:    Reimport tables that exist
+        :type reimport:     bool
+
+        :returns:   False if the import failed
+        :rtype:     bool
+        """
+        _log.info('Processing: {0.filename}'.format(dump_info))
+        dump_db = self._connect_to_db(dump_info)
+        db_name = self._database_name(dump_info)
+
+        tables = []
+        for table in xmldump.TABLES:
+            # skip table if present and reimport disabled
+            if (table in self._table_names(dump_db) and not reimport):
                 _log.info('{0}.{1}: Skipped import of {1}'.format(
                     dump_db.name, table))
-
                 continue
+            tables.append(table)
+
+        if not tables:
+            return True
+
+        for table in tables:
+            if not self._create_table(dump_db, table, reimport):
+                return False
+
+        index_path = utils.multistream_index_path(dump_info.path)
+        workers = self._parse_workers()
+        if index_path is not None and workers > 1:
+            success = self._load_multistream(dump_info, tables, index_path,
+                                             workers)
+        else:
+            table_metrics = self._metrics(dump_info)
+            success = self._load_pages_articles(
+                dump_info, tables,
+                self._get_pages_articles_rows(dump_info, tables,
+                                              table_metrics=table_metrics))
+            self._report_metrics(table_metrics)
+
+        if not success:
+            _log.info('{0}: Import failed. Drop tables {1}'.format(
+                db_name, ', '.join(tables)))
+            for table in tables:
+                self._drop_table(dump_db, table)
+            return False
+
+        return self._schedule_indexes(dump_info, tables)
+
+    def _manifest_status(self, dump_info):
+        """Status of given dump in the manifest (see manifest.Manifest) or
+        None without --manifest or with --reimport.
+        """
+        if self._manifest is None or self.options.reimport:
+            return None
+        return self._manifest.status(dump_info.path,
+                                     self._database_name(dump_info))
 
-            self._create_table(dump_db, table)
+    def _plan_step(self, dump_info, rates):
+        """Plan the import of given dump without changing any database.
 
-            with open(path) as dump_f:
-                psql_returncode = self._psql_pipe(
-                    self._database_name(dump_info), table, dump_f)
+        :param rates:   Throughput of previous imports (see plan.throughput)
+        :type rates:    dict
 
-                if psql_returncode != 0:
-                    _log.info('{0}.{1}: Import failed. Drop Table'.format(
-                        self._database_name(dump_info), table))
-                    dump_db.drop_table(table)
-                    return
+        :rtype:     plan.Step
+        """
+        db_name = self._database_name(dump_info)
+        reimport = self.options.reimport
+        status = self._manifest_status(dump_info)
+        if status == manifest.CHANGED:
+            reimport = True
+
+        if fnmatch.fnmatch(dump_info.filename, '*pages-articles*.xml.bz2'):
+            tables = list(xmldump.TABLES)
+            present = []
+            if self._database_exists(dump_info):
+                present = [table for table in tables if table in
+                           self._table_names(self._connect_to_db(dump_info))]
+            if not reimport:
+                tables = [table for table in tables if table not in present]
+            if status == manifest.UNCHANGED or not tables:
+                (tables, action) = (list(xmldump.TABLES), plan.SKIP)
+            elif reimport and present:
+                action = plan.REIMPORT
+            else:
+                action = plan.CREATE
+        else:
+            tables = [dump_info.table]
+            if status == manifest.UNCHANGED:
+                action = plan.SKIP
+            elif not self._database_exists(dump_info):
+                action = plan.CREATE
+            else:
+                (action, cp) = self._sql_dump_action(
+                    dump_info, self._connect_to_db(dump_info), reimport)
+                if (action == plan.DELTA
+                    and cp.dump_date >= dump_info.dump_date):
+                    action = plan.SKIP
+
+        return plan.Step(dump_info, db_name, tables, action,
+                         plan.estimate(dump_info.size, dump_info.table,
+                                       action, rates))
+
+    def _import_dump(self, dump_info):
+        """Import given dump file.
+
+        With --manifest, dumps that were imported before and did not change
+        since are skipped and changed dumps are reimported.
+
+        :returns:   False if the import failed
+        :rtype:     bool
+        """
+        db_name = self._database_name(dump_info)
+        reimport = self.options.reimport
+        status = self._manifest_status(dump_info)
+        if status == manifest.UNCHANGED:
+            _log.info('{0}: Skipped import of {1.filename}. Unchanged ' \
+                      'since its import'.format(db_name, dump_info))
+            self._manifest.touch(dump_info.path)
+            return True
+        if status == manifest.CHANGED:
+            _log.info('{0}: {1.filename} changed since its import. ' \
+                      'Reimport'.format(db_name, dump_info))
+            reimport = True
+
+        thread = threading.current_thread().ident
+        self._loaded_rows.pop(thread, None)
+        if fnmatch.fnmatch(dump_info.filename, '*pages-articles*.xml.bz2'):
+            tables = xmldump.TABLES
+            success = self._import_pages_articles(dump_info, reimport)
+        else:
+            tables = [dump_info.table]
+            success = self._import_sql_dump(dump_info, reimport)
+
+        if success and self._manifest is not None:
+            self._manifest.record(dump_info.path, db_name, tables,
+                                  self._loaded_rows.pop(thread, None))
+        return success
+
+    def _import_parallel(self, dump_info, jobs, costs):
+        """Import given dumps using a pool of jobs worker processes.
+
+        Databases are created up front, so that workers never race to create
+        the same database. Dumps that go into the same table (several dump
+        dates with --delta) are imported by one worker in order. These units
+        are scheduled most expensive first.
+
+        :param costs:   Estimated duration of the import of every dump file
+                        by path (see plan_import)
+        :type costs:    dict
+
+        :returns:   False if any import failed
+        :rtype:     bool
+        """
+        units = {}
+        for di in dump_info:
+            db_name = self._database_name(di)
+            if not any(key[0] == db_name for key in units):
+                self._connect_to_db(di)
+            units.setdefault((db_name, di.table), []).append(di)
+
+        schedule = sorted(units.itervalues(),
+                          key=lambda dumps: sum(costs[di.path]
+                                                for di in dumps),
+                          reverse=True)
+
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.imap_unordered(_import_worker,
+                                          ((self, dumps) for dumps in
+                                           schedule))
+            return all(list(results))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _import_database(self, dumps):
+        """Import the dumps of a single database in order.
+
+        Deferred indexes of the database are scheduled and its pooled
+        connections are closed afterwards.
+
+        :param dumps:   Dumps that go into the same database
+        :type dumps:    list
 
+        :returns:   False if any import failed
+        :rtype:     bool
+        """
+        db_name = self._database_name(dumps[0])
+        _log.info('Processing database: {0}'.format(db_name))
+
+        success = True
+        for dump_info in dumps:
             try:
-                dump_db.create_pkey_constraint(table)
-            except sqlalchemy.exc.IntegrityError as integrity_error:
-                _log.error(integrity_error)
-                _log.error(
-                    '{0}.{1}: Could not create pkey constraint'.format(
-                        dump_db.name, table))
+                success = self._import_dump(dump_info) and success
+            except Exception as exc:
+                _log.exception('{0.filename}: Import failed: {1}'.format(
+                    dump_info, exc))
+                success = False
+        success = self._flush_deferred_indexes(db_name) and success
+
+        self._release_db(db_name)
+        if self._loader is not None:
+            self._loader.pool.close(db_name)
+        return success
+
+    def _import_concurrent(self, dump_info, databases, costs):
+        """Import given dumps into up to databases databases at once.
+
+        Most of the import of a small wiki is spent waiting for PostgreSQL
+        to create the database and tables, load the data and build the
+        indexes, so databases are imported on threads of a single process.
+        The dumps of a database are imported in order by one thread.
+        Databases are scheduled most expensive first.
+
+        :param costs:   Estimated duration of the import of every dump file
+                        by path (see plan_import)
+        :type costs:    dict
+
+        :returns:   False if any import failed
+        :rtype:     bool
+        """
+        units = {}
+        for di in dump_info:
+            units.setdefault(self._database_name(di), []).append(di)
+        schedule = sorted(units.itervalues(),
+                          key=lambda dumps: sum(costs[di.path]
+                                                for di in dumps),
+                          reverse=True)
+
+        pool = multiprocessing.pool.ThreadPool(databases)
+        try:
+            success = all(list(pool.imap_unordered(self._import_database,
+                                                   schedule)))
+        finally:
+            pool.close()
+            pool.join()
+        return self._wait_for_indexes() and success
+
+    def _find_dumps(self, paths):
+        """Find the dumps of the enabled languages at or beneath given paths.
 
-            dump_db.create_indexes(table)
-            os.remove(path)
+        Only the dumps of the newest complete dump date of every language
+        are returned if the latest option is set.
+
+        :rtype:     list
+        """
+        finder = utils.DumpFinder(
+            self.dump_file_pat,
+            prune=utils.language_pruner(self.enabled_languages,
+                                        self.config.options('Languages')),
+            cache_path=self.options.discovery_cache,
+            latest=self.options.latest)
+        dump_info = sorted(utils.dump_info(finder.find(*paths),
+                                           self.dump_file_pat))
+        dump_info = [di for di in dump_info
+                     if di.language in self.enabled_languages]
+        if self.options.latest:
+            dump_info = utils.latest_dumps(dump_info)
+        return dump_info
+
+    def plan_import(self, paths):
+        """Plan the import of the dumps found at or beneath given paths.
+
+        The plan is based on the databases and tables that exist, the
+        checkpoints, the manifest and the throughput of previous imports
+        recorded in a JSON --metrics-file. No database is changed.
+
+        :param paths:   List of paths to dump files or directories.
+        :type paths:    Iterable
+
+        :returns:   A step for every dump file
+        :rtype:     list of plan.Step
+        """
+        rates = {}
+        if self.options.metrics_format == 'json':
+            rates = plan.throughput(self.options.metrics_file)
+        return [self._plan_step(di, rates) for di in self._find_dumps(paths)]
+
+    def _plan_units(self, steps):
+        """Group planned steps into the units the scheduler runs
+        concurrently.
+        """
+        if self.options.jobs > 1:
+            key = lambda step: (step.database, step.dump_info.table)
+        elif self.options.databases > 1:
+            key = lambda step: step.database
+        else:
+            return [steps]
+
+        units = {}
+        for step in steps:
+            units.setdefault(key(step), []).append(step)
+        return units.values()
+
+    def format_plan(self, steps, fmt='table'):
+        """Format planned steps (see plan_import).
+
+        :param fmt:     table or json
+        :type fmt:      str
+
+        :rtype:     unicode
+        """
+        if self.options.jobs > 1:
+            workers = self.options.jobs
+        else:
+            workers = max(self.options.databases, 1)
+        if fmt == 'json':
+            return plan.to_json(steps, workers, self._plan_units)
+        return plan.to_table(steps, workers, self._plan_units)
 
     def import_dumps(self, paths):
-        """Import newest dumps found at or beneath given paths.
+        """Import dumps found at or beneath given paths.
+
+        Only the dumps of the newest complete dump date of every language
+        are imported if the latest option is set.
 
         :param paths:   List of paths to dump files or directories.
         :type paths:    Iterable
+
+        :returns:   False if the import of any dump failed
+        :rtype:     bool
         """
-        dump_file_paths = utils.dump_file_paths(self.dump_file_pat, *paths)
-        dump_info = sorted(utils.dump_info(dump_file_paths,
-                                           self.dump_file_pat))
-        grouped_dumps = itertools.groupby(dump_info, lambda di: di.language)
-        grouped_dumps = itertools.ifilter(lambda (lang, dumps): lang in
-                                      self.enabled_languages, grouped_dumps)
-
-        for (lang, dumps) in grouped_dumps:
-            _log.info('Processing language: {0}'.format(lang))
-
-            for dump in dumps:
-                if fnmatch.fnmatch(dump.filename, '*pages-articles.xml.bz2'):
-                    self._import_pages_articles(dump)
-                else:
-                    self._import_sql_dump(dump)
+        return self.run_plan(self.plan_import(paths))
+
+    def run_plan(self, steps):
+        """Import the dumps of given plan.
+
+        Steps planned as skipped are not run. The other steps check the
+        state of their tables again when they run, as earlier steps might
+        have changed it (e.g. several dump dates with --delta).
+
+        :param steps:   Planned steps (see plan_import)
+        :type steps:    list of plan.Step
+
+        :returns:   False if the import of any dump failed
+        :rtype:     bool
+        """
+        for step in steps:
+            if step.action == plan.SKIP:
+                _log.info('{0}: Skipped import of {1.filename}'.format(
+                    step.database, step.dump_info))
+        costs = dict((step.dump_info.path, step.seconds) for step in steps)
+        dump_info = [step.dump_info for step in steps
+                     if step.action != plan.SKIP]
+
+        if self.options.jobs > 1:
+            return self._import_parallel(dump_info, self.options.jobs,
+                                         costs)
+
+        if self.options.databases > 1:
+            success = self._import_concurrent(dump_info,
+                                              self.options.databases, costs)
+        else:
+            success = True
+            for (lang, dumps) in itertools.groupby(dump_info,
+                                                   lambda di: di.language):
+                _log.info('Processing language: {0}'.format(lang))
+
+                dumps = list(dumps)
+                for dump in dumps:
+                    success = self._import_dump(dump) and success
+
+                success = self._flush_deferred_indexes() and success
+                for db_name in set(self._database_name(dump)
+                                   for dump in dumps):
+                    self._release_db(db_name)
+
+            success = self._wait_for_indexes() and success
+
+        if self._loader is not None:
+            self._loader.pool.close()
+
+        return success
+
+    def __getstate__(self):
+        # connections and threads can't be shared with worker processes
+        state = self.__dict__.copy()
+        state['_loader'] = None
+        state['_index_pool'] = None
+        state['_index_results'] = []
+        state['_deferred_indexes'] = []
+        state['_lock'] = None
+        state['_catalog_lock'] = None
+        state['_dump_dbs'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._catalog_lock = threading.RLock()
+
+
+def _import_worker(args):
+    """Import dumps within a worker process.
+
+    :param args:    Tuple of the importer and the list of DumpInfo to import
+    :type args:     tuple
+
+    :returns:   False if any import failed
+    :rtype:     bool
+    """
+    (importer, dumps) = args
+    success = True
+    try:
+        for dump_info in dumps:
+            try:
+                success = importer._import_dump(dump_info) and success
+            except Exception as exc:
+                _log.exception('{0.filename}: Import failed: {1}'.format(
+                    dump_info, exc))
+                success = False
+        return importer._wait_for_indexes() and success
+    finally:
+        if importer._loader is not None:
+            importer._loader.pool.close()
+
+
+def _load_shard(args):
+    """Load a shard of a multistream pages-articles dump in a worker
+    process.
+
+    :returns:   True if the shard was loaded successfully
+    :rtype:     bool
+    """
+    (importer, dump_info, tables, shard, namespaces) = args
+    shard_metrics = importer._metrics(
+        dump_info, '{0.table}[{1[0]:d}-{1[1]:d}]'.format(dump_info, shard))
+    try:
+        return importer._load_pages_articles(
+            dump_info, tables,
+            importer._get_pages_articles_rows(dump_info, tables, shard,
+                                              namespaces, shard_metrics))
+    except Exception as exc:
+        _log.exception('{0.filename} [{1[0]:d}-{1[1]:d}]: {2}'.format(
+            dump_info, shard, exc))
+        return False
+    finally:
+        importer._report_metrics(shard_metrics)
+        if importer._loader is not None:
+            importer._loader.pool.close()
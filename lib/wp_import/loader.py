@@ -0,0 +1,374 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.loader
+
+This module contains a loader that writes data into PostgreSQL using
+psycopg2 connections instead of psql subprocesses.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import Queue
+import threading
+
+from contextlib import contextmanager
+
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+import wp_import.exceptions as wpi_exc
+import wp_import.postgresql as wpi_psql
+
+from wp_import.utils import IterFile
+
+_log = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """Small pool of psycopg2 connections for each database.
+
+    :param options:     Command line options obtained from optparse
+    :type options:      optparse.Values
+
+    :param size:        Maximum number of connections per database
+    :type size:         int
+    """
+
+    def __init__(self, options, size=2):
+        super(ConnectionPool, self).__init__()
+        if psycopg2 is None:
+            raise wpi_exc.WPError('psycopg2 is needed for the psycopg2 loader')
+
+        self.options = options
+        self.size = size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _connect_args(self, db_name):
+        conn_args = {
+            'database': db_name,
+            'user': self.options.pg_user,
+            'password': self.options.pg_password,
+            'host': self.options.pg_host,
+            'port': self.options.pg_port,
+        }
+        return dict((key, value) for (key, value) in conn_args.iteritems()
+                    if value)
+
+    def _pool(self, db_name):
+        with self._lock:
+            try:
+                return self._pools[db_name]
+            except KeyError:
+                pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, self.size, **self._connect_args(db_name))
+                self._pools[db_name] = pool
+                return pool
+
+    def connect(self, db_name):
+        """Open a new connection to given database that is not part of the
+        pool.
+        """
+        return psycopg2.connect(**self._connect_args(db_name))
+
+    @contextmanager
+    def connection(self, db_name):
+        """Context manager that lends a connection to given database.
+
+        Uncommitted changes are rolled back when the connection is returned
+        to the pool.
+        """
+        pool = self._pool(db_name)
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            if not conn.closed:
+                conn.rollback()
+            pool.putconn(conn)
+
+    def close(self, db_name=None):
+        """Close all connections (to given database).
+        """
+        with self._lock:
+            if db_name is None:
+                pools = self._pools.values()
+                self._pools = {}
+            elif db_name in self._pools:
+                pools = [self._pools.pop(db_name)]
+            else:
+                pools = []
+
+        for pool in pools:
+            pool.closeall()
+
+
+class Psycopg2Loader(object):
+    """Load INSERT statements and COPY rows using psycopg2.
+
+    :param pool:            Pool the connections are taken from.
+    :type pool:             ConnectionPool
+
+    :param commit_every:    Commit after this many INSERT statements or
+                            1000 times as many COPY rows.
+    :type commit_every:     int
+
+    :param buffer_size:     Size in bytes of the buffers COPY data is sent
+                            in.
+    :type buffer_size:      int
+    """
+
+    def __init__(self, pool, commit_every=100, buffer_size=1 << 20):
+        super(Psycopg2Loader, self).__init__()
+        self.pool = pool
+        self.commit_every = commit_every
+        self.buffer_size = buffer_size
+
+    def execute(self, db_name, table, statements, on_commit=None):
+        """Execute given statements.
+
+        Dump files contain multirow INSERT statements of about one megabyte,
+        so statements are sent one by one. This allows us to count the
+        inserted rows and to report the exact statement that failed.
+
+        :param on_commit:   Callable that is called with the cursor and the
+                            number of executed statements right before each
+                            commit, within the same transaction.
+        :type on_commit:    callable
+
+        :returns:   The number of inserted rows
+        :rtype:     int
+
+        :raises LoadError:  If a statement fails. Statements committed
+                            before stay in the table.
+        """
+        loaded = 0
+        with self.pool.connection(db_name) as conn:
+            cursor = conn.cursor()
+            stmt = None
+            ordinal = 0
+            try:
+                for ordinal, stmt in enumerate(statements, 1):
+                    cursor.execute(stmt)
+                    loaded += max(cursor.rowcount, 0)
+                    if ordinal % self.commit_every == 0:
+                        if on_commit is not None:
+                            on_commit(cursor, ordinal)
+                        conn.commit()
+                if on_commit is not None:
+                    on_commit(cursor, ordinal)
+                conn.commit()
+            except psycopg2.Error as pg_err:
+                raise wpi_exc.LoadError(db_name, table, ordinal, stmt,
+                                        pg_err)
+            finally:
+                cursor.close()
+
+        return loaded
+
+    def copy(self, db_name, table, rows, copy_format='text', on_commit=None,
+             columns=None):
+        """Copy given rows into table.
+
+        :param rows:        Sequence of newline terminated rows in given
+                            COPY format.
+        :type rows:         iterable
+
+        :param columns:     Names of the columns the rows contain (default:
+                            all columns of the table)
+        :type columns:      list
+
+        :param on_commit:   Callable that is called with the cursor and the
+                            number of copied rows right before each commit,
+                            within the same transaction.
+        :type on_commit:    callable
+
+        :returns:   The number of copied rows
+        :rtype:     int
+
+        :raises LoadError:  If COPY fails. Chunks committed before stay in
+                            the table.
+        """
+        rows = iter(rows)
+        copy_stmt = wpi_psql.copy_statement(table, copy_format, columns)
+        chunk_size = self.commit_every * 1000
+        loaded = 0
+        with self.pool.connection(db_name) as conn:
+            cursor = conn.cursor()
+            try:
+                while True:
+                    chunk = IterFile(itertools.islice(rows, chunk_size))
+                    cursor.copy_expert(copy_stmt, chunk, self.buffer_size)
+                    loaded += chunk.count
+                    if on_commit is not None:
+                        on_commit(cursor, loaded)
+                    conn.commit()
+                    if chunk.count < chunk_size:
+                        break
+            except psycopg2.Error as pg_err:
+                raise wpi_exc.LoadError(db_name, table, loaded + 1, None,
+                                        pg_err)
+            finally:
+                cursor.close()
+
+        return loaded
+
+    def delta(self, db_name, table, rows, copy_format='text', on_commit=None,
+              columns=None):
+        """Replace the content of table by given rows, touching only rows that
+        differ.
+
+        The rows are copied into a temporary stage table. Rows missing from
+        the stage table are deleted from table, and new rows are inserted.
+        Everything happens in a single transaction.
+
+        :param rows:        Sequence of newline terminated rows in given
+                            COPY format.
+        :type rows:         iterable
+
+        :param on_commit:   Callable that is called with the cursor and the
+                            number of staged rows right before the commit.
+        :type on_commit:    callable
+
+        :param columns:     Names of the columns the rows contain (default:
+                            all columns of the table)
+        :type columns:      list
+
+        :returns:   The number of deleted and inserted rows
+        :rtype:     tuple
+
+        :raises LoadError:  If the rows can't be applied. The table is left
+                            unchanged.
+        """
+        (stage, create_stmt, delete_stmt, insert_stmt) = \
+                wpi_psql.delta_statements(table)
+        with self.pool.connection(db_name) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(create_stmt)
+                staged = IterFile(rows)
+                cursor.copy_expert(wpi_psql.copy_statement(
+                    stage, copy_format, columns), staged, self.buffer_size)
+                cursor.execute('ANALYZE "{0}"'.format(stage))
+
+                cursor.execute(delete_stmt)
+                deleted = cursor.rowcount
+                cursor.execute(insert_stmt)
+                inserted = cursor.rowcount
+
+                if on_commit is not None:
+                    on_commit(cursor, staged.count)
+                conn.commit()
+            except psycopg2.Error as pg_err:
+                raise wpi_exc.LoadError(db_name, table, 0, None, pg_err)
+            finally:
+                cursor.close()
+
+        return (deleted, inserted)
+
+    def _copy_stream(self, db_name, table, copy_stmt, queue, abort, result):
+        """Copy the rows of given queue into table on a connection of its
+        own until None is received.
+
+        The rows are committed unless abort is set. Remaining rows are
+        discarded after an error, so that the producer is never blocked.
+        """
+        rows = iter(queue.get, None)
+        conn = None
+        try:
+            conn = self.pool.connect(db_name)
+            cursor = conn.cursor()
+            stream = IterFile(rows)
+            cursor.copy_expert(copy_stmt, stream, self.buffer_size)
+            if abort.is_set():
+                conn.rollback()
+            else:
+                conn.commit()
+            result[table] = stream.count
+        except Exception as exc:
+            result[table] = exc
+            for row in rows:
+                pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def copy_streams(self, db_name, columns, rows, copy_format='text',
+                     queue_size=1000):
+        """Copy rows into several tables concurrently.
+
+        Every table is loaded by a COPY on a connection of its own, so the
+        tables don't have to wait for each other.
+
+        :param columns:     Mapping of the names of the tables to the
+                            columns their rows contain.
+        :type columns:      dict
+
+        :param rows:        Sequence of (table, row) tuples with newline
+                            terminated rows in given COPY format.
+        :type rows:         iterable
+
+        :param queue_size:  Maximum number of rows that are buffered for each
+                            table.
+        :type queue_size:   int
+
+        :returns:   The number of copied rows of each table
+        :rtype:     dict
+
+        :raises LoadError:  If a COPY fails. Tables whose COPY succeeded
+                            keep their rows.
+        """
+        queues = {}
+        threads = []
+        result = {}
+        abort = threading.Event()
+
+        for (table, table_columns) in columns.iteritems():
+            queues[table] = Queue.Queue(queue_size)
+            thread = threading.Thread(
+                target=self._copy_stream,
+                args=(db_name, table,
+                      wpi_psql.copy_statement(table, copy_format,
+                                              table_columns),
+                      queues[table], abort, result))
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for (table, row) in rows:
+                queues[table].put(row)
+        except:
+            abort.set()
+            raise
+        finally:
+            for queue in queues.itervalues():
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        for (table, count) in result.iteritems():
+            if isinstance(count, Exception):
+                raise wpi_exc.LoadError(db_name, table, 0, None, count)
+        return result
@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.manifest
+
+This module keeps a local record of the imported dump files, so that files
+that did not change since they were imported can be skipped without
+looking at the database.
+
+Files are identified by path, size and modification time. A file whose
+modification time changed (e.g. copied by a mirror script) is only
+considered changed if its content hash differs. The hash covers the size
+and evenly spaced samples of the file, so it is computed in milliseconds
+even for dumps of many gigabytes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+_log = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+# status of a dump file
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+
+def content_hash(path, samples=16, sample_size=1 << 16):
+    """Compute a fast hash of the content of given file.
+
+    The hash covers the size of the file and samples of sample_size bytes
+    taken at samples evenly spaced offsets, including the start and the end
+    of the file. Small files are hashed completely.
+
+    :param path:            Path to the file
+    :type path:             str
+
+    :param samples:         Number of samples
+    :type samples:          int
+
+    :param sample_size:     Size of every sample
+    :type sample_size:      int
+
+    :rtype:     str
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode('ascii'))
+    with open(path, 'rb') as dump_f:
+        if size <= samples * sample_size:
+            for data in iter(lambda: dump_f.read(1 << 20), b''):
+                digest.update(data)
+            return digest.hexdigest()
+
+        step = (size - sample_size) // (samples - 1)
+        for i in range(samples):
+            dump_f.seek(i * step)
+            digest.update(dump_f.read(sample_size))
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """Imported dump files.
+
+    The manifest is a JSON file. Every entry is keyed by the absolute path
+    of a dump file and records its size, modification time and content
+    hash, the database and tables it was imported into, the number of rows
+    loaded (if known) and the time of the import.
+
+    :param path:    Path to the manifest file. It is created by the first
+                    call of record.
+    :type path:     str
+    """
+
+    def __init__(self, path):
+        super(Manifest, self).__init__()
+        self.path = path
+        self.entries = self._read()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'rb') as manifest_f:
+            content = json.loads(manifest_f.read().decode('utf8'))
+        if content.get('version') != MANIFEST_VERSION:
+            _log.warning('{0}: Unknown manifest version {1}. Ignored'.format(
+                self.path, content.get('version')))
+            return {}
+        return content['files']
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Lock the manifest against writes of other processes.
+        """
+        with open(self.path + '.lock', 'a') as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    def status(self, path, database):
+        """Check whether given dump file was imported into given database
+        and did not change since. The manifest is not written.
+
+        :returns:   NEW, CHANGED or UNCHANGED
+        :rtype:     unicode
+        """
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None or entry['database'] != database:
+            return NEW
+
+        stat = os.stat(path)
+        if stat.st_size != entry['size']:
+            return CHANGED
+        if stat.st_mtime == entry['mtime']:
+            return UNCHANGED
+        if content_hash(path) != entry['hash']:
+            return CHANGED
+        return UNCHANGED
+
+    def touch(self, path):
+        """Save the modification time of an unchanged dump file (see
+        status), so that it is not hashed again.
+        """
+        key = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime
+        if self.entries[key]['mtime'] != mtime:
+            self._update(key, dict(self.entries[key], mtime=mtime))
+
+    def record(self, path, database, tables, rows=None):
+        """Record the import of given dump file and save the manifest.
+
+        :param database:    Name of the database
+        :type database:     unicode
+
+        :param tables:      Tables the dump was imported into
+        :type tables:       list
+
+        :param rows:        Number of rows loaded or None if not known
+        :type rows:         int
+        """
+        stat = os.stat(path)
+        self._update(os.path.abspath(path), {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': content_hash(path),
+            'database': database,
+            'tables': list(tables),
+            'rows': rows,
+            'imported': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        })
+
+    def _update(self, key, entry):
+        """Write an entry into the manifest.
+
+        Entries written by other processes since the manifest was read are
+        kept and the file is replaced atomically.
+        """
+        self.entries[key] = entry
+        with self._locked():
+            entries = self._read()
+            entries[key] = entry
+            (fd, tmp_path) = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'wb') as manifest_f:
+                manifest_f.write(json.dumps(
+                    {'version': MANIFEST_VERSION, 'files': entries},
+                    indent=1, sort_keys=True).encode('utf8'))
+            os.rename(tmp_path, self.path)
@@ -0,0 +1,342 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.metrics
+
+This module measures the import of a table: the time spent in every stage
+of the pipeline, counters like the number of statements and rows, and the
+progress within the compressed dump file.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import timeit
+
+_log = logging.getLogger(__name__)
+
+# counters of events deep within the pipeline (e.g. decode fallbacks) of
+# every thread that imports a table
+_local = threading.local()
+_counters_lock = threading.Lock()
+
+
+def counters():
+    """Get the counters of the current thread (see count).
+
+    :rtype: collections.defaultdict
+    """
+    try:
+        return _local.counters
+    except AttributeError:
+        _local.counters = collections.defaultdict(int)
+        return _local.counters
+
+
+def share_counters(thread_counters):
+    """Count the events of the current thread in the counters of another
+    thread, e.g. in the threads of a pipeline (see utils.buffered).
+
+    :param thread_counters: Counters as returned by counters
+    :type thread_counters:  collections.defaultdict
+    """
+    _local.counters = thread_counters
+
+
+def count(name, value=1):
+    """Increase a counter of the current thread.
+
+    Metrics objects report how much the counters of the thread that created
+    them increased during their lifetime, so concurrent imports on other
+    threads are not included. Counts of parse worker processes are not
+    included either.
+    """
+    with _counters_lock:
+        counters()[name] += value
+
+
+class Metrics(object):
+    """Metrics of the import of a single table.
+
+    :param name:                Name of the import (e.g. db_name.table)
+    :type name:                 unicode
+
+    :param progress_interval:   Log the progress every progress_interval
+                                seconds (0: never)
+    :type progress_interval:    float
+    """
+
+    def __init__(self, name, progress_interval=0):
+        super(Metrics, self).__init__()
+        self.name = name
+        self.progress_interval = progress_interval
+        self.counters = collections.defaultdict(int)
+        self.stages = collections.OrderedDict()
+        self.seconds = None
+        self._counters = counters()
+        self._start_counters = dict(self._counters)
+        self._start = timeit.default_timer()
+        self._last_progress = self._start
+        self._file = None
+        self._file_size = 0
+        self._position = 0
+
+    def add(self, name, value=1):
+        self.counters[name] += value
+
+    def watch(self, compressed_file):
+        """Report the progress within given file.
+
+        :param compressed_file:     File opened by utils.open_compressed
+        :type compressed_file:      utils.DecompressedFile
+        """
+        self._file = compressed_file
+        self._file_size = os.fstat(compressed_file.raw.fileno()).st_size
+
+    def position(self):
+        """Number of compressed bytes of the watched file read so far.
+        """
+        if self._file is not None and not self._file.raw.closed:
+            # the offset is shared with external decompressors
+            self._position = os.lseek(self._file.raw.fileno(), 0, os.SEEK_CUR)
+        return self._position
+
+    def stage(self, name, seq, counter=None, size=None):
+        """Measure the time spent in a stage of a pipeline.
+
+        The time includes the time spent in previous stages, which is
+        subtracted when the metrics are reported.
+
+        :param name:    Name of the stage
+        :type name:     unicode
+
+        :param seq:     Output of the stage
+        :type seq:      iterable
+
+        :param counter: Name of the counter that counts the elements of the
+                        output
+        :type counter:  unicode
+
+        :param size:    Callable that returns the size of an element, which
+                        is added to counter instead of 1.
+        :type size:     callable
+        """
+        # stages are registered in the order the pipeline is built
+        self.stages[name] = 0.0
+        return self._measure(name, iter(seq), counter, size)
+
+    def _measure(self, name, it, counter, size):
+        timer = timeit.default_timer
+        while True:
+            start = timer()
+            try:
+                el = next(it)
+            except StopIteration:
+                self.stages[name] += timer() - start
+                # remember the position before the file is closed
+                self.position()
+                return
+            now = timer()
+            self.stages[name] += now - start
+            if counter is not None:
+                self.counters[counter] += 1 if size is None else size(el)
+
+            if (self.progress_interval
+                and now - self._last_progress >= self.progress_interval):
+                self._last_progress = now
+                self.log_progress()
+            yield el
+
+    def log_progress(self):
+        """Log the progress within the watched file and an ETA.
+        """
+        elapsed = timeit.default_timer() - self._start
+        position = self.position()
+        if not self._file_size or not position:
+            _log.info('{0}: {1:.0f}s elapsed'.format(self.name, elapsed))
+            return
+
+        rate = position / elapsed
+        _log.info('{0}: {1:.1f}% ({2:.1f} of {3:.1f} MB) at {4:.2f} MB/s, '
+                  'ETA {5:.0f}s'.format(
+                      self.name, 100 * position / self._file_size,
+                      position / (1 << 20), self._file_size / (1 << 20),
+                      rate / (1 << 20), (self._file_size - position) / rate))
+
+    def finish(self):
+        """Stop measuring.
+
+        The time the consumer of the last stage (i.e. the loader) spent is
+        recorded as stage load.
+        """
+        if self.seconds is not None:
+            return
+        self.seconds = timeit.default_timer() - self._start
+        if self._file is not None:
+            self.counters['bytes_compressed'] = self.position()
+        for (name, value) in self._counters.items():
+            if value != self._start_counters.get(name, 0):
+                self.counters[name] = value - self._start_counters.get(name, 0)
+
+        pipeline = max(self.stages.values()) if self.stages else 0.0
+        self.stages['load'] = max(self.seconds - pipeline, 0.0)
+
+    def stage_seconds(self):
+        """Time spent in every stage without the time of previous stages.
+
+        :rtype: collections.OrderedDict
+        """
+        seconds = collections.OrderedDict()
+        previous = 0.0
+        for (name, inclusive) in self.stages.iteritems():
+            if name == 'load':
+                seconds[name] = inclusive
+                continue
+            seconds[name] = max(inclusive - previous, 0.0)
+            previous = inclusive
+        return seconds
+
+    def report(self):
+        """Get all metrics.
+
+        :rtype: dict
+        """
+        self.finish()
+        return {
+            'name': self.name,
+            'seconds': round(self.seconds, 3),
+            'counters': dict(self.counters),
+            'stages': collections.OrderedDict(
+                (name, round(seconds, 3))
+                for (name, seconds) in self.stage_seconds().iteritems()),
+        }
+
+    def summary(self):
+        """One line summary of the metrics.
+        """
+        self.finish()
+        stages = ', '.join('{0} {1:.1f}s'.format(name, seconds) for
+                           (name, seconds) in self.stage_seconds().iteritems())
+        counters = ', '.join(
+            '{0} {1:d}'.format(name, value)
+            for (name, value) in sorted(self.counters.iteritems()))
+        return '{0}: {1:.1f}s ({2}) {3}'.format(self.name, self.seconds,
+                                                 stages, counters)
+
+
+def stage(metrics, name, seq, counter=None, size=None):
+    """Measure given stage (see Metrics.stage) if metrics is not None.
+
+    :returns:   seq or the measured output of the stage
+    :rtype:     iterable
+    """
+    if metrics is None:
+        return seq
+    return metrics.stage(name, seq, counter, size)
+
+
+def _prometheus_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name).lower()
+
+
+def _prometheus_labels(report):
+    return 'import="{0}"'.format(report['name'].replace('"', '\\"'))
+
+
+def prometheus_text(reports):
+    """Format metrics reports in the Prometheus text exposition format.
+
+    :param reports:     Reports as returned by Metrics.report
+    :type reports:      list
+    """
+    lines = []
+    for report in reports:
+        labels = _prometheus_labels(report)
+        lines.append('wp_import_seconds{{{0}}} {1}'.format(
+            labels, report['seconds']))
+        for (name, value) in sorted(report['stages'].iteritems()):
+            lines.append('wp_import_stage_seconds{{{0},stage="{1}"}} '
+                         '{2}'.format(labels, name, value))
+        for (name, value) in sorted(report['counters'].iteritems()):
+            lines.append('wp_import_{0}_total{{{1}}} {2}'.format(
+                _prometheus_name(name), labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsWriter(object):
+    """Write metrics reports to a file.
+
+    :param path:        Path to the file
+    :type path:         str
+
+    :param fmt:         json (one JSON object per line, appended) or
+                        prometheus (textfile for the textfile collector of
+                        the node exporter)
+    :type fmt:          str
+    """
+
+    def __init__(self, path, fmt='json'):
+        super(MetricsWriter, self).__init__()
+        self.path = path
+        self.fmt = fmt
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Lock the file against writes of other processes and threads.
+        """
+        with open(self.path + '.lock', 'a') as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    def write(self, report):
+        with self._locked():
+            if self.fmt == 'json':
+                with open(self.path, 'a') as metrics_f:
+                    metrics_f.write(json.dumps(report) + '\n')
+            else:
+                self._write_prometheus(report)
+
+    def _write_prometheus(self, report):
+        # keep the metrics of other imports, possibly written by other
+        # processes, and replace the file atomically
+        labels = _prometheus_labels(report).encode('utf8')
+        lines = []
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as metrics_f:
+                lines = [line for line in metrics_f
+                         if b'{' + labels + b'}' not in line
+                         and b'{' + labels + b',' not in line]
+        lines.append(prometheus_text([report]).encode('utf8'))
+
+        (fd, tmp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, 'wb') as metrics_f:
+            metrics_f.write(b''.join(lines))
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,244 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.mysql
+
+This module contains functions for parsing the MySQL dump files published by
+the Wikimedia foundation.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import logging
+import re
+
+_log = logging.getLogger(__name__)
+
+# a single row of a multirow INSERT: '(' followed by quoted strings or
+# unquoted values up to the closing ')'
+_ROW_PAT = re.compile(r"""\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)""", re.S)
+
+# the same for undecoded statements
+_ROW_BYTES_PAT = re.compile(_ROW_PAT.pattern.encode('ascii'), re.S)
+
+# a single field within a row
+_FIELD_PAT = re.compile(r"""'((?:[^'\\]|\\.)*)'|([^,']+)""", re.S)
+
+_ESCAPE_PAT = re.compile(r'\\(.)', re.S)
+
+# lines of a CREATE TABLE statement
+_CREATE_PAT = re.compile(br'^CREATE TABLE `(?P<table>[^`]+)`')
+_COLUMN_PAT = re.compile(br'''^\s*`(?P<name>[^`]+)`\s+(?P<type>\w+)'''
+                         br'''(?:\((?P<length>[^)]*)\))?(?P<options>.*)$''')
+_KEY_PAT = re.compile(br'''^\s*(?P<kind>PRIMARY|UNIQUE|FULLTEXT)?\s*'''
+                      br'''(?:KEY|INDEX)\s*(?:`(?P<name>[^`]+)`)?\s*'''
+                      br'''\((?P<columns>.*)\)''')
+_NAME_PAT = re.compile(br'`([^`]+)`')
+
+_BINARY_TYPES = frozenset(['binary', 'varbinary', 'tinyblob', 'blob',
+                           'mediumblob', 'longblob'])
+
+# a column of a CREATE TABLE statement: type is the lower case MySQL type
+# (e.g. int, varchar), length the text within the parentheses after the
+# type or None
+Column = collections.namedtuple(
+    'Column', 'name type length unsigned binary nullable')
+
+Key = collections.namedtuple('Key', 'name unique columns')
+
+# the table definition in the header of a dump: columns is a list of
+# Column tuples, primary_key a tuple of column names and keys a list of the
+# other keys
+Schema = collections.namedtuple('Schema', 'table columns primary_key keys')
+
+# backslash escape sequences written by mysqldump
+_ESCAPES = {
+    '0': '\0',
+    'b': '\b',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'Z': '\x1a',
+}
+
+
+def unescape(value):
+    """Resolve the backslash escape sequences of a quoted MySQL string.
+
+    :param value:   Content of a quoted MySQL string without the enclosing
+                    quotes.
+    :type value:    unicode
+    """
+    if '\\' not in value:
+        return value
+    return _ESCAPE_PAT.sub(lambda mat: _ESCAPES.get(mat.group(1),
+                                                    mat.group(1)), value)
+
+
+def _column(col_mat):
+    col_type = col_mat.group('type').decode('ascii').lower()
+    options = col_mat.group('options').lower()
+    length = col_mat.group('length')
+    return Column(
+        col_mat.group('name').decode('utf8'), col_type,
+        None if length is None else length.decode('utf8'),
+        b'unsigned' in options,
+        col_type in _BINARY_TYPES or b' binary' in options,
+        b'not null' not in options)
+
+
+def parse_create_table(lines):
+    """Parse a CREATE TABLE statement written by mysqldump.
+
+    :param lines:   Lines of the statement, starting with CREATE TABLE
+    :type lines:    iterable of bytes
+
+    :rtype: Schema
+    """
+    lines = iter(lines)
+    table = _CREATE_PAT.match(next(lines)).group('table').decode('utf8')
+    columns = []
+    primary_key = ()
+    keys = []
+    for line in lines:
+        if line.startswith(b')'):
+            break
+        col_mat = _COLUMN_PAT.match(line.rstrip().rstrip(b','))
+        if col_mat is not None:
+            columns.append(_column(col_mat))
+            continue
+        key_mat = _KEY_PAT.match(line)
+        if key_mat is None:
+            continue
+        key_columns = tuple(name.decode('utf8') for name in
+                            _NAME_PAT.findall(key_mat.group('columns')))
+        if key_mat.group('kind') == b'PRIMARY':
+            primary_key = key_columns
+        else:
+            keys.append(Key((key_mat.group('name') or b'').decode('utf8'),
+                            key_mat.group('kind') == b'UNIQUE',
+                            key_columns))
+    return Schema(table, columns, primary_key, keys)
+
+
+def split_header(lines):
+    """Read the header of a dump file up to the first INSERT statement.
+
+    :param lines:   Lines of the dump file
+    :type lines:    iterable of bytes
+
+    :returns:   The Schema of the CREATE TABLE statement in the header (None
+                if there is none) and the remaining lines, starting with the
+                first INSERT statement.
+    :rtype:     tuple
+    """
+    lines = iter(lines)
+    schema = None
+    create_table = None
+    for line in lines:
+        if line.startswith(b'INSERT'):
+            return (schema, itertools.chain([line], lines))
+        if create_table is not None:
+            create_table.append(line)
+            if line.startswith(b')'):
+                schema = parse_create_table(create_table)
+                create_table = None
+        elif _CREATE_PAT.match(line):
+            create_table = [line]
+    return (schema, iter([]))
+
+
+def timestamp_columns(schema):
+    """Get the positions of the timestamp columns.
+
+    :param schema:  Schema as returned by split_header or None
+    :type schema:   Schema
+
+    :rtype:     tuple
+    """
+    if schema is None:
+        return ()
+    return tuple(pos for (pos, column) in enumerate(schema.columns)
+                 if column.type == 'timestamp')
+
+
+def values_offset(insert_stmt):
+    """Get the offset of the first row within an INSERT statement.
+
+    :param insert_stmt:     INSERT statement
+    :type insert_stmt:      string
+    """
+    return insert_stmt.index('VALUES') + len('VALUES')
+
+
+def row_spans(insert_stmt, pos=None, endpos=None):
+    """Generator that yields the offsets of the rows of a multirow INSERT
+    statement.
+
+    The statement is scanned once and quoted strings are skipped, so rows
+    containing '),(' are found correctly. The statement does not have to be
+    decoded.
+
+    :param insert_stmt:     Multirow INSERT statement
+    :type insert_stmt:      bytes or unicode
+
+    :param pos:             Offset of the first row (default: after VALUES)
+    :type pos:              int
+
+    :param endpos:          Stop scanning at this offset
+    :type endpos:           int
+
+    :returns:   (start, end) tuples, insert_stmt[start:end] is a row
+                including its parentheses
+    :rtype:     iterable
+    """
+    if isinstance(insert_stmt, unicode):
+        (pat, values) = (_ROW_PAT, 'VALUES')
+    else:
+        (pat, values) = (_ROW_BYTES_PAT, b'VALUES')
+    if pos is None:
+        pos = insert_stmt.index(values) + len(values)
+    if endpos is None:
+        endpos = len(insert_stmt)
+    for row_mat in pat.finditer(insert_stmt, pos, endpos):
+        yield row_mat.span()
+
+
+def values_rows(insert_stmt):
+    """Generator that yields the rows of a multirow INSERT statement.
+
+    Each row is a tuple of unescaped values. Unquoted values (numbers) are
+    returned as strings, NULL as None.
+
+    :param insert_stmt:     Multirow INSERT statement
+    :type insert_stmt:      unicode
+    """
+    for row_mat in _ROW_PAT.finditer(insert_stmt, values_offset(insert_stmt)):
+        row = []
+        for field_mat in _FIELD_PAT.finditer(row_mat.group(1)):
+            quoted, unquoted = field_mat.groups()
+            if quoted is not None:
+                row.append(unescape(quoted))
+            else:
+                unquoted = unquoted.strip()
+                if unquoted:
+                    row.append(None if unquoted == 'NULL' else unquoted)
+        yield tuple(row)
@@ -0,0 +1,186 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.plan
+
+This module describes what an import run will do before it starts: the
+action taken for every dump file and an estimate of its duration, which is
+based on the compressed size of the file and the throughput of previous
+imports of the same table.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import heapq
+import json
+import logging
+import os
+
+_log = logging.getLogger(__name__)
+
+# actions of a step
+CREATE = 'create'
+SKIP = 'skip'
+REIMPORT = 'reimport'
+RESUME = 'resume'
+DELTA = 'delta'
+
+# compressed bytes per second assumed if there are no previous imports
+DEFAULT_THROUGHPUT = 2 << 20
+
+# a dump file, the database and tables it is imported into, the action
+# and the estimated duration in seconds
+Step = collections.namedtuple('Step',
+                              'dump_info database tables action seconds')
+
+
+def _table_of(name):
+    """Get the table from the name of a metrics report (e.g.
+    wp_de.pagelinks or wp_de.text[0-1024]).
+    """
+    return name.rsplit('.', 1)[-1].split('[', 1)[0]
+
+
+def throughput(metrics_path):
+    """Read the throughput of previous imports from a JSON metrics file
+    (see metrics.MetricsWriter).
+
+    :returns:   Compressed bytes per second of every table and of all tables
+                (key None)
+    :rtype:     dict
+    """
+    (size, seconds) = (collections.defaultdict(int),
+                       collections.defaultdict(float))
+    if not metrics_path or not os.path.exists(metrics_path):
+        return {}
+
+    with open(metrics_path, 'rb') as metrics_f:
+        for line in metrics_f:
+            try:
+                report = json.loads(line.decode('utf8'))
+            except ValueError:
+                continue
+            compressed = report.get('counters', {}).get('bytes_compressed')
+            if not compressed or not report.get('seconds'):
+                continue
+            for table in (_table_of(report['name']), None):
+                size[table] += compressed
+                seconds[table] += report['seconds']
+
+    return dict((table, size[table] / seconds[table]) for table in size
+                if seconds[table] > 0)
+
+
+def estimate(size, table, action, rates):
+    """Estimate the duration of a step in seconds.
+
+    :param size:    Compressed size of the dump file
+    :type size:     int
+
+    :param rates:   Throughput as returned by throughput
+    :type rates:    dict
+    """
+    if action == SKIP or not size:
+        return 0.0
+    rate = rates.get(table) or rates.get(None) or DEFAULT_THROUGHPUT
+    return size / rate
+
+
+def makespan(costs, workers=1):
+    """Estimate the duration of a run if given costs are scheduled largest
+    first on workers workers.
+
+    :param costs:   Durations of the units of work
+    :type costs:    iterable
+
+    :rtype:     float
+    """
+    loads = [0.0] * max(workers, 1)
+    for cost in sorted(costs, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + cost)
+    return max(loads)
+
+
+def summary(steps, workers=1, units=None):
+    """Totals of a plan.
+
+    :param units:   Function that groups the steps into units of work that
+                    can't run concurrently (default: every step is a unit)
+    :type units:    callable
+
+    :rtype:     dict
+    """
+    todo = [step for step in steps if step.action != SKIP]
+    groups = units(todo) if units is not None else [[step] for step in todo]
+    actions = collections.Counter(step.action for step in steps)
+    return {
+        'files': len(steps),
+        'actions': dict(actions),
+        'bytes': sum(step.dump_info.size or 0 for step in todo),
+        'seconds': round(sum(step.seconds for step in todo), 1),
+        'workers': workers,
+        'makespan': round(makespan(
+            [sum(step.seconds for step in group) for group in groups],
+            workers), 1),
+    }
+
+
+def to_json(steps, workers=1, units=None):
+    """Format a plan as JSON.
+    """
+    return json.dumps({
+        'steps': [{
+            'database': step.database,
+            'tables': list(step.tables),
+            'path': step.dump_info.path,
+            'language': step.dump_info.language,
+            'date': step.dump_info.date,
+            'bytes': step.dump_info.size,
+            'action': step.action,
+            'seconds': round(step.seconds, 1),
+        } for step in steps],
+        'summary': summary(steps, workers, units),
+    }, indent=2, separators=(',', ': '), sort_keys=True)
+
+
+def to_table(steps, workers=1, units=None):
+    """Format a plan as a text table.
+    """
+    lines = ['{0:<24} {1:<20} {2:<8} {3:>10} {4:>10}  {5}'.format(
+        'database', 'table', 'action', 'MB', 'seconds', 'file')]
+    for step in steps:
+        lines.append('{0:<24} {1:<20} {2:<8} {3:>10.1f} {4:>10.1f}  '
+                     '{5}'.format(step.database, ','.join(step.tables),
+                                  step.action,
+                                  (step.dump_info.size or 0) / (1 << 20),
+                                  step.seconds, step.dump_info.filename))
+
+    totals = summary(steps, workers, units)
+    lines.append('')
+    lines.append('{0} files ({1}), {2:.1f} MB to load, {3:.0f}s of work, '
+                 'about {4:.0f}s with {5} workers'.format(
+                     totals['files'],
+                     ', '.join('{0} {1}'.format(count, action) for
+                               (action, count) in
+                               sorted(totals['actions'].iteritems())),
+                     totals['bytes'] / (1 << 20), totals['seconds'],
+                     totals['makespan'], workers))
+    return '\n'.join(lines)
@@ -24,14 +24,17 @@ This module contains functions that are specific to PostgreSQL.
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import collections
 import itertools
-import fnmatch
 import logging
-import os
+import multiprocessing
 import re
 
 import wp_import
 import wp_import.exceptions as wpi_exc
+import wp_import.metrics as wpi_metrics
+import wp_import.mysql as wpi_mysql
+import wp_import.rowfilter as wpi_rowfilter
 import wp_import.utils as wpi_utils
 
 _log = logging.getLogger(__name__)
@@ -60,50 +63,703 @@ def timestamp_to_iso_8601(seq):
     return (timestamp_pat.sub(r"\1'\2-\3-\4T\5:\6:\7Z'\8", el) for el in seq)
 
 
-def insert_statements(file_path):
-    """Get insert statements from given file"""
-    with wpi_utils.open_compressed(file_path) as dump_file:
-        if fnmatch.fnmatch(os.path.basename(file_path), '*categorylinks*'):
-            statements = categorylinks_pipeline(dump_file)
-        else:
-            statements = generic_pipeline(dump_file)
+def insert_statements(file_path, decompressor='auto', metrics=None):
+    """Get insert statements from given file.
+
+    The stages of the pipeline are measured if metrics (a
+    wp_import.metrics.Metrics object) is given.
+    """
+    with wpi_utils.open_compressed(file_path, decompressor) as dump_file:
+        statements = generic_pipeline(_watch(metrics, dump_file), metrics)
+        statements = wpi_metrics.stage(metrics, 'output', statements,
+                                       'statements')
 
         for stmt in statements:
             yield stmt
 
 
-def generic_pipeline(seq):
+def _watch(metrics, dump_file):
+    """Measure the decompression of given file if metrics is not None.
+    """
+    if metrics is None:
+        return dump_file
+    metrics.watch(dump_file)
+    return metrics.stage('decompression', dump_file, 'bytes_decompressed',
+                         len)
+
+
+def generic_pipeline(seq, metrics=None):
     """Preprocessing pipeline needed for all dump files.
 
     Steps in this pipeline:
 
+        * Read the columns from the header of the dump
         * Extract INSERT statements
         * Convert strings to unicode
         * Strip strings
-        * Replace MySQL quotes with psql ones
+        * Replace MySQL quotes with psql ones and convert timestamp
+          columns (see transform_insert)
 
     :param seq: Sequence of strings
     :type seq:  Iterable
+
+    :param metrics: Measure the stages of the pipeline
+    :type metrics:  wp_import.metrics.Metrics
     """
+    (schema, seq) = wpi_mysql.split_header(seq)
+    timestamp_columns = wpi_mysql.timestamp_columns(schema)
     seq = wpi_utils.filter_strings(r'^INSERT', seq)
+    seq = wpi_metrics.stage(metrics, 'filter_strings', seq)
     seq = wpi_utils.convert_multirow_to_unicode(seq)
-    seq = (el.strip() for el in seq)
-    seq = psql_quotation(seq)
+    seq = wpi_metrics.stage(metrics, 'convert_multirow_to_unicode', seq)
+    seq = (transform_insert(el.strip(), timestamp_columns) for el in seq)
+    seq = wpi_metrics.stage(metrics, 'transform_insert', seq)
     return seq
 
 
-def categorylinks_pipeline(seq):
+def categorylinks_pipeline(seq, metrics=None):
     """Preprocessing pipeline for categorylinks.
 
-    Steps in this pipeline:
-
-        * Timestamp conversion
+    The timestamp columns of all tables are converted by generic_pipeline,
+    so this is the same pipeline.
 
     :param seq: Sequence of strings containing INSERT statements
     :type seq:  Iterable
+
+    :param metrics: Measure the stages of the pipeline
+    :type metrics:  wp_import.metrics.Metrics
+    """
+    return generic_pipeline(seq, metrics)
+
+
+# a field of a row: a quoted string or an unquoted value
+_FIELD = r"""(?:'(?:[^'\\]|\\.)*'|[^',()]*)"""
+
+_ROW_PATTERNS = {}
+
+_TOKENS = {
+    unicode: ('VALUES', '`', '"', '%', '%%', "'%s-%s-%sT%s:%s:%sZ'", ''),
+    bytes: (b'VALUES', b'`', b'"', b'%', b'%%', b"'%s-%s-%sT%s:%s:%sZ'",
+            b''),
+}
+
+
+def _row_pattern(kind, positions):
+    """Get the pattern that matches the start of a row up to the last
+    column in positions, or a quoted string outside of a row.
+
+    The text before the columns in positions is captured by the odd groups,
+    the columns by the even groups.
+    """
+    key = (kind, positions)
+    if key not in _ROW_PATTERNS:
+        value = r'(\d{14}(?=[,)])|' + _FIELD + ')'
+        pattern = r'(\((?:' + _FIELD + ',){%d})' % positions[0] + value
+        for (previous, pos) in zip(positions, positions[1:]):
+            pattern += (r'((?:,' + _FIELD + '){%d},)' % (pos - previous - 1)
+                        + value)
+        pattern += r"""|'(?:[^'\\]|\\.)*'"""
+        if kind is bytes:
+            pattern = pattern.encode('ascii')
+        _ROW_PATTERNS[key] = re.compile(pattern, re.S)
+    return _ROW_PATTERNS[key]
+
+
+def transform_insert(stmt, timestamp_columns=(), escape_percent=False):
+    """Transform a multirow INSERT statement of a MySQL dump for PostgreSQL.
+
+    Only the identifier quotes before VALUES are replaced, so quoted strings
+    containing ` are left alone. Unquoted MySQL timestamps (YYYYMMDDHHMMSS)
+    in given columns are converted to quoted ISO 8601 timestamps, skipping
+    quoted strings while the rows are scanned.
+
+    :param stmt:                Multirow INSERT statement
+    :type stmt:                 unicode or bytes
+
+    :param timestamp_columns:   Positions of the timestamp columns (see
+                                mysql.timestamp_columns)
+    :type timestamp_columns:    tuple
+
+    :param escape_percent:      Escape % as %% for drivers that interpolate
+                                parameters into the statement
+    :type escape_percent:       bool
+    """
+    kind = unicode if isinstance(stmt, unicode) else bytes
+    (values, backtick, quote, percent, escaped_percent, iso_8601,
+     empty) = _TOKENS[kind]
+    offset = stmt.find(values)
+    if offset == -1:
+        return stmt
+    offset += len(values)
+    body = stmt[offset:]
+
+    if timestamp_columns:
+
+        def convert_row(row_mat):
+            parts = row_mat.groups()
+            if parts[0] is None:
+                # a quoted string outside of a row
+                return row_mat.group(0)
+            parts = list(parts)
+            for i in xrange(1, len(parts), 2):
+                value = parts[i]
+                if len(value) == 14 and value.isdigit():
+                    parts[i] = iso_8601 % (value[:4], value[4:6], value[6:8],
+                                           value[8:10], value[10:12],
+                                           value[12:])
+            return empty.join(parts)
+
+        body = _row_pattern(kind, tuple(sorted(timestamp_columns))).sub(
+            convert_row, body)
+
+    if escape_percent and percent in body:
+        body = body.replace(percent, escaped_percent)
+    return stmt[:offset].replace(backtick, quote) + body
+
+
+def raw_insert_statements(file_path, decompressor='auto', skip=0,
+                          metrics=None, escape_percent=False, buffering=None,
+                          row_filter=None):
+    """Get UTF-8 encoded insert statements from given file.
+
+    The first skip of the transformed statements are dropped. Statements
+    without decodable or matching rows are dropped by the transformation,
+    so skip counts the statements yielded (e.g. by a previous import, see
+    checkpoint) rather than those in the file. The stages of the pipeline
+    are measured if metrics is given. % is escaped as %% if escape_percent
+    is True.
+
+    If buffering (max_entries, max_bytes) is given, the file is read in a
+    thread of its own that works ahead of the transformation within these
+    limits (see utils.buffered).
+
+    If row_filter (see rowfilter.RowFilter) is given, only matching rows
+    are kept.
+    """
+    with wpi_utils.open_compressed(file_path, decompressor) as dump_file:
+        (schema, lines) = wpi_mysql.split_header(_watch(metrics, dump_file))
+        resolved = wpi_rowfilter.resolve(row_filter, schema)
+        statements = wpi_utils.filter_strings(br'^INSERT', lines)
+        if buffering is not None:
+            statements = wpi_utils.buffered(statements, *buffering)
+        statements = raw_pipeline(statements,
+                                  wpi_mysql.timestamp_columns(schema),
+                                  metrics, escape_percent, resolved)
+        statements = itertools.islice(statements, skip, None)
+        statements = wpi_metrics.stage(metrics, 'output', statements,
+                                       'statements')
+
+        for stmt in statements:
+            yield stmt
+
+
+def raw_pipeline(seq, timestamp_columns=(), metrics=None,
+                 escape_percent=False, row_filter=None):
+    """Preprocessing pipeline that works on bytes.
+
+    This pipeline yields the same statements as generic_pipeline, but UTF-8
+    encoded and newline terminated. Statements are only decoded if they are
+    not valid UTF-8.
+
+    Steps in this pipeline:
+
+        * Extract INSERT statements
+        * Drop and project rows if a filter is given
+        * Validate UTF-8
+        * Replace MySQL quotes with psql ones, convert timestamp columns
+          and escape % if needed (see transform_insert)
+
+    :param seq:                 Sequence of bytes
+    :type seq:                  Iterable
+
+    :param timestamp_columns:   Positions of the timestamp columns
+    :type timestamp_columns:    tuple
+
+    :param metrics:             Measure the stages of the pipeline
+    :type metrics:              wp_import.metrics.Metrics
+
+    :param escape_percent:      Escape % as %%
+    :type escape_percent:       bool
+
+    :param row_filter:          Filter resolved against the columns of the
+                                dump (see rowfilter.resolve)
+    :type row_filter:           wp_import.rowfilter.Resolved
+    """
+    seq = wpi_utils.filter_strings(br'^INSERT', seq)
+    seq = wpi_metrics.stage(metrics, 'filter_strings', seq)
+    if row_filter is not None:
+        seq = (el for el in (wpi_rowfilter.filter_insert(el, row_filter)
+                             for el in seq) if el is not None)
+        seq = wpi_metrics.stage(metrics, 'filter_rows', seq)
+        timestamp_columns = wpi_rowfilter.projected_positions(
+            row_filter, timestamp_columns)
+    seq = wpi_utils.utf8_multirow(seq)
+    seq = wpi_metrics.stage(metrics, 'utf8_multirow', seq)
+    seq = (transform_insert(el, timestamp_columns, escape_percent)
+           for el in seq)
+    seq = wpi_metrics.stage(metrics, 'transform_insert', seq)
+    return (el if el.endswith(b'\n') else el + b'\n' for el in seq)
+
+
+_TIMESTAMP_FIELD_PAT = re.compile(
+    r'^(\d\d\d\d)([0,1]\d)([0-3]\d)([0-5]\d)([0-5]\d)([0-5]\d)$')
+
+_COPY_TEXT_SPECIAL_PAT = re.compile('[\\\\\t\n\r\0]')
+
+_COPY_TEXT_ESCAPES = {
+    ord('\\'): '\\\\',
+    ord('\t'): '\\t',
+    ord('\n'): '\\n',
+    ord('\r'): '\\r',
+    0: None,
+}
+
+
+def timestamp_field_to_iso_8601(value):
+    """Convert a single MySQL timestamp value to ISO 8601 format.
+
+    Values that are not of the form YYYYMMDDHHMMSS are returned unchanged.
+
+    :param value:   Field value
+    :type value:    unicode
+    """
+    if value is None:
+        return value
+    return _TIMESTAMP_FIELD_PAT.sub(r'\1-\2-\3T\4:\5:\6Z', value)
+
+
+def copy_text_row(row):
+    """Format a row as a line of PostgreSQL's COPY text format.
+
+    PostgreSQL can't store NUL characters in text columns, so they are
+    dropped.
+
+    :param row:     Sequence of field values. None is written as NULL.
+    :type row:      tuple
+    """
+    fields = []
+    for value in row:
+        if value is None:
+            fields.append('\\N')
+        elif _COPY_TEXT_SPECIAL_PAT.search(value):
+            fields.append(value.translate(_COPY_TEXT_ESCAPES))
+        else:
+            fields.append(value)
+    return '\t'.join(fields) + '\n'
+
+
+def copy_csv_row(row):
+    """Format a row as a line of PostgreSQL's COPY CSV format.
+
+    :param row:     Sequence of field values. None is written as NULL.
+    :type row:      tuple
+    """
+    return ','.join('' if value is None else
+                    '"{0}"'.format(value.replace('\0', '').replace('"', '""'))
+                    for value in row) + '\n'
+
+
+COPY_FORMATS = {
+    'text': copy_text_row,
+    'csv': copy_csv_row,
+}
+
+
+def copy_statement(table, copy_format='text', columns=None):
+    """Get the COPY statement that reads rows for given table from STDIN.
+
+    :param table:           Name of the table
+    :type table:            unicode
+
+    :param copy_format:     COPY format (text, csv)
+    :type copy_format:      unicode
+
+    :param columns:         Names of the columns the rows contain (default:
+                            all columns of the table)
+    :type columns:          list
+    """
+    target = '"{0}"'.format(table)
+    if columns:
+        target += ' ({0})'.format(', '.join('"{0}"'.format(column)
+                                            for column in columns))
+    if copy_format == 'csv':
+        return 'COPY {0} FROM STDIN WITH CSV'.format(target)
+    return 'COPY {0} FROM STDIN'.format(target)
+
+
+def persistence_statement(table, logged=True):
+    """Get the statement that switches given table to a (un)logged table.
+
+    Unlogged tables are not written to the WAL, which makes bulk loading
+    them much faster. Their content is lost after a crash though.
+
+    :param table:   Name of the table
+    :type table:    unicode
+
+    :param logged:  Switch to a logged (True) or an unlogged table (False)
+    :type logged:   bool
+    """
+    return 'ALTER TABLE "{0}" SET {1}'.format(
+        table, 'LOGGED' if logged else 'UNLOGGED')
+
+
+# PostgreSQL types of MySQL types (signed, unsigned)
+_PG_TYPES = {
+    'tinyint': ('smallint', 'smallint'),
+    'smallint': ('smallint', 'integer'),
+    'mediumint': ('integer', 'integer'),
+    'int': ('integer', 'bigint'),
+    'integer': ('integer', 'bigint'),
+    'bigint': ('bigint', 'numeric'),
+    'float': ('real', 'real'),
+    'double': ('double precision', 'double precision'),
+    'decimal': ('numeric', 'numeric'),
+    'timestamp': ('timestamp with time zone', 'timestamp with time zone'),
+    'datetime': ('timestamp without time zone',
+                 'timestamp without time zone'),
+    'date': ('date', 'date'),
+}
+
+# types that can hold the values of a type, ordered by size
+_PG_TYPE_FAMILIES = [
+    ('smallint', 'integer', 'bigint', 'numeric'),
+    ('real', 'double precision', 'numeric'),
+    ('timestamp without time zone', 'timestamp with time zone'),
+    ('date', ),
+]
+
+_TEXT_TYPES = frozenset(['text', 'character varying', 'character'])
+
+
+def column_type(column):
+    """Get the PostgreSQL type that holds the values of a MySQL column.
+
+    Strings of all kinds (including binary ones, which contain UTF-8 in
+    Wikipedia dumps) are mapped to text.
+
+    :param column:  Column of a dump
+    :type column:   wp_import.mysql.Column
+
+    :rtype: unicode
+    """
+    if column.type not in _PG_TYPES:
+        return 'text'
+    return _PG_TYPES[column.type][column.unsigned]
+
+
+def _compatible(pg_type, target_type):
+    """Check whether values of pg_type can be loaded into target_type.
+
+    :returns:   True, False or 'narrow' if the target type is smaller.
+    """
+    if pg_type == target_type or target_type in _TEXT_TYPES:
+        return True
+    for family in _PG_TYPE_FAMILIES:
+        if pg_type in family and target_type in family:
+            if family.index(target_type) < family.index(pg_type):
+                return 'narrow'
+            return True
+    return False
+
+
+def table_columns(cursor, table):
+    """Get the columns of a table.
+
+    :param cursor:  psycopg2 cursor
+    :type cursor:   psycopg2.extensions.cursor
+
+    :returns:   (name, data type) tuples in the order of the table
+    :rtype:     list
+    """
+    cursor.execute(columns_query(), (table, ))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def columns_query(table=None):
+    """Get the query for the columns of a table (see table_columns).
+
+    :param table:   Name of the table, which is quoted into the query, or
+                    None to get a query with a parameter
+    :type table:    unicode
+    """
+    table = '%s' if table is None else "'{0}'".format(table.replace("'",
+                                                                     "''"))
+    return 'SELECT column_name, data_type FROM information_schema.columns ' \
+            'WHERE table_schema = current_schema() AND table_name = ' \
+            '{0} ORDER BY ordinal_position'.format(table)
+
+
+def check_schema(db_name, schema, target_columns):
+    """Check that the columns of a dump can be loaded into a table.
+
+    Columns are matched by position and must have the same name and a
+    compatible type. Integer columns that are smaller than the dump column
+    are logged, as the values of a dump rarely cover the full range.
+
+    :param schema:          Schema of the dump
+    :type schema:           wp_import.mysql.Schema
+
+    :param target_columns:  Columns of the table as returned by
+                            table_columns
+    :type target_columns:   list
+
+    :raises wp_import.exceptions.SchemaError:   If the dump does not match
+    """
+    problems = []
+    if len(schema.columns) != len(target_columns):
+        problems.append('{0:d} columns in dump, {1:d} in table'.format(
+            len(schema.columns), len(target_columns)))
+
+    for (column, (name, target_type)) in zip(schema.columns, target_columns):
+        if column.name != name:
+            problems.append('column {0} in dump, {1} in table'.format(
+                column.name, name))
+            continue
+
+        pg_type = column_type(column)
+        compatible = _compatible(pg_type, target_type)
+        if not compatible:
+            problems.append('{0}: {1} can\'t be loaded into {2}'.format(
+                name, pg_type, target_type))
+        elif compatible == 'narrow':
+            _log.info('{0}.{1}.{2}: Values of {3} may not fit into '
+                      '{4}'.format(db_name, schema.table, name, pg_type,
+                                   target_type))
+
+    if problems:
+        raise wpi_exc.SchemaError(db_name, schema.table, problems)
+
+
+def delta_statements(table):
+    """Get the statements that apply a new dump to an existing table.
+
+    The rows of the new dump are copied into a temporary stage table that
+    is created by the first statement. The second statement deletes the
+    rows that are no longer present, the third one inserts the new rows.
+
+    :param table:   Name of the table
+    :type table:    unicode
+
+    :returns:   Name of the stage table and the statements to create the
+                stage table, delete old and insert new rows.
+    :rtype:     tuple
+    """
+    stage = '{0}_stage'.format(table)
+    # rows are compared as text: unlike = it matches NULL columns (which
+    # are empty while empty strings are "") and unlike IS NOT DISTINCT FROM
+    # it can be hashed, so that both statements run as hash anti joins
+    return (
+        stage,
+        'CREATE TEMPORARY TABLE "{1}" (LIKE "{0}" INCLUDING DEFAULTS) '
+        'ON COMMIT DROP'.format(table, stage),
+        'DELETE FROM "{0}" WHERE NOT EXISTS (SELECT 1 FROM "{1}" '
+        'WHERE ROW("{1}".*)::text = ROW("{0}".*)::text)'.format(table, stage),
+        'INSERT INTO "{0}" SELECT * FROM "{1}" WHERE NOT EXISTS '
+        '(SELECT 1 FROM "{0}" WHERE ROW("{0}".*)::text = '
+        'ROW("{1}".*)::text)'.format(table, stage),
+    )
+
+
+def copy_pipeline(seq, copy_format='text', timestamp_columns=(),
+                  metrics=None, row_filter=None):
+    """Pipeline that turns a dump file into COPY rows.
+
+    Steps in this pipeline:
+
+        * Extract INSERT statements as unicode strings
+        * Split multirow INSERT statements into single rows
+        * Drop and project rows if a filter is given
+        * Convert timestamp columns
+        * Format rows for COPY
+
+    :param seq:             Sequence of strings
+    :type seq:              Iterable
+
+    :param copy_format:     COPY format (text, csv)
+    :type copy_format:      unicode
+
+    :param timestamp_columns:   Positions of the columns with MySQL
+                                timestamps to convert to ISO 8601
+    :type timestamp_columns:    tuple
+
+    :param metrics:         Measure the stages of the pipeline. Rows are
+                            measured as a whole to keep the overhead low.
+    :type metrics:          wp_import.metrics.Metrics
+
+    :param row_filter:      Filter resolved against the columns of the dump
+                            (see rowfilter.resolve)
+    :type row_filter:       wp_import.rowfilter.Resolved
+    """
+    seq = wpi_utils.filter_strings(r'^INSERT', seq)
+    seq = wpi_metrics.stage(metrics, 'filter_strings', seq, 'statements')
+    seq = wpi_utils.convert_multirow_to_unicode(seq)
+    seq = wpi_metrics.stage(metrics, 'convert_multirow_to_unicode', seq)
+    rows = itertools.chain.from_iterable(wpi_mysql.values_rows(el)
+                                         for el in seq)
+    if row_filter is not None:
+        rows = wpi_rowfilter.filter_rows(rows, row_filter)
+        timestamp_columns = wpi_rowfilter.projected_positions(
+            row_filter, timestamp_columns)
+    if timestamp_columns:
+        rows = (tuple(timestamp_field_to_iso_8601(value)
+                      if pos in timestamp_columns else value
+                      for (pos, value) in enumerate(row))
+                for row in rows)
+    format_row = COPY_FORMATS[copy_format]
+    return (format_row(row) for row in rows)
+
+
+def copy_rows(file_path, copy_format='text', decompressor='auto', skip=0,
+              metrics=None, buffering=None, row_filter=None):
+    """Get COPY rows from given file.
+
+    The first skip rows are dropped. The stages of the pipeline are measured
+    if metrics is given. The file is read in a thread of its own if
+    buffering is given (see raw_insert_statements). Only the rows matching
+    row_filter (see rowfilter.RowFilter) are kept if it is given.
+    """
+    with wpi_utils.open_compressed(file_path, decompressor) as dump_file:
+        (schema, lines) = wpi_mysql.split_header(_watch(metrics, dump_file))
+        resolved = wpi_rowfilter.resolve(row_filter, schema)
+        if buffering is not None:
+            lines = wpi_utils.buffered(lines, *buffering)
+        rows = copy_pipeline(lines, copy_format,
+                             wpi_mysql.timestamp_columns(schema), metrics,
+                             resolved)
+        rows = itertools.islice(rows, skip, None)
+        rows = wpi_metrics.stage(metrics, 'output', rows, 'rows')
+
+        for row in rows:
+            yield row
+
+
+def _transform_batch(args):
+    """Transform a batch of INSERT statements within a worker process.
+
+    :param args:    Tuple of the batch, the COPY format (None to get INSERT
+                    statements), the positions of the timestamp columns,
+                    whether % has to be escaped and the resolved row filter
+                    or None.
+    :type args:     tuple
+
+    :returns:   Transformed statements or COPY rows
+    :rtype:     list
+    """
+    (batch, copy_format, timestamp_columns, escape_percent, row_filter) = args
+    if copy_format is not None:
+        return list(copy_pipeline(batch, copy_format, timestamp_columns,
+                                  row_filter=row_filter))
+    return list(raw_pipeline(batch, timestamp_columns,
+                             escape_percent=escape_percent,
+                             row_filter=row_filter))
+
+
+def _completed(pending, ordered):
+    """Remove the next completed result from pending results.
+
+    :param pending:     Pending results
+    :type pending:      collections.deque of multiprocessing.AsyncResult
+
+    :param ordered:     Return results in the order they were submitted
+    :type ordered:      bool
+    """
+    if ordered:
+        return pending.popleft()
+
+    while True:
+        for result in pending:
+            if result.ready():
+                pending.remove(result)
+                return result
+        pending[0].wait(0.01)
+
+
+def parallel_pipeline(file_path, workers, copy_format=None, batch_size=8,
+                      ordered=True, decompressor='auto', skip=0,
+                      metrics=None, escape_percent=False, row_filter=None):
+    """Get INSERT statements or COPY rows from given file and transform them
+    on a pool of worker processes.
+
+    The INSERT statements are read and decompressed in this process and sent
+    to the workers in batches.
+
+    :param file_path:   Path to the dump file
+    :type file_path:    str
+
+    :param workers:     Number of worker processes
+    :type workers:      int
+
+    :param copy_format: COPY format of the rows to generate or None to
+                        generate UTF-8 encoded INSERT statements.
+    :type copy_format:  unicode
+
+    :param batch_size:  Number of INSERT statements per batch
+    :type batch_size:   int
+
+    :param ordered:     Keep the order of the dump file. Batches are
+                        yielded as soon as they are done otherwise.
+    :type ordered:      bool
+
+    :param decompressor:    Decompressor passed to utils.open_compressed
+    :type decompressor:     str
+
+    :param skip:        Number of transformed INSERT statements (or COPY
+                        rows if copy_format is given) to skip. Statements
+                        dropped by the workers are not counted.
+    :type skip:         int
+
+    :param metrics:     Measure the stages of this process. The stages of
+                        the workers are measured as a whole (transform).
+    :type metrics:      wp_import.metrics.Metrics
+
+    :param escape_percent:  Escape % as %% in INSERT statements
+    :type escape_percent:   bool
+
+    :param row_filter:  Keep only matching rows (see rowfilter.RowFilter).
+                        Rows dropped by the workers are not counted.
+    :type row_filter:   wp_import.rowfilter.RowFilter
+    """
+    with wpi_utils.open_compressed(file_path, decompressor) as dump_file:
+        (schema, lines) = wpi_mysql.split_header(_watch(metrics, dump_file))
+        resolved = wpi_rowfilter.resolve(row_filter, schema)
+        statements = wpi_utils.filter_strings(r'^INSERT', lines)
+        statements = wpi_metrics.stage(metrics, 'filter_strings', statements)
+
+        results = itertools.chain.from_iterable(_parallel_batches(
+            statements, workers, batch_size, ordered,
+            (copy_format, wpi_mysql.timestamp_columns(schema),
+             escape_percent, resolved)))
+
+        results = itertools.islice(results, skip, None)
+        for el in wpi_metrics.stage(metrics, 'transform', results,
+                                    'statements' if copy_format is None
+                                    else 'rows'):
+            yield el
+
+
+def _parallel_batches(statements, workers, batch_size, ordered, args):
+    """Generator that transforms batches of statements on a process pool.
+
+    At most two batches per worker are in flight, so memory use stays
+    bounded.
+
+    :param args:    Arguments passed to _transform_batch after the batch
+    :type args:     tuple
     """
-    insert_statements = generic_pipeline(seq)
-    return timestamp_to_iso_8601(insert_statements)
+    pool = multiprocessing.Pool(workers)
+    pending = collections.deque()
+    try:
+        for batch in wpi_utils.batches(statements, batch_size):
+            pending.append(pool.apply_async(_transform_batch,
+                                            ((batch, ) + args, )))
+            if len(pending) >= 2 * workers:
+                yield _completed(pending, ordered).get()
+
+        while pending:
+            yield _completed(pending, ordered).get()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def _parse_pgpass(path):
@@ -0,0 +1,253 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.rowfilter
+
+This module drops rows and columns of SQL dumps before they are loaded.
+Filters are declared per table in [Filter:<table>] sections of the
+configuration, e.g.
+
+    [Filter:pagelinks]
+    pl_namespace = 0,14
+    columns = pl_from,pl_namespace,pl_title
+
+Every option but columns names a column and the values a row may have in
+it (NULL matches missing values). Rows have to match all options. columns
+restricts the loaded columns to the given ones, in the given order.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import collections
+import logging
+import re
+
+import wp_import.exceptions as wpi_exc
+import wp_import.metrics as wpi_metrics
+import wp_import.mysql as wpi_mysql
+
+_log = logging.getLogger(__name__)
+
+SECTION_PREFIX = 'Filter:'
+
+# the filter of a table as configured: conditions is a tuple of (column
+# name, frozenset of values) tuples, columns a tuple of column names or None
+# to keep all columns
+RowFilter = collections.namedtuple('RowFilter', 'table conditions columns')
+
+# a filter resolved against the columns of a dump: conditions is a tuple of
+# (position, frozenset of values) tuples, projection a tuple of positions
+# and names the names of the projected columns (both None to keep all
+# columns)
+Resolved = collections.namedtuple('Resolved',
+                                  'conditions projection names')
+
+_RAW_FIELD_PAT = re.compile(r"""'(?:[^'\\]|\\.)*'|[^,']+""", re.S)
+_RAW_FIELD_BYTES_PAT = re.compile(_RAW_FIELD_PAT.pattern.encode('ascii'),
+                                  re.S)
+
+_TOKENS = {
+    unicode: ('VALUES', "'", ',', '(', ')', ' ', ';\n', '`'),
+    bytes: (b'VALUES', b"'", b',', b'(', b')', b' ', b';\n', b'`'),
+}
+
+
+def _split(value):
+    return tuple(el.strip() for el in value.split(',') if el.strip())
+
+
+def from_config(config):
+    """Read the filters of all tables from given configuration.
+
+    :param config:  Configuration
+    :type config:   ConfigParser.ConfigParser
+
+    :returns:   RowFilter of every table that has one
+    :rtype:     dict
+    """
+    filters = {}
+    for section in config.sections():
+        if not section.startswith(SECTION_PREFIX):
+            continue
+        table = section[len(SECTION_PREFIX):].strip()
+        conditions = []
+        columns = None
+        # options of the DEFAULT section are not filters
+        for option in config.options(section):
+            if config.has_option('DEFAULT', option):
+                continue
+            value = config.get(section, option)
+            if option == 'columns':
+                columns = _split(value)
+                continue
+            conditions.append((option, frozenset(
+                None if el == 'NULL' else el for el in _split(value))))
+        if conditions or columns:
+            filters[table] = RowFilter(table, tuple(sorted(conditions)),
+                                       columns)
+    return filters
+
+
+def resolve(row_filter, schema):
+    """Resolve the column names of a filter to positions within the rows of
+    a dump.
+
+    :param row_filter:  Filter of the table or None
+    :type row_filter:   RowFilter
+
+    :param schema:      Table definition in the header of the dump
+    :type schema:       wp_import.mysql.Schema
+
+    :returns:   None if row_filter is None
+    :rtype:     Resolved
+
+    :raises wp_import.exceptions.FilterError:   If a column is not part of
+                                                the dump
+    """
+    if row_filter is None:
+        return None
+    if schema is None:
+        raise wpi_exc.FilterError(row_filter.table,
+                                  ['no table definition in dump'])
+
+    # option names of ConfigParser are lower case
+    positions = dict((column.name.lower(), pos)
+                     for (pos, column) in enumerate(schema.columns))
+    names = [name for (name, values) in row_filter.conditions]
+    names.extend(row_filter.columns or ())
+    unknown = [name for name in names if name.lower() not in positions]
+    if unknown:
+        raise wpi_exc.FilterError(row_filter.table, [
+            'no column {0}'.format(name) for name in unknown])
+
+    (projection, projected) = (None, None)
+    if row_filter.columns:
+        projection = tuple(positions[name.lower()]
+                           for name in row_filter.columns)
+        projected = tuple(schema.columns[pos].name for pos in projection)
+    return Resolved(tuple((positions[name], values) for (name, values)
+                          in row_filter.conditions), projection, projected)
+
+
+def projected_positions(resolved, positions):
+    """Get the positions of given columns within projected rows.
+
+    Columns that are not projected are dropped.
+
+    :param positions:   Positions of columns of the dump (e.g. the timestamp
+                        columns)
+    :type positions:    tuple
+
+    :rtype: tuple
+    """
+    if resolved is None or resolved.projection is None:
+        return positions
+    return tuple(resolved.projection.index(pos) for pos in positions
+                 if pos in resolved.projection)
+
+
+def filter_rows(rows, resolved):
+    """Generator that drops the rows that don't match a filter and projects
+    the others.
+
+    :param rows:        Rows as returned by mysql.values_rows
+    :type rows:         iterable
+
+    :param resolved:    Filter as returned by resolve
+    :type resolved:     Resolved
+    """
+    (conditions, projection) = (resolved.conditions, resolved.projection)
+    dropped = 0
+    try:
+        for row in rows:
+            if not all(row[pos] in values for (pos, values) in conditions):
+                dropped += 1
+                continue
+            if projection is not None:
+                row = tuple(row[pos] for pos in projection)
+            yield row
+    finally:
+        wpi_metrics.count('rows_filtered', dropped)
+
+
+def _field_value(field, kind):
+    """Get the value of a field of a row as written by mysqldump.
+    """
+    if field.startswith(_TOKENS[kind][1]):
+        if kind is bytes:
+            field = field.decode('utf8', 'replace')
+        return wpi_mysql.unescape(field[1:-1])
+    if kind is bytes:
+        field = field.decode('ascii', 'replace')
+    return None if field == 'NULL' else field
+
+
+def filter_insert(stmt, resolved):
+    """Drop the rows of a multirow INSERT statement that don't match a
+    filter and project the others.
+
+    Only the fields used by the conditions are unescaped, the statement is
+    not decoded. Projected statements name their columns, so that they
+    insert into the right columns of the table.
+
+    :param stmt:        Multirow INSERT statement
+    :type stmt:         unicode or bytes
+
+    :param resolved:    Filter as returned by resolve
+    :type resolved:     Resolved
+
+    :returns:   The statement or None if no row matches
+    :rtype:     unicode or bytes
+    """
+    kind = unicode if isinstance(stmt, unicode) else bytes
+    (values, quote, comma, lparen, rparen, space, end,
+     backtick) = _TOKENS[kind]
+    field_pat = _RAW_FIELD_PAT if kind is unicode else _RAW_FIELD_BYTES_PAT
+    (conditions, projection, names) = resolved
+
+    offset = stmt.index(values)
+    rows = []
+    dropped = 0
+    for (start, stop) in wpi_mysql.row_spans(stmt, offset + len(values)):
+        fields = field_pat.findall(stmt, start + 1, stop - 1)
+        if not all(_field_value(fields[pos], kind) in allowed
+                   for (pos, allowed) in conditions):
+            dropped += 1
+            continue
+        if projection is None:
+            rows.append(stmt[start:stop])
+        else:
+            rows.append(lparen + comma.join(fields[pos] for pos in projection)
+                        + rparen)
+    wpi_metrics.count('rows_filtered', dropped)
+
+    if not rows:
+        return None
+    if projection is None:
+        if not dropped:
+            return stmt
+        return stmt[:offset] + values + space + comma.join(rows) + end
+
+    if kind is bytes:
+        names = [name.encode('utf8') for name in names]
+    columns = lparen + comma.join(backtick + name + backtick
+                                  for name in names) + rparen
+    return (stmt[:offset] + columns + space + values + space
+            + comma.join(rows) + end)
+
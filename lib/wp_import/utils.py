@@ -25,129 +25,505 @@ process.
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import bisect
 import bz2
+import codecs
+import collections
 import fnmatch
-import gzip
+import functools
+import io
 import itertools
+import json
 import logging
 import os
 import re
+import subprocess
+import tempfile
+import threading
+import zlib
 
 from contextlib import contextmanager
+from distutils.spawn import find_executable
 
 import wp_import
+import wp_import.exceptions as wpi_exc
+import wp_import.metrics as wpi_metrics
+import wp_import.mysql as wpi_mysql
 
 _log = logging.getLogger(__name__)
 
+_INSERT_PAT = re.compile(
+    br'''^INSERT\sINTO\s(?P<quote>[`"])(?P<table>[\w-]+)(?P=quote)'''
+    br'''\s(?P<columns>\([^)]*\)\s)?VALUES\s*''', re.IGNORECASE)
 
+# file rows that can't be decoded are appended to (see set_reject_file)
+_reject_path = None
+
+
+@functools.total_ordering
 class DumpInfo(object):
     """Information about a database dump file
-    """
 
-    def __init__(self, path, fn_regex):
-        super(DumpInfo, self).__init__()
+    Instances are immutable. They are ordered by language, date, table and
+    path.
 
-        self.fn_regex = fn_regex
-        self.path = path
+    :param path:        Path to the dump file
+    :type path:         str
 
-    def __cmp__(self, other):
-        return cmp(self.path, other.path)
+    :param fn_regex:    Regular expression or compiled pattern used to
+                        extract the language, date and table from the
+                        filename (see dump_info)
+    :type fn_regex:     string
+
+    :param size:        Size of the (compressed) dump file. It is read from
+                        the file system if None and is None if the file does
+                        not exist.
+    :type size:         int
+    """
+
+    __slots__ = ('path', 'filename', 'language', 'date', 'dump_date',
+                 'table', 'size', 'sort_key')
+
+    def __init__(self, path, fn_regex, size=None):
+        filename = os.path.basename(path)
+        fn_mat = re.compile(fn_regex).match(filename)
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                pass
+
+        values = {
+            'path': path,
+            'filename': filename,
+            'language': fn_mat.group('language'),
+            # the date as in the filename (e.g. for database names and
+            # checkpoints) and as number
+            'dump_date': fn_mat.group('date'),
+            'date': int(fn_mat.group('date')),
+            'table': fn_mat.group('table'),
+            'size': size,
+        }
+        values['sort_key'] = (values['language'], values['date'],
+                              values['table'], path)
+        self.__setstate__(values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('DumpInfo is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('DumpInfo is immutable')
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in state.iteritems():
+            object.__setattr__(self, name, value)
 
     def __getitem__(self, item):
         return getattr(self, item)
 
-    @property
-    def filename(self):
-        return self._filename
+    def __eq__(self, other):
+        if not isinstance(other, DumpInfo):
+            return NotImplemented
+        return self.sort_key == other.sort_key
+
+    def __ne__(self, other):
+        if not isinstance(other, DumpInfo):
+            return NotImplemented
+        return self.sort_key != other.sort_key
 
-    @filename.setter
-    def filename(self, value):
-        self._filename = value
+    def __lt__(self, other):
+        if not isinstance(other, DumpInfo):
+            return NotImplemented
+        return self.sort_key < other.sort_key
 
-    @filename.deleter
-    def filename(self):
-        del self._filename
+    def __hash__(self):
+        return hash(self.sort_key)
 
-    @property
-    def fn_regex(self):
-        return self._fn_regex
+    def __repr__(self):
+        return 'DumpInfo({0!r})'.format(self.path)
 
-    @fn_regex.setter
-    def fn_regex(self, value):
-        self._fn_regex = value
-        self._fn_pat = re.compile(value)
 
-    @fn_regex.deleter
-    def fn_regex(self):
-        del self._fn_regex
-        del self._fn_pat
+# size of the buffers decompressed data is read in
+BUFFER_SIZE = 1 << 20
 
-    @property
-    def language(self):
-        return self._language
+# external decompressors in order of preference
+DECOMPRESSION_COMMANDS = {
+    '.gz': [['pigz', '-dc'], ['gzip', '-dc']],
+    '.bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    '.xz': [['xz', '-dc', '-T0']],
+    '.zst': [['zstd', '-dc']],
+}
 
-    @language.setter
-    def language(self, value):
-        self._language = value
 
-    @language.deleter
-    def language(self):
-        del self._language
+def _lzma_decompressor():
+    try:
+        import lzma
+    except ImportError:
+        from backports import lzma
+    return lzma.LZMADecompressor()
+
 
-    @property
-    def date(self):
-        return self._date
+# decompressor factories used if no external decompressor is available
+DECOMPRESSOR_FACTORIES = {
+    '.gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    '.bz2': bz2.BZ2Decompressor,
+    '.xz': _lzma_decompressor,
+}
 
-    @date.setter
-    def date(self, value):
-        self._date = value
 
-    @date.deleter
-    def date(self):
-        del self._date
+class StreamDecompressor(io.RawIOBase):
+    """Raw stream of the decompressed content of a compressed file.
+
+    Files consisting of several concatenated compressed streams (multistream
+    bzip2, multimember gzip) are decompressed completely.
+
+    :param raw:         Compressed file opened in binary mode
+    :type raw:          file
+
+    :param factory:     Callable returning a new decompressor object
+    :type factory:      callable
+
+    :param chunk_size:  Number of compressed bytes read at once
+    :type chunk_size:   int
+    """
+
+    def __init__(self, raw, factory, chunk_size=BUFFER_SIZE):
+        super(StreamDecompressor, self).__init__()
+        self.raw = raw
+        self.factory = factory
+        self.chunk_size = chunk_size
+        self._decompressor = factory()
+        self._pending = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def _decompress(self, data):
+        chunks = []
+        while data:
+            try:
+                chunks.append(self._decompressor.decompress(data))
+                data = self._decompressor.unused_data
+            except EOFError:
+                pass
+            else:
+                if not data:
+                    break
+            # start of the next stream
+            self._decompressor = self.factory()
+        return b''.join(chunks)
+
+    def readinto(self, buf):
+        while self._offset >= len(self._pending):
+            data = self.raw.read(self.chunk_size)
+            if not data:
+                return 0
+            self._pending = self._decompress(data)
+            self._offset = 0
+
+        size = min(len(buf), len(self._pending) - self._offset)
+        buf[:size] = self._pending[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super(StreamDecompressor, self).close()
+
+
+class DecompressedFile(object):
+    """File object for the decompressed content of a compressed file.
+
+    Iterating over a DecompressedFile yields lines. The content is read in
+    buffers of BUFFER_SIZE bytes.
+
+    :param path:        Path to the (compressed) file
+    :type path:         str
+
+    :param decompressor:    'auto' to use an external decompressor (pigz,
+                            lbzip2, ...) if one is installed, 'python' to
+                            decompress within this process.
+    :type decompressor:     str
+    """
+
+    def __init__(self, path, decompressor='auto'):
+        super(DecompressedFile, self).__init__()
+        self.path = path
+        self.command = None
+        self.process = None
+
+        self.raw = open(path, 'rb')
+        extension = os.path.splitext(path)[1]
+
+        if decompressor == 'auto':
+            self.command = external_decompressor(extension)
+
+        if self.command is not None:
+            _log.debug('{0}: Decompress with {1}'.format(
+                os.path.basename(path), self.command[0]))
+            # the child shares the file offset of self.raw
+            self.process = subprocess.Popen(self.command, stdin=self.raw,
+                                            stdout=subprocess.PIPE)
+            self.stream = io.open(self.process.stdout.fileno(), 'rb',
+                                  BUFFER_SIZE, closefd=False)
+        elif extension in DECOMPRESSOR_FACTORIES:
+            self.stream = io.BufferedReader(
+                StreamDecompressor(self.raw,
+                                   DECOMPRESSOR_FACTORIES[extension]),
+                BUFFER_SIZE)
+        elif extension in DECOMPRESSION_COMMANDS:
+            self.raw.close()
+            raise wpi_exc.WPError(
+                '{0}: No decompressor available'.format(path))
+        else:
+            self.stream = io.BufferedReader(io.FileIO(self.raw.fileno(),
+                                                      closefd=False),
+                                            BUFFER_SIZE)
 
-    @property
-    def path(self):
-        return self._path
+    def __iter__(self):
+        return iter(self.stream)
 
-    @path.setter
-    def path(self, value):
-        self._path = value
-        self.filename = os.path.basename(value)
+    def read(self, size=-1):
+        return self.stream.read(size)
 
-        # assign extracted values
-        fn_mat = self._fn_pat.match(self.filename)
-        self.language = fn_mat.group('language')
-        self.date = fn_mat.group('date')
-        self.table = fn_mat.group('table')
+    def readline(self, size=-1):
+        return self.stream.readline(size)
 
-    @path.deleter
-    def path(self):
-        del self._path
-        del self.language
-        del self.date
-        del self.table
+    def close(self):
+        """Close the file and wait for the external decompressor.
+
+        :raises IOError:    If the external decompressor failed
+        """
+        self.stream.close()
+        if self.process is not None:
+            # stopped reading early
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.stdout.close()
+            self.process.wait()
+        self.raw.close()
+
+        if self.process is not None and self.process.returncode > 0:
+            raise IOError('{0}: {1} exited with {2:d}'.format(
+                self.path, self.command[0], self.process.returncode))
+
+
+class IterFile(object):
+    """Read-only file-like object over a sequence of strings.
+
+    This is used to feed generated rows to cursor.copy_expert and generated
+    XML to iterparse, which read their input in chunks of a given size.
+
+    :param seq:         Sequence of strings
+    :type seq:          iterable
+
+    :param encoding:    Encoding used for unicode strings in seq
+    :type encoding:     str
+    """
+
+    def __init__(self, seq, encoding='utf8'):
+        super(IterFile, self).__init__()
+        self._iter = iter(seq)
+        self._buffer = b''
+        self._offset = 0
+        self.encoding = encoding
+        self.count = 0
+
+    def _next_chunk(self):
+        chunk = next(self._iter)
+        self.count += 1
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode(self.encoding)
+        return chunk
+
+    def read(self, size=-1):
+        available = len(self._buffer) - self._offset
+        if 0 <= size <= available:
+            # serve small reads from large chunks without copying the rest
+            data = self._buffer[self._offset:self._offset + size]
+            self._offset += size
+            return data
+
+        chunks = [self._buffer[self._offset:]]
+        length = available
+        try:
+            while size < 0 or length < size:
+                chunk = self._next_chunk()
+                chunks.append(chunk)
+                length += len(chunk)
+        except StopIteration:
+            pass
+
+        data = b''.join(chunks)
+        if size < 0 or size >= len(data):
+            (self._buffer, self._offset) = (b'', 0)
+            return data
+        (self._buffer, self._offset) = (data, size)
+        return data[:size]
+
+    def readline(self, size=-1):
+        # copy_expert only calls readline for COPY ... FROM files opened in
+        # text mode; every chunk we hand out is a complete line
+        if self._offset < len(self._buffer):
+            line = self._buffer[self._offset:]
+            (self._buffer, self._offset) = (b'', 0)
+            return line
+        try:
+            return self._next_chunk()
+        except StopIteration:
+            return b''
+
+
+def external_decompressor(extension):
+    """Get the command of the preferred installed decompressor for files
+    with given extension.
+
+    :param extension:   File name extension (.gz, .bz2, ...)
+    :type extension:    str
+
+    :returns:   Command line or None if no decompressor is installed
+    :rtype:     list
+    """
+    for command in DECOMPRESSION_COMMANDS.get(extension, []):
+        if find_executable(command[0]):
+            return command
+    return None
 
 
 @contextmanager
-def open_compressed(filename):
+def open_compressed(filename, decompressor='auto'):
     """Open a compressed file.
 
-    :param filenames:   Sequence of filenames to open.
-    :type filenames:    iterable
+    :param filename:        Path to the file. Files ending with .gz, .bz2,
+                            .xz or .zst are decompressed.
+    :type filename:         str
+
+    :param decompressor:    'auto' to use an external decompressor if one
+                            is installed, 'python' to decompress within
+                            this process.
+    :type decompressor:     str
     """
+    open_file = DecompressedFile(filename, decompressor)
     try:
-        if filename.endswith('.gz'):
-            open_file = gzip.open(filename)
-        elif filename.endswith('.bz2'):
-            open_file = bz2.BZ2File(filename)
-        else:
-            open_file = open(filename)
         yield open_file
     finally:
         open_file.close()
 
 
+class _FileRange(object):
+    """Read at most size bytes from given file.
+    """
+
+    def __init__(self, raw, size):
+        super(_FileRange, self).__init__()
+        self.raw = raw
+        self.size = size
+
+    def read(self, size):
+        data = self.raw.read(min(size, self.size))
+        self.size -= len(data)
+        return data
+
+    def close(self):
+        self.raw.close()
+
+
+def decompress_range(path, start, end=None):
+    """Decompress the bzip2 streams between two offsets of a multistream
+    bzip2 file.
+
+    :param start:   Offset of the first stream
+    :type start:    int
+
+    :param end:     Offset after the last stream (default: end of file)
+    :type end:      int
+
+    :returns:   Sequence of decompressed buffers
+    :rtype:     iterable
+    """
+    raw = open(path, 'rb')
+    raw.seek(start)
+    if end is None:
+        end = os.fstat(raw.fileno()).st_size
+
+    stream = StreamDecompressor(_FileRange(raw, end - start),
+                                bz2.BZ2Decompressor)
+    try:
+        while True:
+            data = stream.read(BUFFER_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        stream.close()
+
+
+def multistream_index_path(path):
+    """Get the path of the index of a multistream pages-articles dump.
+
+    :returns:   Path of the index or None if there is none
+    :rtype:     str
+    """
+    (base, ext) = os.path.splitext(path)
+    if ext != '.bz2' or not base.endswith('-multistream.xml'):
+        return None
+    index_path = base[:-len('.xml')] + '-index.txt.bz2'
+    if not os.path.exists(index_path):
+        return None
+    return index_path
+
+
+def multistream_offsets(index_path):
+    """Read the stream offsets of a multistream dump from its index.
+
+    Lines of the index look like offset:page_id:title.
+
+    :returns:   Sorted offsets of the streams
+    :rtype:     list
+    """
+    offsets = set()
+    with open_compressed(index_path) as index_f:
+        for line in index_f:
+            (offset, _, _) = line.partition(b':')
+            if offset.strip():
+                offsets.add(int(offset))
+    return sorted(offsets)
+
+
+def multistream_shards(offsets, size, shards):
+    """Split the streams of a multistream file into shards of about the same
+    size.
+
+    :param offsets:     Sorted offsets of the streams
+    :type offsets:      list
+
+    :param size:        Size of the file
+    :type size:         int
+
+    :param shards:      Maximum number of shards
+    :type shards:       int
+
+    :returns:   (start, end) offsets of the shards
+    :rtype:     list
+    """
+    if not offsets:
+        return []
+
+    first = offsets[0]
+    starts = [first]
+    for shard in range(1, shards):
+        pos = bisect.bisect_left(
+            offsets, first + (size - first) * shard // shards)
+        if pos < len(offsets) and offsets[pos] > starts[-1]:
+            starts.append(offsets[pos])
+    return zip(starts, starts[1:] + [size])
+
+
 def filter_strings(pat, seq):
     """Generator that yields only those strings matching the given regular
     expression.
@@ -164,6 +540,162 @@ def filter_strings(pat, seq):
             yield element
 
 
+def batches(seq, size):
+    """Generator that groups the elements of a sequence into lists.
+
+    :param seq:     Sequence to group
+    :type seq:      iterable
+
+    :param size:    Number of elements per list. The last list might be
+                    shorter.
+    :type size:     int
+    """
+    seq = iter(seq)
+    while True:
+        batch = list(itertools.islice(seq, size))
+        if not batch:
+            return
+        yield batch
+
+
+class BoundedQueue(object):
+    """Thread-safe FIFO queue limited by the number and total size of its
+    entries.
+
+    An entry that exceeds max_bytes on its own is accepted if the queue is
+    empty, so that a producer is never blocked forever.
+
+    :param max_entries:     Maximum number of entries
+    :type max_entries:      int
+
+    :param max_bytes:       Maximum total size of the entries
+    :type max_bytes:        int
+    """
+
+    def __init__(self, max_entries=16, max_bytes=1 << 26):
+        super(BoundedQueue, self).__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, entry, size=0):
+        """Append an entry, waiting until there is room for it.
+
+        :returns:   False if the queue was closed and entry was discarded
+        :rtype:     bool
+        """
+        with self._cond:
+            while (not self._closed and self._entries
+                   and (len(self._entries) >= self.max_entries
+                        or self.size + size > self.max_bytes)):
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._entries.append((entry, size))
+            self.size += size
+            self._cond.notify_all()
+            return True
+
+    def get(self):
+        """Remove and return the first entry, waiting until there is one.
+        """
+        with self._cond:
+            while not self._entries:
+                self._cond.wait()
+            (entry, size) = self._entries.popleft()
+            self.size -= size
+            self._cond.notify_all()
+            return entry
+
+    def close(self):
+        """Discard all entries and all entries put from now on.
+        """
+        with self._cond:
+            self._closed = True
+            self._entries.clear()
+            self.size = 0
+            self._cond.notify_all()
+
+
+# end of the sequence passed through the queue of buffered
+_END = object()
+
+
+def buffered(seq, max_entries=16, max_bytes=1 << 26, batch_bytes=1 << 16,
+             size=len):
+    """Generator that evaluates a sequence in a thread of its own.
+
+    The elements are passed in batches of about batch_bytes through a
+    BoundedQueue, so the producer of seq works ahead of the consumer, but
+    is blocked once the queue is full. Threads of decompressors, psql pipes
+    and the database driver release the GIL while they wait, so chained
+    buffered stages overlap.
+
+    Exceptions of the producer are raised in the consumer. If the consumer
+    stops early, seq is closed within the producer thread.
+
+    :param seq:             Sequence to evaluate
+    :type seq:              iterable
+
+    :param max_entries:     Maximum number of batches in the queue
+    :type max_entries:      int
+
+    :param max_bytes:       Maximum total size of the batches in the queue
+    :type max_bytes:        int
+
+    :param batch_bytes:     Size at which a batch is passed on
+    :type batch_bytes:      int
+
+    :param size:            Function that returns the size of an element
+    :type size:             callable
+    """
+    queue = BoundedQueue(max_entries, max_bytes)
+    counters = wpi_metrics.counters()
+
+    def produce():
+        wpi_metrics.share_counters(counters)
+        it = iter(seq)
+        try:
+            (batch, batch_size) = ([], 0)
+            for el in it:
+                batch.append(el)
+                batch_size += size(el)
+                if batch_size >= batch_bytes:
+                    if not queue.put(batch, batch_size):
+                        return
+                    (batch, batch_size) = ([], 0)
+            if batch:
+                queue.put(batch, batch_size)
+            queue.put(_END)
+        except Exception as exc:
+            queue.put(exc)
+        finally:
+            if hasattr(it, 'close'):
+                it.close()
+
+    thread = threading.Thread(target=produce, name='buffered')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            entry = queue.get()
+            if entry is _END:
+                return
+            if isinstance(entry, Exception):
+                raise entry
+            for el in entry:
+                yield el
+    finally:
+        queue.close()
+        thread.join()
+
+
 def field_map(dictseq, name, func):
     """Generator for dictionary field conversion.
 
@@ -233,17 +765,69 @@ def convert_to_unicode(seq, encoding):
         except UnicodeDecodeError as unidec_err:
             _log.warning('Dropped {row}: Not {encoding} encoded'.format(
                 row=el.decode(encoding, 'replace'), encoding=encoding))
+            wpi_metrics.count('dropped_rows')
             continue
 
 
+def validate_utf8(data, chunk_size=1 << 16):
+    """Check that given bytes are valid UTF-8.
+
+    The data is decoded in chunks that are thrown away immediately, so no
+    copy of the whole string is made.
+
+    :param data:        Bytes to check
+    :type data:         str
+
+    :param chunk_size:  Number of bytes decoded at once
+    :type chunk_size:   int
+
+    :raises UnicodeDecodeError: If data is not valid UTF-8. The start and end
+                                attributes of the error are offsets within
+                                data.
+    """
+    view = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        final = pos + chunk_size >= len(data)
+        try:
+            (_, consumed) = codecs.utf_8_decode(view[pos:pos + chunk_size],
+                                                'strict', final)
+        except UnicodeDecodeError as unidec_err:
+            raise UnicodeDecodeError(unidec_err.encoding, data,
+                                     pos + unidec_err.start,
+                                     pos + unidec_err.end,
+                                     unidec_err.reason)
+        pos += consumed
+
+
+def utf8_multirow(seq):
+    """Generator that yields multirow INSERT statements that are valid UTF-8.
+
+    Statements are validated without decoding them. If a statement is not
+    valid UTF-8 the rows that can't be decoded are dropped as in
+    convert_multirow_to_unicode.
+
+    :param seq:         Sequence of multirow INSERT statements
+    :type seq:          iterable of bytes
+    """
+    for el in seq:
+        try:
+            validate_utf8(el)
+            yield el
+        except UnicodeDecodeError as unidec_err:
+            wpi_metrics.count('decode_fallbacks')
+            stmt = decode_multirow(el, 'utf8', unidec_err.start)
+            if stmt is not None:
+                yield stmt.encode('utf8')
+
+
 def convert_multirow_to_unicode(seq, encoding='utf8'):
     """Decode a sequence of bytes containing multirow INSERT statements from
     given encoding.
 
     It might be that Wikipedia dumps contain rows that contain strings that
-    are *not* utf8 encoded. If we encounter an UnicodeDecodeError we will
-    split the multirow INSERT statements into single rows and drop all rows
-    that can't be decoded.
+    are *not* utf8 encoded. If we encounter an UnicodeDecodeError the rows
+    that can't be decoded are dropped (see decode_multirow).
 
     :param seq:         Sequence of bytes with given encoding to convert
                         to strings.
@@ -252,21 +836,302 @@ def convert_multirow_to_unicode(seq, encoding='utf8'):
     :param encoding:    Encoding of bytes in sequence
     :type encoding:     string
     """
-    table_name_pat = re.compile(
-        r'''^INSERT\sINTO\s(?P<quote>[`"])(?P<table>[\w-]+)(?P=quote)''',
-                           re.IGNORECASE)
     for el in seq:
         try:
             yield el.decode(encoding)
         except UnicodeDecodeError as unidec_err:
-            _log.warning('Decoding error: Decode single rows')
-            mat_dict = table_name_pat.match(el).groupdict()
-            rows = single_rows(el)
-            rows = convert_to_unicode(rows, encoding)
-            yield 'INSERT INTO {0}{1}{0} VALUES {2};'.format(
-                mat_dict['quote'],
-                mat_dict['table'],
-                ','.join(rows))
+            wpi_metrics.count('decode_fallbacks')
+            stmt = decode_multirow(el, encoding, unidec_err.start)
+            if stmt is not None:
+                yield stmt
+
+
+def set_reject_file(path):
+    """Append the rows dropped by decode_multirow to given file.
+
+    Every line of the file consists of the table name, a tab and the
+    undecoded row as found in the dump.
+
+    :param path:    Path to the reject file (None: don't write rejected rows)
+    :type path:     str
+    """
+    global _reject_path
+    _reject_path = path
+
+
+def _reject(table, rows):
+    if _reject_path is None:
+        return
+    # opened for every statement, so forked workers can write as well
+    with open(_reject_path, 'ab') as reject_f:
+        reject_f.writelines(table + b'\t' + row + b'\n' for row in rows)
+
+
+def decode_multirow(multirow_insert, encoding='utf8', error_offset=None):
+    """Decode a multirow INSERT statement and drop the rows that can't be
+    decoded.
+
+    The statement is decoded in one pass. When decoding fails, the row
+    containing the offending byte is looked up by scanning the rows after
+    the last decoded position, the bytes before that row are kept and
+    decoding continues after it. Dropped rows are logged and written to the
+    reject file.
+
+    :param multirow_insert:     Multirow INSERT statement
+    :type multirow_insert:      bytes
+
+    :param encoding:            Encoding of the statement
+    :type encoding:             string
+
+    :param error_offset:        Offset of the first byte known not to be
+                                decodable (e.g. the start attribute of a
+                                UnicodeDecodeError)
+    :type error_offset:         int
+
+    :returns:   The decoded statement or None if no row can be decoded
+    :rtype:     unicode
+    """
+    mat = _INSERT_PAT.match(multirow_insert)
+    if mat is None:
+        _log.warning('Dropped statement: Not {0} encoded'.format(encoding))
+        wpi_metrics.count('dropped_statements')
+        return None
+
+    decode = codecs.getdecoder(encoding)
+    view = memoryview(multirow_insert)
+    (pos, bad) = (mat.end(), error_offset)
+    parts = []
+    rejected = []
+    while True:
+        if bad is None:
+            try:
+                parts.append(decode(view[pos:])[0])
+                break
+            except UnicodeDecodeError as unidec_err:
+                bad = pos + unidec_err.start
+
+        # the first row ending after the offending byte
+        span = None
+        for (start, end) in wpi_mysql.row_spans(multirow_insert, pos):
+            if end > bad:
+                span = (start, end)
+                break
+
+        if span is None or span[0] > bad:
+            # not within a row: skip the bytes up to the next row
+            (keep, skip) = (bad, len(multirow_insert) if span is None
+                            else span[0])
+        else:
+            (keep, skip) = span
+            rejected.append(multirow_insert[keep:skip])
+        parts.append(decode(view[pos:keep])[0])
+        (pos, bad) = (skip, None)
+
+    table = mat.group('table')
+    for row in rejected:
+        _log.warning('Dropped {row}: Not {encoding} encoded'.format(
+            row=row.decode(encoding, 'replace'), encoding=encoding))
+    wpi_metrics.count('dropped_rows', len(rejected))
+    _reject(table, rejected)
+
+    # the kept parts start and end with complete rows or separators
+    rows = ','.join(part.strip(', ;\r\n') for part in parts
+                    if part.strip(', ;\r\n'))
+    if not rows:
+        return None
+    # the column list of projected statements (see rowfilter.filter_insert)
+    columns = (mat.group('columns') or b'').decode(encoding)
+    return 'INSERT INTO {0}{1}{0} {2}VALUES {3};'.format(
+        mat.group('quote').decode('ascii'), table.decode('ascii'), columns,
+        rows)
+
+
+# scandir gets the type of directory entries without a stat call per entry
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+def _scandir_listing(path):
+    (dirs, files) = ([], [])
+    for entry in _scandir(path):
+        (dirs if entry.is_dir() else files).append(entry.name)
+    return (dirs, files)
+
+
+def _listdir_listing(path):
+    (dirs, files) = ([], [])
+    for name in os.listdir(path):
+        if os.path.isdir(os.path.join(path, name)):
+            dirs.append(name)
+        else:
+            files.append(name)
+    return (dirs, files)
+
+
+_listing = _listdir_listing if _scandir is None else _scandir_listing
+
+# names of directories that contain the dumps of a single date
+_DATE_DIR_PAT = re.compile(r'^\d{8}$')
+
+DISCOVERY_CACHE_VERSION = 1
+
+
+def language_pruner(enabled, known):
+    """Get a function that tells whether a directory contains dumps of a
+    language that is not enabled.
+
+    Directories are named after the language (e.g. de, zh-classical) or the
+    wiki (e.g. dewiki). Directories with other names are never pruned.
+
+    :param enabled:     Enabled languages
+    :type enabled:      iterable
+
+    :param known:       All known languages (e.g. the options of the
+                        Languages section of the configuration)
+    :type known:        iterable
+
+    :rtype:     callable
+    """
+    enabled = frozenset(enabled)
+    known = frozenset(known)
+
+    def prune(name):
+        language = name[:-len('wiki')] if name.endswith('wiki') else name
+        language = language.replace('-', '_')
+        return language in known and language not in enabled
+
+    return prune
+
+
+class DumpFinder(object):
+    """Find dump files beneath given paths.
+
+    Directories are read with scandir if it is available. Directories
+    named after a dump date (e.g. 20091023) are searched newest first.
+
+    :param fn_regex:    Regular expression that filenames must match to be
+                        considered a dump file. It must define the groups
+                        language and table if latest is True.
+    :type fn_regex:     string
+
+    :param prune:       Function that is called with the name of every
+                        directory and returns True if the directory should
+                        not be searched (see language_pruner).
+    :type prune:        callable
+
+    :param cache_path:  Path to a file in which the listings of the searched
+                        directories are kept. Directories whose modification
+                        time did not change are not read again.
+    :type cache_path:   str
+
+    :param latest:      Stop searching the dump date directories of a
+                        directory once the newest complete date is found
+                        (see latest_dumps).
+    :type latest:       bool
+    """
+
+    def __init__(self, fn_regex, prune=None, cache_path=None, latest=False):
+        super(DumpFinder, self).__init__()
+        self.fn_pat = re.compile(fn_regex)
+        self.prune = prune
+        self.cache_path = cache_path
+        self.latest = latest
+        self._cache = self._read_cache()
+        self._cache_changed = False
+
+    def _read_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path, 'rb') as cache_f:
+            content = json.loads(cache_f.read().decode('utf8'))
+        if (content.get('version') != DISCOVERY_CACHE_VERSION
+            or content.get('pattern') != self.fn_pat.pattern):
+            return {}
+        return content['directories']
+
+    def _write_cache(self):
+        (fd, tmp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.cache_path)))
+        with os.fdopen(fd, 'wb') as cache_f:
+            cache_f.write(json.dumps({
+                'version': DISCOVERY_CACHE_VERSION,
+                'pattern': self.fn_pat.pattern,
+                'directories': self._cache,
+            }).encode('utf8'))
+        os.rename(tmp_path, self.cache_path)
+
+    def _directory(self, path):
+        """Get the subdirectories and dump files of given directory.
+        """
+        mtime = os.stat(path).st_mtime
+        cached = self._cache.get(path)
+        if cached is not None and cached['mtime'] == mtime:
+            return (cached['dirs'], cached['files'])
+
+        (dirs, files) = _listing(path)
+        files = [name for name in files if self.fn_pat.match(name)]
+        if self.cache_path is not None:
+            self._cache[path] = {'mtime': mtime, 'dirs': dirs,
+                                 'files': files}
+            self._cache_changed = True
+        return (dirs, files)
+
+    def _tables(self, paths):
+        return set((mat.group('language'), mat.group('table')) for mat in
+                   (self.fn_pat.match(os.path.basename(path))
+                    for path in paths))
+
+    def _walk(self, path):
+        (dirs, files) = self._directory(path)
+        found = [os.path.join(path, name) for name in files]
+
+        dates = []
+        for name in dirs:
+            if self.prune is not None and self.prune(name):
+                continue
+            if _DATE_DIR_PAT.match(name):
+                dates.append(name)
+            else:
+                found.extend(self._walk(os.path.join(path, name)))
+
+        newer = None
+        for name in sorted(dates, reverse=True):
+            paths = self._walk(os.path.join(path, name))
+            if self.latest and paths:
+                tables = self._tables(paths)
+                if newer is not None and newer >= tables:
+                    # the newer date is complete, older ones are not needed
+                    break
+                newer = tables
+            found.extend(paths)
+        return found
+
+    def find(self, *paths):
+        """Find dump files at or beneath given paths.
+
+        :param paths:   Paths to dump files or directories
+        :type paths:    iterable
+
+        :returns:   Sorted list of unique paths of dump files
+        :rtype:     list
+        """
+        found = set()
+        for path in paths:
+            if os.path.isdir(path):
+                found.update(self._walk(path))
+            elif (os.path.isfile(path)
+                  and self.fn_pat.match(os.path.basename(path))):
+                found.add(path)
+
+        if self._cache_changed:
+            self._write_cache()
+            self._cache_changed = False
+        return sorted(found)
 
 
 def dump_file_paths(fn_regex, *paths):
@@ -279,14 +1144,36 @@ def dump_file_paths(fn_regex, *paths):
     :param paths:       List of paths where dump files are located.
     :type paths:        iterable
     """
-    fn_pat = re.compile(fn_regex)
-    # all files within given paths
-    dump_file_paths = itertools.chain(*(file_paths(path) for path in paths))
-    # matching ones
-    dump_file_paths = (path for path in dump_file_paths
-                       if fn_pat.match(os.path.basename(path)))
-    # we want a unique and sorted list
-    return iter(sorted(set(dump_file_paths)))
+    return iter(DumpFinder(fn_regex).find(*paths))
+
+
+def latest_dumps(dump_infos):
+    """Select the dumps of the newest complete dump date of every language.
+
+    A dump date is considered complete if it has dumps of all tables the
+    previous dump date of the language has. Dumps that are still written
+    (e.g. by a mirror script) are skipped in favour of the previous date.
+
+    :param dump_infos:  Dumps to select from
+    :type dump_infos:   iterable
+
+    :returns:   Selected dumps in the order of dump_infos
+    :rtype:     list
+    """
+    dump_infos = list(dump_infos)
+    dates = collections.defaultdict(lambda: collections.defaultdict(set))
+    for di in dump_infos:
+        dates[di.language][di.date].add(di.table)
+
+    selected = {}
+    for (language, tables) in dates.iteritems():
+        newer = None
+        for date in sorted(tables, reverse=True):
+            if newer is not None and tables[newer] >= tables[date]:
+                break
+            newer = date
+        selected[language] = newer
+    return [di for di in dump_infos if selected[di.language] == di.date]
 
 
 def dump_info(paths, fn_regex):
@@ -307,8 +1194,9 @@ def dump_info(paths, fn_regex):
 
     :type fn_regex:    string
     """
+    fn_pat = re.compile(fn_regex)
     for filepath in paths:
-        yield DumpInfo(filepath, fn_regex)
+        yield DumpInfo(filepath, fn_pat)
 
 
 def single_rows(multirow_insert):
@@ -317,10 +1205,5 @@ def single_rows(multirow_insert):
     :param multirow_insert:     Multirow INSERT statement
     :type multirow_insert:      string
     """
-    multirow_insert = re.sub(b'^INSERT\sINTO\s[`"][\w-]+[`"]\sVALUES\s', b'',
-                             multirow_insert, 1)
-    multirow_insert = re.sub(b';$', b'', multirow_insert)
-    multirow_insert = multirow_insert.replace(b'),(', b')\n(')
-    rows = multirow_insert.split(b'\n')
-    row_pat = re.compile(b'^\(.+\)$')
-    return itertools.ifilter(lambda el: row_pat.match(el) is not None, rows)
+    return (multirow_insert[start:end] for (start, end)
+            in wpi_mysql.row_spans(multirow_insert))
@@ -0,0 +1,259 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""wp_import.xmldump
+
+This module parses the pages-articles XML dumps published by the Wikimedia
+foundation into rows of the page, revision and text tables.
+
+The dump is parsed incrementally and every page is discarded once its rows
+are generated, so memory usage does not depend on the size of the dump.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import random
+
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+import wp_import.utils as wpi_utils
+
+_log = logging.getLogger(__name__)
+
+TABLES = ('page', 'revision', 'text')
+
+COLUMNS = {
+    'page': ('page_id', 'page_namespace', 'page_title', 'page_restrictions',
+             'page_counter', 'page_is_redirect', 'page_is_new',
+             'page_random', 'page_touched', 'page_latest', 'page_len'),
+    'revision': ('rev_id', 'rev_page', 'rev_text_id', 'rev_comment',
+                 'rev_user', 'rev_user_text', 'rev_timestamp',
+                 'rev_minor_edit', 'rev_deleted', 'rev_len', 'rev_parent_id'),
+    'text': ('old_id', 'old_text', 'old_flags'),
+}
+
+# bits of rev_deleted for elements with a deleted attribute
+_DELETED_BITS = {
+    'text': 1,
+    'comment': 2,
+    'contributor': 4,
+}
+
+
+def _local_name(tag):
+    """Strip the namespace from an ElementTree tag.
+
+    The namespace of pages-articles dumps changes with the version of the
+    export format (e.g. http://www.mediawiki.org/xml/export-0.4/).
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return unicode(value)
+
+
+def _namespace_and_title(page, namespaces):
+    """Get namespace number and database title of given page.
+
+    Dumps prior to export format 0.5 have no ns element, so the namespace
+    is taken from the title prefix.
+    """
+    title = _text(page.get('title'))
+    if 'ns' in page:
+        namespace = page['ns']
+        prefix, sep, rest = title.partition(':')
+        if sep and namespaces.get(prefix) == namespace:
+            title = rest
+    else:
+        namespace = '0'
+        prefix, sep, rest = title.partition(':')
+        if sep and prefix in namespaces:
+            namespace = namespaces[prefix]
+            title = rest
+    return (namespace, title.replace(' ', '_'))
+
+
+def _revision_rows(page, revision):
+    """Get the revision and text row of a revision element.
+    """
+    rev_id = revision['id']
+    contributor = revision.get('contributor', {})
+    text = _text(revision.get('text'))
+    rev_len = unicode(len(text.encode('utf8')))
+
+    if 'id' in contributor:
+        (user, user_text) = (contributor['id'],
+                             _text(contributor.get('username')))
+    else:
+        (user, user_text) = ('0', _text(contributor.get('ip')))
+
+    return (
+        (rev_id, page['id'], rev_id, _text(revision.get('comment')), user,
+         user_text, revision.get('timestamp'),
+         '1' if 'minor' in revision else '0',
+         unicode(revision.get('deleted', 0)), rev_len,
+         revision.get('parentid')),
+        (rev_id, text, 'utf-8'),
+    )
+
+
+def _page_row(page, namespaces):
+    (namespace, title) = _namespace_and_title(page, namespaces)
+    return (page['id'], namespace, title, _text(page.get('restrictions')),
+            '0', '1' if 'redirect' in page else '0',
+            '1' if page.get('revisions') == 1 else '0',
+            '{0:.14f}'.format(random.random()), page.get('touched'),
+            page.get('latest'), page.get('len', '0'))
+
+
+def table_rows(xml_file, namespaces=None):
+    """Parse a pages-articles XML dump into rows of the page, revision and
+    text tables.
+
+    The columns of the rows are given by COLUMNS. Revision and text rows of
+    a page are generated before its page row.
+
+    :param xml_file:    File-like object with the uncompressed XML dump
+    :type xml_file:     file
+
+    :param namespaces:  Mapping of namespace names to numbers for dumps
+                        without siteinfo (see site_namespaces).
+    :type namespaces:   dict
+
+    :returns:   Sequence of (table, row) tuples. Row values are unicode
+                strings or None (NULL).
+    :rtype:     iterable
+    """
+    namespaces = dict(namespaces or {})
+    page = revision = contributor = None
+
+    # cElementTree only accepts native strings as event names
+    context = etree.iterparse(xml_file, events=(str('start'), str('end')))
+    (_, root) = next(context)
+
+    for (event, elem) in context:
+        tag = _local_name(elem.tag)
+
+        if event == 'start':
+            if tag == 'page':
+                page = {'revisions': 0}
+            elif tag == 'revision':
+                revision = {}
+            elif tag == 'contributor':
+                contributor = {}
+            continue
+
+        if revision is not None and elem.get('deleted'):
+            revision['deleted'] = (revision.get('deleted', 0)
+                                   | _DELETED_BITS.get(tag, 0))
+
+        if contributor is not None:
+            if tag == 'contributor':
+                revision['contributor'] = contributor
+                contributor = None
+            else:
+                contributor[tag] = _text(elem.text)
+        elif revision is not None:
+            if tag == 'revision':
+                (rev_row, text_row) = _revision_rows(page, revision)
+                yield ('revision', rev_row)
+                yield ('text', text_row)
+
+                page['revisions'] += 1
+                page['latest'] = rev_row[0]
+                page['touched'] = rev_row[6]
+                page['len'] = rev_row[9]
+                revision = None
+                elem.clear()
+            else:
+                revision[tag] = _text(elem.text)
+        elif page is not None:
+            if tag == 'page':
+                yield ('page', _page_row(page, namespaces))
+                page = None
+                # drop the parsed pages from the tree
+                root.clear()
+            else:
+                page[tag] = _text(elem.text)
+        elif tag == 'namespace' and elem.text:
+            namespaces[_text(elem.text)] = elem.get('key')
+
+
+def site_namespaces(xml_file):
+    """Read the namespaces from the siteinfo of a pages-articles XML dump.
+
+    Parsing stops after the siteinfo, so the header of a dump is sufficient.
+
+    :returns:   Mapping of namespace names to numbers
+    :rtype:     dict
+    """
+    namespaces = {}
+    for (event, elem) in etree.iterparse(xml_file):
+        tag = _local_name(elem.tag)
+        if tag == 'namespace' and elem.text:
+            namespaces[_text(elem.text)] = elem.get('key')
+        elif tag == 'siteinfo':
+            break
+    return namespaces
+
+
+def _strip_footer(chunks, footer=b'</mediawiki>'):
+    """Remove the closing root tag from the end of given XML chunks.
+    """
+    # hold back the last two chunks, the tag may span both
+    held = []
+    for chunk in chunks:
+        held.append(chunk)
+        if len(held) > 2:
+            yield held.pop(0)
+
+    tail = b''.join(held)
+    pos = tail.rfind(footer)
+    if pos != -1:
+        tail = tail[:pos]
+    yield tail
+
+
+def fragment_rows(chunks, namespaces):
+    """Parse page elements of a pages-articles XML dump into rows of the
+    page, revision and text tables.
+
+    This is used to parse the streams of multistream dumps, which contain
+    consecutive page elements. The footer of the dump is ignored.
+
+    :param chunks:      Sequence of XML data
+    :type chunks:       iterable
+
+    :param namespaces:  Mapping of namespace names to numbers
+    :type namespaces:   dict
+
+    :returns:   Sequence of (table, row) tuples
+    :rtype:     iterable
+    """
+    xml_file = wpi_utils.IterFile(itertools.chain(
+        [b'<mediawiki>'], _strip_footer(chunks), [b'</mediawiki>']))
+    return table_rows(xml_file, namespaces)
@@ -0,0 +1,52 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.benchmark
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+import wp_import.benchmark as wpi_bench
+import wp_import.mysql as wpi_mysql
+import wp_import.postgresql as wpi_psql
+
+
+def test_synthetic_dumps():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = wpi_bench.synthetic_dumps(tmp_dir, 50, bad_utf8_every=0)
+        eq_(len(paths), len(wpi_bench.SCHEMAS))
+        for path in paths:
+            stmts = list(wpi_psql.insert_statements(path))
+            eq_(sum(len(list(wpi_mysql.values_rows(stmt)))
+                    for stmt in stmts), 50)
+
+        results = wpi_bench.run(paths[:1])
+        eq_([result['stage'] for result in results],
+            ['decompression', 'filter_strings', 'convert_multirow_to_unicode',
+             'transform_insert', 'load',
+             'insert_statements', 'raw_insert_statements', 'copy_rows'])
+        eq_(set(result['rows'] for result in results), set([50]))
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.checkpoint
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from nose.tools import eq_
+
+import wp_import.checkpoint as wpi_checkpoint
+
+
+class FakeCursor(object):
+    """Cursor that records the executed statements and returns given
+    rows.
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.statements = []
+
+    def execute(self, stmt, params=None):
+        self.statements.append(stmt)
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+
+def test_load_without_table():
+    # planning must not create the checkpoint table
+    for load in (lambda cursor: wpi_checkpoint.load(cursor, 'redirect',
+                                                    '20091023'),
+                 lambda cursor: wpi_checkpoint.latest(cursor, 'redirect')):
+        cursor = FakeCursor([(False, )])
+        eq_(load(cursor), None)
+        eq_(len(cursor.statements), 1)
+        assert cursor.statements[0].startswith('SELECT to_regclass')
+
+
+def test_load():
+    cursor = FakeCursor([(True, ), ('redirect', '20091023', 'copy', 42,
+                                    False)])
+    eq_(wpi_checkpoint.load(cursor, 'redirect', '20091023'),
+        wpi_checkpoint.Checkpoint('redirect', '20091023', 'copy', 42, False))
+    assert not any('CREATE' in stmt for stmt in cursor.statements)
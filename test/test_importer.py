@@ -0,0 +1,381 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.importer
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import ConfigParser
+import contextlib
+import gzip
+import io
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+import sqlalchemy
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_
+
+import wp_import.importer as wpi_imp
+import wp_import.metrics as wpi_metrics
+import wp_import.postgresql as wpi_psql
+import wp_import.utils as wpi_utils
+
+PREFIX = os.path.join(*os.path.split(os.path.dirname(__file__))[:-1])
+TEST_DATA_DIR = os.path.join(PREFIX, 'test', 'data')
+DOWNLOAD_DIR = os.path.join(TEST_DATA_DIR, 'download')
+DUMP_PATH = os.path.join(DOWNLOAD_DIR, 'zh', '20091023',
+                         'zhwiki-20091023-pagelinks.sql.gz')
+
+CONFIG = """
+[Patterns]
+dump_file_pattern = (?P<language>[\\w_]+)wiki-(?P<date>\\d{8})-(?P<table>[\\w_-]+).*
+
+[Database]
+db_name_template = wp_${language}_${date}
+
+[Languages]
+zh = True
+"""
+
+OPTIONS = {
+    'decompressor': 'auto',
+    'manifest': None,
+    'metrics_file': None,
+    'metrics_format': 'json',
+    'delta': False,
+    'reimport': False,
+    'resume': False,
+    'pg_unlogged': False,
+    'parse_batch_size': 8,
+    'parse_workers': 1,
+    'pg_copy_format': 'text',
+    'pg_driver': 'psycopg2',
+    'pg_host': 'localhost',
+    'pg_load_mode': 'insert',
+    'pg_loader': 'psql',
+    'pg_user': 'wp',
+    'progress_interval': 0,
+    'queue_memory': 64,
+    'queue_size': 0,
+    'unordered': False,
+}
+
+
+class FakeOptions(object):
+
+    def __init__(self, **options):
+        self.__dict__.update(OPTIONS)
+        self.__dict__.update(options)
+
+
+class CountingImporter(wpi_imp.PostgreSQLImporter):
+    """Importer that only reports the metrics of its imports.
+    """
+
+    def _import_dump(self, dump_info):
+        table_metrics = self._metrics(dump_info)
+        wpi_metrics.count('decode_fallbacks', int(dump_info.dump_date[-2:]))
+        self._report_metrics(table_metrics)
+        return True
+
+
+class FakeEngine(object):
+
+    disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+class FakeDatabase(object):
+    """mwdb database that only keeps the names of its tables.
+    """
+
+    def __init__(self, name, table_names):
+        self.name = name
+        self.table_names = list(table_names)
+        self.truncated = []
+        self.engine = FakeEngine()
+
+    def create_table(self, table_name, pkey, index):
+        self.table_names.append(table_name)
+
+    def drop_table(self, table_name):
+        self.table_names.remove(table_name)
+
+    def truncate_table(self, table_name):
+        self.truncated.append(table_name)
+
+    def drop_pkey_constraint(self, table_name):
+        pass
+
+    drop_indexes = create_pkey_constraint = create_indexes = \
+            drop_pkey_constraint
+
+
+class MismatchImporter(wpi_imp.PostgreSQLImporter):
+    """Importer whose tables never match the table definition of the dumps.
+    """
+
+    def _connect_to_db(self, dump_info):
+        return self.dump_db
+
+    def _check_schema(self, dump_info):
+        self.checked_tables.append((list(self.dump_db.table_names),
+                                    list(self.dump_db.truncated)))
+        return False
+
+
+def _importer(cls=wpi_imp.PostgreSQLImporter, config_text=CONFIG, **options):
+    config = ConfigParser.SafeConfigParser()
+    config.readfp(io.StringIO(config_text))
+    return cls(config, FakeOptions(**options))
+
+
+def _dump_info(path=DUMP_PATH):
+    return wpi_utils.DumpInfo(path, _importer().dump_file_pat)
+
+
+def _write_dump(dir_path, statements):
+    path = os.path.join(dir_path, 'zhwiki-20091023-pagelinks.sql.gz')
+    with gzip.open(path, 'wb') as dump_f:
+        dump_f.writelines(statements)
+    return path
+
+
+# psql that fails like a COPY with a bad row: it exits with 3 if it stops
+# at errors and with 0 otherwise
+FAKE_PSQL = """#!/bin/sh
+cat > "$(dirname "$0")/stdin"
+case "$*" in *ON_ERROR_STOP=1*) exit 3;; esac
+exit 0
+"""
+
+
+@contextlib.contextmanager
+def _failing_psql(dir_path):
+    path = os.path.join(dir_path, 'psql')
+    with open(path, 'w') as psql_f:
+        psql_f.write(FAKE_PSQL)
+    os.chmod(path, stat.S_IRWXU)
+    search_path = os.environ['PATH']
+    os.environ[b'PATH'] = os.pathsep.join([dir_path, search_path]).encode(
+        'utf8')
+    try:
+        yield os.path.join(dir_path, 'stdin')
+    finally:
+        os.environ[b'PATH'] = search_path
+
+
+def test_checkpointed_imports_are_ordered():
+    eq_(_importer(unordered=True)._ordered(), False)
+    eq_(_importer(unordered=True, pg_loader='psycopg2')._ordered(), True)
+
+    # batches are loaded in dump order, so that --resume skips loaded rows
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = _write_dump(tmp_dir, [
+            "INSERT INTO `pagelinks` VALUES ({0:d},0,'Ni');\n".format(
+                i).encode('ascii') for i in range(64)])
+        importer = _importer(unordered=True, pg_loader='psycopg2',
+                             parse_workers=4, parse_batch_size=1)
+        eq_(list(importer._get_copy_rows(_dump_info(path), skip=10)),
+            list(wpi_psql.copy_rows(path, skip=10)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_percent_is_loaded_verbatim():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = _write_dump(tmp_dir, [
+            b"INSERT INTO `pagelinks` VALUES (1,0,'100%'),(2,0,'%s');\n"])
+        importer = _importer()
+        eq_(list(importer._get_insert_statements(_dump_info(path))),
+            [b"""INSERT INTO "pagelinks" VALUES (1,0,'100%'),(2,0,'%s');\n"""])
+        eq_(list(importer._get_copy_rows(_dump_info(path))),
+            ['1\t0\t100%\n', '2\t0\t%s\n'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_import_worker_metrics():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        metrics_path = os.path.join(tmp_dir, 'wp_import.prom')
+        importer = _importer(CountingImporter, metrics_file=metrics_path,
+                             metrics_format='prometheus')
+        dumps = [_dump_info(os.path.join(
+            tmp_dir, 'zhwiki-200910{0:02d}-pagelinks.sql.gz'.format(day)))
+            for day in range(1, 29)]
+
+        # --jobs: worker processes write the file concurrently
+        pool = multiprocessing.Pool(4)
+        try:
+            eq_(pool.map(wpi_imp._import_worker,
+                         [(importer, [dump_info]) for dump_info in dumps]),
+                [True] * len(dumps))
+        finally:
+            pool.close()
+            pool.join()
+        # --databases: threads count separately
+        os.remove(metrics_path)
+        assert importer._import_concurrent(
+            dumps, 4, dict((di.path, 1) for di in dumps))
+
+        lines = open(metrics_path).read().splitlines()
+        eq_(sorted(line for line in lines if 'decode_fallbacks' in line),
+            sorted('wp_import_decode_fallbacks_total{{import="wp_zh_{0}.'
+                   'pagelinks"}} {1:d}'.format(di.dump_date,
+                                               int(di.dump_date[-2:]))
+                   for di in dumps))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_database_name():
+    importer = _importer()
+    dump_info = _dump_info()
+    eq_(importer._database_name(dump_info), 'wp_zh_20091023')
+    eq_(importer._database_name(wpi_utils.DumpInfo(
+        'zhwiki-00091023-pagelinks.sql.gz', importer.dump_file_pat)),
+        'wp_zh_00091023')
+
+
+def test_failing_psql():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = _write_dump(tmp_dir, [
+            b"INSERT INTO `pagelinks` VALUES (1,0,'Ni'),(2,0,'Ekke');\n"])
+        with _failing_psql(tmp_dir) as stdin_path:
+            for load_mode in ('copy', 'insert'):
+                importer = _importer(pg_load_mode=load_mode)
+                eq_(importer._load_sql_dump(_dump_info(path)), False)
+            eq_(open(stdin_path, 'rb').read(),
+                b"""INSERT INTO "pagelinks" VALUES (1,0,'Ni'),"""
+                b"""(2,0,'Ekke');\n""")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_failing_psql_streams():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with _failing_psql(tmp_dir):
+            importer = _importer()
+            columns = {'page': ['page_id'], 'text': ['old_id']}
+            eq_(importer._psql_copy_streams(
+                'wp_zh', columns, [('page', '1\n'), ('text', '2\n')]), False)
+
+            # psql processes are reaped if the rows can't be read
+            processes = []
+            psql_process = importer._psql_process
+
+            def track_process(db_name):
+                processes.append(psql_process(db_name))
+                return processes[-1]
+
+            def rows():
+                yield ('page', '1\n')
+                raise SyntaxError('not well-formed')
+
+            importer._psql_process = track_process
+            try:
+                importer._psql_copy_streams('wp_zh', columns, rows())
+            except SyntaxError:
+                pass
+            eq_(len(processes), 2)
+            assert all(process.returncode is not None
+                       for process in processes)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_schema_mismatch():
+    importer = _importer(MismatchImporter)
+    importer.checked_tables = []
+
+    # a new table is dropped, so that the next run imports the dump
+    importer.dump_db = FakeDatabase('wp_zh_20091023', [])
+    eq_(importer._import_sql_dump(_dump_info()), False)
+    eq_(importer.dump_db.table_names, [])
+
+    # an existing table is checked before it is emptied
+    importer._tables = {}
+    importer.dump_db = FakeDatabase('wp_zh_20091023', ['pagelinks'])
+    eq_(importer._import_sql_dump(_dump_info(), reimport=True), False)
+    eq_(importer.dump_db.truncated, [])
+    eq_(importer.checked_tables, [(['pagelinks'], []), (['pagelinks'], [])])
+
+
+def test_maintenance_settings():
+    pg_options = os.environ.get('PGOPTIONS')
+    importer = _importer(config_text=CONFIG + """
+[DEFAULT]
+ni = 1
+
+[Maintenance]
+maintenance_work_mem = 1GB
+max parallel = 4
+""")
+    eq_(importer._maintenance_settings, (('maintenance_work_mem', '1GB'), ))
+    eq_(os.environ.get('PGOPTIONS'), pg_options)
+
+
+def test_session_settings():
+    if 'PGHOST' not in os.environ:
+        raise SkipTest('needs a PostgreSQL server (PGHOST)')
+    engine = sqlalchemy.create_engine(
+        'postgresql+psycopg2://', connect_args=dict(
+            (name, os.environ[env]) for (name, env) in
+            (('host', 'PGHOST'), ('port', 'PGPORT'), ('user', 'PGUSER'),
+             ('dbname', 'PGDATABASE')) if env in os.environ))
+    show = lambda: engine.execute('SHOW maintenance_work_mem').scalar()
+    try:
+        default = show()
+        with wpi_imp._session_settings((('maintenance_work_mem', '1GB'), )):
+            eq_(show(), '1GB')
+            # the connection of the pool is reused
+            eq_(show(), '1GB')
+        eq_(show(), default)
+    finally:
+        engine.dispose()
+
+
+def test_release_db():
+    importer = _importer(index_workers=1)
+    thread = threading.current_thread().ident
+    (own, other) = (FakeDatabase('wp_zh_20091023', ['pagelinks']),
+                    FakeDatabase('wp_zh_20091023', ['pagelinks']))
+    importer._dump_dbs = {('wp_zh_20091023', thread): own,
+                          ('wp_zh_20091023', thread + 1): other}
+
+    # index workers close their connection after every build
+    eq_(importer._create_indexes(_dump_info(), ['pagelinks']), True)
+    eq_(list(importer._dump_dbs), [('wp_zh_20091023', thread + 1)])
+    eq_((own.engine.disposed, other.engine.disposed), (True, False))
+
+    importer._release_db('wp_zh_20091023')
+    eq_(other.engine.disposed, False)
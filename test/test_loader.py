@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.loader
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_
+
+import wp_import.loader as wpi_loader
+
+
+class FakeOptions(object):
+    # connect like psql does (PGHOST, PGPORT, PGUSER)
+    pg_user = os.environ.get('PGUSER')
+    pg_password = os.environ.get('PGPASSWORD')
+    pg_host = os.environ.get('PGHOST')
+    pg_port = os.environ.get('PGPORT')
+
+
+def _loader():
+    if wpi_loader.psycopg2 is None or 'PGHOST' not in os.environ:
+        raise SkipTest('needs psycopg2 and a PostgreSQL server (PGHOST)')
+    return wpi_loader.Psycopg2Loader(
+        wpi_loader.ConnectionPool(FakeOptions()))
+
+
+def test_iter_file():
+    iter_file = wpi_loader.IterFile(['1\tni\n', '2\t使用者\n', '3\tit\n'])
+    eq_(iter_file.read(4), b'1\tni')
+    eq_(iter_file.read(3), b'\n2\t')
+    eq_(iter_file.read(), '使用者\n3\tit\n'.encode('utf8'))
+    eq_(iter_file.read(10), b'')
+    eq_(iter_file.count, 3)
+
+    iter_file = wpi_loader.IterFile(['a\n', 'b\n'])
+    eq_(iter_file.readline(), b'a\n')
+    eq_(iter_file.readline(), b'b\n')
+    eq_(iter_file.readline(), b'')
+
+
+def test_delta_null():
+    loader = _loader()
+    db_name = os.environ.get('PGDATABASE', 'postgres')
+    rows = ['1\tni\t\\N\n', '2\t\t5\n', '3\t\\N\t6\n']
+    try:
+        loader.execute(db_name, 'witch', [
+            'DROP TABLE IF EXISTS "witch"',
+            'CREATE TABLE "witch" (id integer, name text, weight integer)'])
+        loader.copy(db_name, 'witch', rows)
+
+        # unchanged rows with NULL columns are kept, an empty string
+        # replaced by NULL is not
+        eq_(loader.delta(db_name, 'witch', rows[:1] + [
+            '2\t\\N\t5\n', '3\t\\N\t6\n', '4\tit\t\\N\n']), (1, 2))
+        with loader.pool.connection(db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, name, weight FROM "witch" ORDER BY id')
+            eq_(cursor.fetchall(), [(1, 'ni', None), (2, None, 5),
+                                    (3, None, 6), (4, 'it', None)])
+    finally:
+        loader.execute(db_name, 'witch', ['DROP TABLE IF EXISTS "witch"'])
+        loader.pool.close()
@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.manifest
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+import wp_import.manifest as wpi_manifest
+
+
+def test_content_hash():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'dewiki-20091023-redirect.sql.gz')
+        with open(path, 'wb') as dump_f:
+            dump_f.write(b'\0' * (1 << 16) + b'ni' + b'\0' * (1 << 16))
+        complete = wpi_manifest.content_hash(path)
+        eq_(complete, wpi_manifest.content_hash(path, 2, 1 << 20))
+        sampled = wpi_manifest.content_hash(path, 2, 1 << 10)
+        assert complete != sampled
+
+        # only the samples are hashed
+        with open(path, 'r+b') as dump_f:
+            dump_f.seek(1 << 16)
+            dump_f.write(b'Ni')
+        eq_(wpi_manifest.content_hash(path, 2, 1 << 10), sampled)
+        assert complete != wpi_manifest.content_hash(path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_manifest():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'dewiki-20091023-redirect.sql.gz')
+        manifest_path = os.path.join(tmp_dir, 'manifest.json')
+        with open(path, 'wb') as dump_f:
+            dump_f.write(b'shrubbery')
+
+        manifest = wpi_manifest.Manifest(manifest_path)
+        eq_(manifest.status(path, 'wp_de'), wpi_manifest.NEW)
+        manifest.record(path, 'wp_de', ['redirect'], 23)
+        eq_(manifest.status(path, 'wp_de'), wpi_manifest.UNCHANGED)
+        eq_(manifest.status(path, 'wp_en'), wpi_manifest.NEW)
+
+        # a copy with a new modification time
+        os.utime(path, (0, 0))
+        manifest = wpi_manifest.Manifest(manifest_path)
+        eq_(manifest.status(path, 'wp_de'), wpi_manifest.UNCHANGED)
+        # status doesn't write the manifest
+        assert wpi_manifest.Manifest(manifest_path).entries[path]['mtime']
+        manifest.touch(path)
+        entry = wpi_manifest.Manifest(manifest_path).entries[path]
+        eq_((entry['mtime'], entry['tables'], entry['rows']),
+            (0, ['redirect'], 23))
+
+        with open(path, 'wb') as dump_f:
+            dump_f.write(b'Shrubbery')
+        os.utime(path, (1, 1))
+        eq_(manifest.status(path, 'wp_de'), wpi_manifest.CHANGED)
+        with open(path, 'ab') as dump_f:
+            dump_f.write(b'!')
+        eq_(manifest.status(path, 'wp_de'), wpi_manifest.CHANGED)
+
+        # entries of other processes are kept
+        other = wpi_manifest.Manifest(manifest_path)
+        other.record(manifest_path, 'wp_de', ['witch'])
+        manifest.record(path, 'wp_de', ['redirect'], 42)
+        eq_(sorted(json.load(open(manifest_path))['files']),
+            sorted([path, manifest_path]))
+    finally:
+        shutil.rmtree(tmp_dir)
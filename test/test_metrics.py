@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.metrics
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_
+
+import wp_import.metrics as wpi_metrics
+import wp_import.postgresql as wpi_psql
+import wp_import.utils as wpi_utils
+
+PREFIX = os.path.join(*os.path.split(os.path.dirname(__file__))[:-1])
+DOWNLOAD_DIR = os.path.join(PREFIX, 'test', 'data', 'download')
+
+
+def test_metrics():
+    for dump_path in wpi_utils.find('*categorylinks*.sql.gz', DOWNLOAD_DIR):
+        metrics = wpi_metrics.Metrics('wp_de.categorylinks')
+        eq_(list(wpi_psql.raw_insert_statements(dump_path,
+                                                metrics=metrics)),
+            list(wpi_psql.raw_insert_statements(dump_path)))
+
+        report = metrics.report()
+        eq_(report['counters']['statements'], 1)
+        eq_(report['counters']['bytes_compressed'],
+            os.path.getsize(dump_path))
+        assert report['counters']['bytes_decompressed'] > \
+                report['counters']['bytes_compressed']
+        eq_(list(report['stages']),
+            ['decompression', 'filter_strings', 'utf8_multirow',
+             'transform_insert', 'output', 'load'])
+
+
+def test_count():
+    metrics = wpi_metrics.Metrics('wp_de.redirect')
+    wpi_metrics.count('decode_fallbacks', 2)
+    eq_(metrics.report()['counters'], {'decode_fallbacks': 2})
+
+
+def test_count_per_thread():
+    metrics = wpi_metrics.Metrics('wp_de.redirect')
+    # other imports are not counted, the threads of the pipeline are
+    thread = threading.Thread(target=wpi_metrics.count,
+                              args=('decode_fallbacks', 23))
+    thread.start()
+    thread.join()
+    seq = (wpi_metrics.count('dropped_rows') for i in range(3))
+    eq_(len(list(wpi_utils.buffered(seq, size=lambda el: 1))), 3)
+    eq_(metrics.report()['counters'], {'dropped_rows': 3})
+
+
+def test_metrics_writer():
+    report = {'name': 'wp_de.redirect', 'seconds': 1.5,
+              'stages': {'load': 1.0}, 'counters': {'rows': 23}}
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(tmp_dir, 'metrics.json')
+        writer = wpi_metrics.MetricsWriter(json_path, 'json')
+        writer.write(report)
+        writer.write(report)
+        eq_([json.loads(line) for line in open(json_path)],
+            [report, report])
+
+        prom_path = os.path.join(tmp_dir, 'wp_import.prom')
+        writer = wpi_metrics.MetricsWriter(prom_path, 'prometheus')
+        writer.write(report)
+        writer.write(dict(report, name='wp_de.langlinks'))
+        writer.write(report)
+        lines = open(prom_path).read().splitlines()
+        eq_(len(lines), 6)
+        eq_(lines[-3:],
+            ['wp_import_seconds{import="wp_de.redirect"} 1.5',
+             'wp_import_stage_seconds{import="wp_de.redirect",stage="load"} '
+             '1.0',
+             'wp_import_rows_total{import="wp_de.redirect"} 23'])
+    finally:
+        shutil.rmtree(tmp_dir)
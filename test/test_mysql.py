@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.mysql
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from nose.tools import eq_
+
+import wp_import.mysql as wpi_mysql
+
+
+def test_unescape():
+    eq_(wpi_mysql.unescape(r"it\'s a \\ newt\n"), "it's a \\ newt\n")
+    eq_(wpi_mysql.unescape(r'\0\Z\"'), '\0\x1a"')
+    eq_(wpi_mysql.unescape('shrubbery'), 'shrubbery')
+
+
+def test_values_rows():
+    eq_(list(wpi_mysql.values_rows(
+        "INSERT INTO `witch` VALUES (1,'ne (wt)',NULL),"
+        "(2,'it\\'s ),( a duck',''),(3,'\\\\',-4.5);")),
+        [('1', 'ne (wt)', None),
+         ('2', "it's ),( a duck", ''),
+         ('3', '\\', '-4.5')])
+    eq_(list(wpi_mysql.values_rows('INSERT INTO `witch` VALUES ();')),
+        [()])
+
+
+def test_split_header():
+    (schema, lines) = wpi_mysql.split_header([
+        b'-- MySQL dump 10.11\n',
+        b'CREATE TABLE `categorylinks` (\n',
+        b"  `cl_from` int(8) unsigned NOT NULL default '0',\n",
+        b"  `cl_to` varchar(255) binary NOT NULL default '',\n",
+        b'  `cl_timestamp` timestamp(14) NOT NULL,\n',
+        b"  `cl_type` enum('page','subcat','file') default NULL,\n",
+        b'  PRIMARY KEY (`cl_from`,`cl_to`),\n',
+        b'  KEY `cl_timestamp` (`cl_to`(20),`cl_timestamp`)\n',
+        b') TYPE=InnoDB;\n',
+        b'INSERT INTO `categorylinks` VALUES (1,20080218135752);\n',
+        b'UNLOCK TABLES;\n'])
+    eq_(schema, wpi_mysql.Schema(
+        'categorylinks',
+        [wpi_mysql.Column('cl_from', 'int', '8', True, False, False),
+         wpi_mysql.Column('cl_to', 'varchar', '255', False, True, False),
+         wpi_mysql.Column('cl_timestamp', 'timestamp', '14', False, False,
+                          False),
+         wpi_mysql.Column('cl_type', 'enum', "'page','subcat','file'", False,
+                          False, True)],
+        ('cl_from', 'cl_to'),
+        [wpi_mysql.Key('cl_timestamp', False, ('cl_to', 'cl_timestamp'))]))
+    eq_(list(lines), [b'INSERT INTO `categorylinks` VALUES '
+                      b'(1,20080218135752);\n', b'UNLOCK TABLES;\n'])
+    eq_(wpi_mysql.timestamp_columns(schema), (2, ))
+    eq_(wpi_mysql.split_header([b'INSERT INTO `witch` VALUES (1);\n'])[0],
+        None)
@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.plan
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+from nose.tools import eq_
+
+import wp_import.plan as wpi_plan
+import wp_import.utils as wpi_utils
+
+FN_REGEX = r'(?P<language>[\w_]+)wiki-(?P<date>\d{8})-(?P<table>[\w_-]+).*'
+
+
+def _step(filename, action, size, seconds):
+    return wpi_plan.Step(wpi_utils.DumpInfo(filename, FN_REGEX, size),
+                         'wp_' + filename[:2], [filename.split('-')[2][:-7]],
+                         action, seconds)
+
+
+def test_throughput():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        metrics_path = os.path.join(tmp_dir, 'metrics.json')
+        with open(metrics_path, 'w') as metrics_f:
+            for (name, size, seconds) in [('wp_de.pagelinks', 300, 1.0),
+                                          ('wp_en.pagelinks', 100, 1.0),
+                                          ('wp_de.text[0-10]', 50, 0.5)]:
+                metrics_f.write(json.dumps({
+                    'name': name, 'seconds': seconds,
+                    'counters': {'bytes_compressed': size}}) + '\n')
+            metrics_f.write('{"name": "wp_de.redirect", "seconds": 0.0, '
+                            '"counters": {}}\n')
+
+        rates = wpi_plan.throughput(metrics_path)
+        eq_(rates, {'pagelinks': 200.0, 'text': 100.0, None: 180.0})
+        eq_(wpi_plan.estimate(400, 'pagelinks', wpi_plan.CREATE, rates), 2.0)
+        eq_(wpi_plan.estimate(360, 'langlinks', wpi_plan.REIMPORT, rates),
+            2.0)
+        eq_(wpi_plan.estimate(400, 'pagelinks', wpi_plan.SKIP, rates), 0.0)
+        eq_(wpi_plan.throughput(os.path.join(tmp_dir, 'missing')), {})
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_makespan():
+    eq_(wpi_plan.makespan([5, 4, 3, 3], 2), 8)
+    eq_(wpi_plan.makespan([5, 4, 3], 1), 12)
+    eq_(wpi_plan.makespan([], 4), 0)
+
+
+def test_summary():
+    steps = [_step('dewiki-20091023-pagelinks.sql.gz', wpi_plan.CREATE,
+                   3 << 20, 30.0),
+             _step('dewiki-20091023-redirect.sql.gz', wpi_plan.SKIP,
+                   1 << 20, 0.0),
+             _step('enwiki-20091017-pagelinks.sql.gz', wpi_plan.RESUME,
+                   1 << 20, 10.0)]
+    eq_(wpi_plan.summary(steps, 2),
+        {'files': 3, 'bytes': 4 << 20, 'seconds': 40.0, 'workers': 2,
+         'makespan': 30.0,
+         'actions': {'create': 1, 'skip': 1, 'resume': 1}})
+
+    plan = json.loads(wpi_plan.to_json(steps, 1))
+    eq_([(step['database'], step['action']) for step in plan['steps']],
+        [('wp_de', 'create'), ('wp_de', 'skip'), ('wp_en', 'resume')])
+    eq_(plan['summary']['makespan'], 40.0)
+
+    table = wpi_plan.to_table(steps, 1)
+    eq_(len(table.splitlines()), 6)
+    assert table.splitlines()[-1].startswith('3 files (1 create, 1 resume, '
+                                             '1 skip), 4.0 MB to load')
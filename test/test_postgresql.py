@@ -28,6 +28,9 @@ import tempfile
 
 from nose.tools import *
 
+import wp_import.exceptions as wpi_exc
+import wp_import.mysql as wpi_mysql
+import wp_import.rowfilter as wpi_rowfilter
 import wp_import.utils as wpi_utils
 import wp_import.postgresql as wpi_psql
 
@@ -126,3 +129,157 @@ def test_password_from_pgpass():
         tmp_f.seek(0)
         assert_raises(KeyError, wpi_psql.password_from_pgpass,
                       options=options)
+
+
+def test_timestamp_field_to_iso_8601():
+    eq_(wpi_psql.timestamp_field_to_iso_8601('20080218135752'),
+        '2008-02-18T13:57:52Z')
+    eq_(wpi_psql.timestamp_field_to_iso_8601('42'), '42')
+    eq_(wpi_psql.timestamp_field_to_iso_8601(None), None)
+
+
+def test_copy_text_row():
+    eq_(wpi_psql.copy_text_row(('12', None, 'P/NP問題')),
+        '12\t\\N\tP/NP問題\n')
+    eq_(wpi_psql.copy_text_row(('a\\b', 'c\td\ne', 'f\0')),
+        'a\\\\b\tc\\td\\ne\tf\n')
+
+
+def test_copy_csv_row():
+    eq_(wpi_psql.copy_csv_row(('12', None, 'say "ni"', '')),
+        '"12",,"say ""ni""",""\n')
+
+
+def test_copy_statement():
+    eq_(wpi_psql.copy_statement('redirect'), 'COPY "redirect" FROM STDIN')
+    eq_(wpi_psql.copy_statement('text', 'csv', ['old_id', 'old_text']),
+        'COPY "text" ("old_id", "old_text") FROM STDIN WITH CSV')
+
+
+def test_copy_rows():
+    for dump_path in sorted(wpi_utils.find('*categorylinks*.sql.gz',
+                                           DOWNLOAD_DIR)):
+        eq_(list(wpi_psql.copy_rows(dump_path)),
+            ['130\tLinux\tLinux内核\t2006-07-25T19:03:22Z\n'])
+
+
+def test_copy_rows_filtered():
+    row_filter = wpi_rowfilter.RowFilter(
+        'categorylinks', (('cl_to', frozenset(['Linux'])), ),
+        ('cl_from', 'cl_timestamp'))
+    for dump_path in sorted(wpi_utils.find('*categorylinks*.sql.gz',
+                                           DOWNLOAD_DIR)):
+        eq_(list(wpi_psql.copy_rows(dump_path, row_filter=row_filter)),
+            ['130\t2006-07-25T19:03:22Z\n'])
+        eq_(list(wpi_psql.raw_insert_statements(dump_path,
+                                                row_filter=row_filter)),
+            [b'INSERT INTO "categorylinks" ("cl_from","cl_timestamp") '
+             b"VALUES (130,'2006-07-25T19:03:22Z');\n"])
+        eq_(list(wpi_psql.parallel_pipeline(
+            dump_path, 2, 'text', row_filter=row_filter._replace(
+                conditions=(('cl_to', frozenset(['Ni'])), )))), [])
+
+
+def test_parallel_pipeline():
+    for dump_path in sorted(wpi_utils.find('*.sql.gz', DOWNLOAD_DIR)):
+        eq_(list(wpi_psql.parallel_pipeline(dump_path, 2)),
+            list(wpi_psql.raw_insert_statements(dump_path)))
+        eq_(sorted(wpi_psql.parallel_pipeline(dump_path, 2, 'text',
+                                              ordered=False)),
+            sorted(wpi_psql.copy_rows(dump_path)))
+
+
+def test_raw_insert_statements():
+    fn_pat = re.compile(
+        r'''(?P<language>\w+)wiki-(?P<date>\d{8})-(?P<table>[\w_]+).*''')
+    for dump_path in sorted(wpi_utils.find('*.sql.gz', DOWNLOAD_DIR)):
+        mat = fn_pat.match(os.path.basename(dump_path))
+        eq_(list(wpi_psql.raw_insert_statements(dump_path)),
+            [(stmt + '\n').encode('utf8')
+             for stmt in EXPECTED_STMTS[mat.group('table')]])
+
+
+def test_resume_undecodable():
+    # statements without decodable rows don't count towards skip, as they
+    # were never loaded
+    with tempfile.NamedTemporaryFile(suffix='.sql') as tmp_f:
+        tmp_f.write(b"INSERT INTO `witch` VALUES (1,'a'),(2,'b');\n"
+                    b"INSERT INTO `witch` VALUES (3,'\xe5'),(4,'\xe5');\n"
+                    b"INSERT INTO `witch` VALUES (5,'c');\n")
+        tmp_f.flush()
+        statements = list(wpi_psql.raw_insert_statements(tmp_f.name))
+        eq_(len(statements), 2)
+        for skip in range(3):
+            eq_(list(wpi_psql.raw_insert_statements(tmp_f.name, skip=skip)),
+                statements[skip:])
+            eq_(list(wpi_psql.parallel_pipeline(tmp_f.name, 2, batch_size=1,
+                                                skip=skip)),
+                statements[skip:])
+
+
+def test_raw_pipeline():
+    mul_row = [b"INSERT INTO `witch` VALUES ('\xc3\xa5',20080218135752),"
+               b"('\xe5',42);\n"]
+    eq_(list(wpi_psql.raw_pipeline(mul_row, timestamp_columns=(1, ))),
+        [b'''INSERT INTO "witch" VALUES '''
+         b"('\xc3\xa5','2008-02-18T13:57:52Z');\n"])
+
+
+def test_transform_insert():
+    stmt = ("INSERT INTO `witch` VALUES (1,'`ni` (20080218135752)',"
+            "20080218135752,NULL),(2,'it\\'s 100%',20080218135752,1),"
+            "(3,'ni',NULL,20080218135752);")
+    eq_(wpi_psql.transform_insert(stmt),
+        stmt.replace('INSERT INTO `witch`', 'INSERT INTO "witch"'))
+    eq_(wpi_psql.transform_insert(stmt, (2, ), escape_percent=True),
+        """INSERT INTO "witch" VALUES (1,'`ni` (20080218135752)',"""
+        "'2008-02-18T13:57:52Z',NULL),(2,'it\\'s 100%%',"
+        "'2008-02-18T13:57:52Z',1),(3,'ni',NULL,20080218135752);")
+    eq_(wpi_psql.transform_insert(stmt.encode('utf8'), (2, )),
+        wpi_psql.transform_insert(stmt, (2, )).encode('utf8'))
+
+
+def test_persistence_statement():
+    eq_(wpi_psql.persistence_statement('redirect'),
+        'ALTER TABLE "redirect" SET LOGGED')
+    eq_(wpi_psql.persistence_statement('redirect', logged=False),
+        'ALTER TABLE "redirect" SET UNLOGGED')
+
+
+def test_check_schema():
+    schema = wpi_mysql.Schema('redirect', [
+        wpi_mysql.Column('rd_from', 'int', '8', True, False, False),
+        wpi_mysql.Column('rd_namespace', 'int', '11', False, False, False),
+        wpi_mysql.Column('rd_title', 'varbinary', '255', False, True, False),
+    ], ('rd_from', ), [])
+    eq_([wpi_psql.column_type(column) for column in schema.columns],
+        ['bigint', 'integer', 'text'])
+    wpi_psql.check_schema('wp_de', schema, [
+        ('rd_from', 'integer'), ('rd_namespace', 'bigint'),
+        ('rd_title', 'character varying')])
+
+    with assert_raises(wpi_exc.SchemaError) as cm:
+        wpi_psql.check_schema('wp_de', schema, [
+            ('rd_from', 'integer'), ('rd_namespace', 'text'),
+            ('rd_fragment', 'text'), ('rd_title', 'timestamp with time zone')])
+    eq_(cm.exception.problems,
+        ['3 columns in dump, 4 in table',
+         'column rd_title in dump, rd_fragment in table'])
+    with assert_raises(wpi_exc.SchemaError) as cm:
+        wpi_psql.check_schema('wp_de', schema, [
+            ('rd_from', 'integer'), ('rd_namespace', 'integer'),
+            ('rd_title', 'integer')])
+    eq_(cm.exception.problems, ["rd_title: text can't be loaded into integer"])
+
+
+def test_delta_statements():
+    eq_(wpi_psql.delta_statements('redirect'), (
+        'redirect_stage',
+        'CREATE TEMPORARY TABLE "redirect_stage" (LIKE "redirect" '
+        'INCLUDING DEFAULTS) ON COMMIT DROP',
+        'DELETE FROM "redirect" WHERE NOT EXISTS (SELECT 1 FROM '
+        '"redirect_stage" WHERE ROW("redirect_stage".*)::text = '
+        'ROW("redirect".*)::text)',
+        'INSERT INTO "redirect" SELECT * FROM "redirect_stage" WHERE NOT '
+        'EXISTS (SELECT 1 FROM "redirect" WHERE ROW("redirect".*)::text = '
+        'ROW("redirect_stage".*)::text)'))
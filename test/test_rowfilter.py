@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.rowfilter
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import ConfigParser
+import io
+
+from nose.tools import assert_raises, eq_
+
+import wp_import.exceptions as wpi_exc
+import wp_import.mysql as wpi_mysql
+import wp_import.rowfilter as wpi_rowfilter
+import wp_import.utils as wpi_utils
+
+CONFIG = """
+[Database]
+db_name_template = wp_${language}_${date}
+
+[Filter:pagelinks]
+pl_namespace = 0, 14
+columns = pl_from,pl_title
+
+[Filter:redirect]
+rd_namespace = 4
+"""
+
+SCHEMA = wpi_mysql.parse_create_table([
+    b'CREATE TABLE `pagelinks` (\n',
+    b"  `pl_from` int(8) unsigned NOT NULL default '0',\n",
+    b"  `pl_namespace` int(11) NOT NULL default '0',\n",
+    b"  `pl_title` varbinary(255) NOT NULL default '',\n",
+    b') ENGINE=InnoDB DEFAULT CHARSET=binary;\n'])
+
+STMT = (b"INSERT INTO `pagelinks` VALUES (1,0,'Ni, it\\'s'),(2,4,'Ni'),"
+        b"(3,14,'Linux\xe5\x86\x85\xe6\xa0\xb8');\n")
+
+
+def _filters():
+    config = ConfigParser.SafeConfigParser()
+    config.readfp(io.StringIO(CONFIG))
+    return wpi_rowfilter.from_config(config)
+
+
+def test_from_config():
+    filters = _filters()
+    eq_(sorted(filters), ['pagelinks', 'redirect'])
+    eq_(filters['pagelinks'], wpi_rowfilter.RowFilter(
+        'pagelinks', (('pl_namespace', frozenset(['0', '14'])), ),
+        ('pl_from', 'pl_title')))
+    eq_(filters['redirect'].columns, None)
+
+
+def test_resolve():
+    filters = _filters()
+    eq_(wpi_rowfilter.resolve(None, SCHEMA), None)
+    resolved = wpi_rowfilter.resolve(filters['pagelinks'], SCHEMA)
+    eq_(resolved.conditions, ((1, frozenset(['0', '14'])), ))
+    eq_(resolved.projection, (0, 2))
+    eq_(wpi_rowfilter.projected_positions(resolved, (1, 2)), (1, ))
+    assert_raises(wpi_exc.FilterError, wpi_rowfilter.resolve,
+                  filters['redirect'], SCHEMA)
+    assert_raises(wpi_exc.FilterError, wpi_rowfilter.resolve,
+                  filters['pagelinks'], None)
+
+
+def test_filter_rows():
+    resolved = wpi_rowfilter.resolve(_filters()['pagelinks'], SCHEMA)
+    rows = [('1', '0', 'Ni'), ('2', '4', 'Ni'), ('3', None, 'Ni')]
+    eq_(list(wpi_rowfilter.filter_rows(rows, resolved)), [('1', 'Ni')])
+    eq_(list(wpi_rowfilter.filter_rows(
+        rows, resolved._replace(conditions=((1, frozenset([None])), )))),
+        [('3', 'Ni')])
+
+
+def test_filter_insert():
+    row_filter = _filters()['pagelinks']
+    resolved = wpi_rowfilter.resolve(row_filter, SCHEMA)
+    eq_(wpi_rowfilter.filter_insert(STMT, resolved),
+        b"INSERT INTO `pagelinks` (`pl_from`,`pl_title`) VALUES "
+        b"(1,'Ni, it\\'s'),(3,'Linux\xe5\x86\x85\xe6\xa0\xb8');\n")
+    eq_(wpi_rowfilter.filter_insert(STMT.decode('utf8'), resolved),
+        "INSERT INTO `pagelinks` (`pl_from`,`pl_title`) VALUES "
+        "(1,'Ni, it\\'s'),(3,'Linux内核');\n")
+
+    resolved = wpi_rowfilter.resolve(row_filter._replace(columns=None),
+                                     SCHEMA)
+    eq_(wpi_rowfilter.filter_insert(STMT, resolved),
+        b"INSERT INTO `pagelinks` VALUES (1,0,'Ni, it\\'s'),"
+        b"(3,14,'Linux\xe5\x86\x85\xe6\xa0\xb8');\n")
+    eq_(wpi_rowfilter.filter_insert(
+        b"INSERT INTO `pagelinks` VALUES (2,4,'Ni');\n", resolved), None)
+
+
+def test_filter_insert_undecodable():
+    resolved = wpi_rowfilter.resolve(_filters()['pagelinks'], SCHEMA)
+    stmt = wpi_rowfilter.filter_insert(
+        b"INSERT INTO `pagelinks` VALUES (1,0,'Ni'),(2,0,'\xe5'),"
+        b"(3,14,'Ekke'),(4,0,'\xe5k'),(5,0,'Ptang');\n", resolved)
+    eq_(list(wpi_utils.utf8_multirow([stmt])),
+        [b"INSERT INTO `pagelinks` (`pl_from`,`pl_title`) VALUES "
+         b"(1,'Ni'),(3,'Ekke'),(5,'Ptang');"])
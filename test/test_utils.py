@@ -21,10 +21,18 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import bz2
+import io
 import itertools
 import os
+import pickle
 import re
-from nose.tools import eq_
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from nose.tools import assert_raises, eq_
 
 import wp_import.utils as wpi_utils
 
@@ -150,12 +158,97 @@ def test_dump_info():
         dump_info = dump_infos.next()
 
         eq_(dump_info.language, lang)
-        eq_(dump_info.date, date)
+        eq_(dump_info.date, int(date))
+        eq_(dump_info.dump_date, date)
         eq_(dump_info.table, table)
         eq_(dump_info.path, os.path.join(os.path.sep, 'path', 'to',
                                             filename))
 
 
+def test_dump_info_order():
+    fn_regex = r'(?P<language>[\w_]+)wiki-(?P<date>\d{8})-(?P<table>[\w_-]+).*'
+    dump_infos = [wpi_utils.DumpInfo(os.path.join(directory, filename),
+                                     fn_regex, size=1)
+                  for (directory, filename) in [
+                      ('b', 'enwiki-20091017-langlinks.sql.gz'),
+                      ('a', 'dewiki-20091023-redirect.sql.gz'),
+                      ('c', 'dewiki-20091001-redirect.sql.gz'),
+                      ('a', 'dewiki-20091023-langlinks.sql.gz')]]
+    eq_([di.sort_key for di in sorted(dump_infos)],
+        [('de', 20091001, 'redirect',
+          os.path.join('c', 'dewiki-20091001-redirect.sql.gz')),
+         ('de', 20091023, 'langlinks',
+          os.path.join('a', 'dewiki-20091023-langlinks.sql.gz')),
+         ('de', 20091023, 'redirect',
+          os.path.join('a', 'dewiki-20091023-redirect.sql.gz')),
+         ('en', 20091017, 'langlinks',
+          os.path.join('b', 'enwiki-20091017-langlinks.sql.gz'))])
+
+    copy = pickle.loads(pickle.dumps(dump_infos[0], 2))
+    eq_(copy, dump_infos[0])
+    eq_(copy.size, 1)
+    assert_raises(AttributeError, setattr, copy, 'table', 'redirect')
+
+
+def test_dump_finder():
+    fn_regex = r'(?P<language>[\w_]+)wiki-(?P<date>\d{8})-(?P<table>[\w_-]+).*'
+    root = tempfile.mkdtemp()
+    try:
+        layout = [
+            ('dewiki', '20091001', ['langlinks', 'redirect']),
+            ('dewiki', '20091023', ['langlinks', 'redirect']),
+            ('dewiki', '20091101', ['langlinks']),
+            ('enwiki', '20091017', ['langlinks']),
+        ]
+        for (wiki, date, tables) in layout:
+            os.makedirs(os.path.join(root, wiki, date))
+            for table in tables:
+                open(os.path.join(root, wiki, date, '{0}-{1}-{2}.sql.gz'.format(
+                    wiki, date, table)), 'w').close()
+        open(os.path.join(root, 'dewiki', '20091023', 'md5sums.txt'),
+             'w').close()
+
+        def path(wiki, date, table):
+            return os.path.join(root, wiki, date, '{0}-{1}-{2}.sql.gz'.format(
+                wiki, date, table))
+
+        # everything
+        cache_path = os.path.join(root, 'cache.json')
+        finder = wpi_utils.DumpFinder(fn_regex, cache_path=cache_path)
+        found = finder.find(root)
+        eq_(found, sorted(path(wiki, date, table)
+                          for (wiki, date, tables) in layout
+                          for table in tables))
+
+        # from the cache
+        finder = wpi_utils.DumpFinder(fn_regex, cache_path=cache_path)
+        eq_(finder.find(root), found)
+
+        # disabled languages are pruned
+        prune = wpi_utils.language_pruner(['de'], ['de', 'en'])
+        finder = wpi_utils.DumpFinder(fn_regex, prune=prune)
+        eq_([os.path.basename(p) for p in finder.find(root)],
+            ['dewiki-20091001-langlinks.sql.gz',
+             'dewiki-20091001-redirect.sql.gz',
+             'dewiki-20091023-langlinks.sql.gz',
+             'dewiki-20091023-redirect.sql.gz',
+             'dewiki-20091101-langlinks.sql.gz'])
+
+        # 20091101 is incomplete, 20091001 is not searched
+        finder = wpi_utils.DumpFinder(fn_regex, prune=prune, latest=True)
+        found = finder.find(root)
+        eq_([os.path.basename(p) for p in found],
+            ['dewiki-20091023-langlinks.sql.gz',
+             'dewiki-20091023-redirect.sql.gz',
+             'dewiki-20091101-langlinks.sql.gz'])
+        eq_([di.path for di in wpi_utils.latest_dumps(
+            wpi_utils.dump_info(found, fn_regex))],
+            [path('dewiki', '20091023', 'langlinks'),
+             path('dewiki', '20091023', 'redirect')])
+    finally:
+        shutil.rmtree(root)
+
+
 def test_filter_strings():
     eq_(wpi_utils.filter_strings(
         '^INSERT', ["INSERT INTO `witch` VALUES ('使用者')",
@@ -189,6 +282,162 @@ def test_convert_multirow_to_unicode():
         '''INSERT INTO "witch" VALUES ('å',23);''')
 
 
+def test_decode_multirow():
+    mul_row = (b"INSERT INTO `witch` VALUES ('\xe5 ),(',1),('\xc3\xa5',2),"
+               b"('it\\'s ),( \xe5',3),('ni',4),('\xe5',5);\n")
+    with tempfile.NamedTemporaryFile() as tmp_f:
+        wpi_utils.set_reject_file(tmp_f.name)
+        try:
+            eq_(wpi_utils.decode_multirow(mul_row),
+                "INSERT INTO `witch` VALUES ('\xe5',2),('ni',4);")
+            eq_(wpi_utils.decode_multirow(mul_row, error_offset=29),
+                "INSERT INTO `witch` VALUES ('\xe5',2),('ni',4);")
+        finally:
+            wpi_utils.set_reject_file(None)
+        eq_(tmp_f.read().splitlines()[:3],
+            [b"witch\t('\xe5 ),(',1)", b"witch\t('it\\'s ),( \xe5',3)",
+             b"witch\t('\xe5',5)"])
+    eq_(wpi_utils.decode_multirow(b"INSERT INTO `witch` VALUES ('\xe5',1);"),
+        None)
+
+
 def test_single_row():
     mul_row = b'''INSERT INTO "witch" VALUES ('ne (wt)',23),('ni',42);'''
     eq_(list(wpi_utils.single_rows(mul_row)), ["('ne (wt)',23)", "('ni',42)"])
+    mul_row = b"INSERT INTO `witch` VALUES ('),(',23),('ni',42);"
+    eq_(list(wpi_utils.single_rows(mul_row)), ["('),(',23)", "('ni',42)"])
+
+
+def test_batches():
+    eq_(list(wpi_utils.batches(xrange(5), 2)), [[0, 1], [2, 3], [4]])
+    eq_(list(wpi_utils.batches([], 2)), [])
+
+
+def test_open_compressed():
+    file_path = os.path.join(DOWNLOAD_DIR, 'de', '20091023',
+                             'dewiki-20091023-pagelinks.sql.gz')
+    with wpi_utils.open_compressed(file_path, 'python') as python_f:
+        lines = list(python_f)
+    with wpi_utils.open_compressed(file_path, 'auto') as auto_f:
+        eq_(list(auto_f), lines)
+    eq_(lines[-1], b'-- Dump completed on 2009-09-03 13:13:58\n')
+
+    # stop reading early
+    with wpi_utils.open_compressed(file_path) as dump_f:
+        eq_(dump_f.readline(), b'-- MySQL dump 10.11\n')
+
+
+def test_stream_decompressor():
+    data = bz2.compress(b'ni\n' * 1000) + bz2.compress(b'shrubbery\n')
+    raw = io.BytesIO(data)
+    stream = io.BufferedReader(
+        wpi_utils.StreamDecompressor(raw, bz2.BZ2Decompressor, 7))
+    eq_(stream.read(), b'ni\n' * 1000 + b'shrubbery\n')
+
+    data = zlib.compress(b'newt')
+    stream = wpi_utils.StreamDecompressor(io.BytesIO(data),
+                                          zlib.decompressobj, 2)
+    eq_(stream.read(), b'newt')
+
+
+def test_multistream():
+    streams = [bz2.compress(b'<siteinfo />'), bz2.compress(b'ni' * 1000),
+               bz2.compress(b'newt'), bz2.compress(b'shrubbery')]
+    offsets = [sum(len(stream) for stream in streams[:i])
+               for i in range(1, len(streams))]
+    size = sum(len(stream) for stream in streams)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dump_path = os.path.join(tmp_dir,
+                                 'dewiki-20091023-pages-articles-'
+                                 'multistream.xml.bz2')
+        index_path = os.path.join(tmp_dir,
+                                  'dewiki-20091023-pages-articles-'
+                                  'multistream-index.txt.bz2')
+        with open(dump_path, 'wb') as dump_f:
+            dump_f.write(b''.join(streams))
+        eq_(wpi_utils.multistream_index_path(dump_path), None)
+
+        with open(index_path, 'wb') as index_f:
+            index_f.write(bz2.compress(''.join(
+                '{0}:{1}:Holy Grail\n'.format(offset, page_id)
+                for offset in offsets for page_id in (1, 2)).encode('utf8')))
+        eq_(wpi_utils.multistream_index_path(dump_path), index_path)
+        eq_(wpi_utils.multistream_offsets(index_path), offsets)
+
+        eq_(b''.join(wpi_utils.decompress_range(dump_path, 0, offsets[0])),
+            b'<siteinfo />')
+        eq_(b''.join(wpi_utils.decompress_range(dump_path, offsets[1])),
+            b'newtshrubbery')
+
+        shards = wpi_utils.multistream_shards(offsets, size, 3)
+        eq_(shards[0][0], offsets[0])
+        eq_(shards[-1][1], size)
+        eq_(b''.join(b''.join(wpi_utils.decompress_range(dump_path, *shard))
+                     for shard in shards), b'ni' * 1000 + b'newtshrubbery')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_validate_utf8():
+    wpi_utils.validate_utf8(b'\xe4\xbd\xbf\xe7\x94\xa8\xe8\x80\x85', 4)
+    wpi_utils.validate_utf8(b'')
+    try:
+        wpi_utils.validate_utf8(b"('\xc3\xa5',23),('\xe5',42)", 4)
+    except UnicodeDecodeError as unidec_err:
+        eq_(unidec_err.start, 12)
+    else:
+        raise AssertionError('UnicodeDecodeError not raised')
+
+
+def test_utf8_multirow():
+    mul_row = [b"INSERT INTO `witch` VALUES ('\xc3\xa5',23),('\xe5',42);",
+               b"INSERT INTO `witch` VALUES ('\xc3\xa5',23);"]
+    eq_(list(wpi_utils.utf8_multirow(mul_row)),
+        [b"INSERT INTO `witch` VALUES ('\xc3\xa5',23);",
+         b"INSERT INTO `witch` VALUES ('\xc3\xa5',23);"])
+
+
+def test_buffered():
+    eq_(list(wpi_utils.buffered(xrange(10000), 2, 100, 10, lambda el: 1)),
+        range(10000))
+
+    def failing():
+        yield b'x'
+        raise ValueError('broken dump')
+
+    assert_raises(ValueError, list, wpi_utils.buffered(failing(),
+                                                        batch_bytes=1))
+
+    # the producer is closed if the consumer stops early
+    closed = []
+
+    def endless():
+        try:
+            while True:
+                yield b'x' * 10
+        finally:
+            closed.append(True)
+
+    seq = wpi_utils.buffered(endless(), 2, 100, 10)
+    eq_(next(seq), b'x' * 10)
+    seq.close()
+    eq_(closed, [True])
+
+
+def test_bounded_queue():
+    queue = wpi_utils.BoundedQueue(max_entries=3, max_bytes=10)
+    producer = threading.Thread(
+        target=lambda: [queue.put(el, 4) for el in range(6)])
+    producer.start()
+    time.sleep(0.1)
+    # the third entry exceeds max_bytes
+    eq_((len(queue), queue.size), (2, 8))
+    eq_([queue.get() for el in range(6)], range(6))
+    producer.join()
+
+    # entries larger than max_bytes are accepted by an empty queue
+    assert queue.put('large', 11)
+    queue.close()
+    assert not queue.put('discarded', 1)
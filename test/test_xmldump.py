@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+
+# © Copyright 2009 Wolodja Wentland. All Rights Reserved.
+
+# This file is part of wp-import.
+#
+# wp-import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# wp-import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with wp-import. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for wp_import.xmldump
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+
+from nose.tools import eq_
+
+import wp_import.xmldump as wpi_xml
+
+PAGES_ARTICLES = """\
+<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.4/" version="0.4">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <namespaces>
+      <namespace key="0" />
+      <namespace key="2">User</namespace>
+    </namespaces>
+  </siteinfo>
+  <page>
+    <title>User:King Arthur</title>
+    <id>7</id>
+    <revision>
+      <id>42</id>
+      <timestamp>2008-02-18T13:57:52Z</timestamp>
+      <contributor>
+        <ip>10.0.0.1</ip>
+      </contributor>
+      <minor />
+      <text xml:space="preserve">Ni!\tP/NP問題</text>
+    </revision>
+  </page>
+  <page>
+    <title>Holy Grail</title>
+    <id>8</id>
+    <redirect />
+    <revision>
+      <id>43</id>
+      <timestamp>2008-02-18T13:57:53Z</timestamp>
+      <contributor>
+        <username>Brian</username>
+        <id>23</id>
+      </contributor>
+      <comment>shrubbery</comment>
+      <text xml:space="preserve">#REDIRECT [[Grail]]</text>
+    </revision>
+    <revision>
+      <id>44</id>
+      <timestamp>2008-02-18T13:57:54Z</timestamp>
+      <contributor deleted="deleted" />
+      <text xml:space="preserve" />
+    </revision>
+  </page>
+</mediawiki>
+""".encode('utf8')
+
+
+def test_table_rows():
+    rows = list(wpi_xml.table_rows(io.BytesIO(PAGES_ARTICLES)))
+    eq_([table for (table, row) in rows],
+        ['revision', 'text', 'page', 'revision', 'text', 'revision', 'text',
+         'page'])
+
+    eq_(rows[0], ('revision', ('42', '7', '42', '', '0', '10.0.0.1',
+                               '2008-02-18T13:57:52Z', '1', '0', '14',
+                               None)))
+    eq_(rows[1], ('text', ('42', 'Ni!\tP/NP問題', 'utf-8')))
+    eq_(rows[3][1][3:8], ('shrubbery', '23', 'Brian', '2008-02-18T13:57:53Z',
+                          '0'))
+    eq_(rows[5][1][4:6], ('0', ''))
+    eq_(rows[5][1][8], '4')
+
+    page = rows[2][1]
+    eq_(page[:7], ('7', '2', 'King_Arthur', '', '0', '0', '1'))
+    eq_(page[8:], ('2008-02-18T13:57:52Z', '42', '14'))
+    page = rows[7][1]
+    eq_(page[:7], ('8', '0', 'Holy_Grail', '', '0', '1', '0'))
+    eq_(page[8:], ('2008-02-18T13:57:54Z', '44', '0'))
+
+    for (table, row) in rows:
+        eq_(len(row), len(wpi_xml.COLUMNS[table]))
+
+
+def test_fragment_rows():
+    (header, _, pages) = PAGES_ARTICLES.partition(b'</siteinfo>')
+    namespaces = wpi_xml.site_namespaces(io.BytesIO(header + b'</siteinfo>'))
+    eq_(namespaces, {'User': '2'})
+
+    # split the footer across chunks
+    chunks = [pages[:-8], pages[-8:]]
+    eq_([row[:3] for (table, row) in wpi_xml.fragment_rows(chunks, namespaces)
+         if table == 'page'],
+        [('7', '2', 'King_Arthur'), ('8', '0', 'Holy_Grail')])